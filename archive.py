@@ -0,0 +1,182 @@
+import os
+import sys
+import gzip
+import json
+import shutil
+import sqlite3
+import logging
+import argparse
+from pathlib import Path
+from contextlib import closing
+from wsgiref.simple_server import make_server
+
+logging.basicConfig(level=logging.INFO)
+
+# Pack a cycle's tile directories into one SQLite file, so that moving a cycle
+# means one sequential file instead of zipping, copying and unzipping every
+# {z}/{x}/{y}.pbf. This is this repo's own format, not MBTiles: the tables
+# borrow MBTiles' column names and TMS rows, but every cycle holds many tile
+# sets, so both tables have a layer column (the tile directory relative to the
+# cycle, e.g. gc_gfs/gc_t2_tiles) and MBTiles readers and tile servers can't
+# open the file. Read it with read_tile or `archive.py get`, and serve it at the
+# old tile URLs with tile_app (`archive.py serve`). Archives are named
+# <cycle>.tiles.sqlite. Tiles are stored as they are, or gzipped with --gzip
+# like tippecanoe does without --no-tile-compression.
+
+SCHEMA = """
+CREATE TABLE metadata (layer TEXT, name TEXT, value TEXT);
+CREATE TABLE tiles (layer TEXT, zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+CREATE UNIQUE INDEX tile_index ON tiles (layer, zoom_level, tile_column, tile_row);
+CREATE UNIQUE INDEX metadata_index ON metadata (layer, name);
+"""
+
+# Tile directories of a cycle: <cycle_dir>/<model>_<init_cond>/<name>_tiles
+def tile_dirs(cycle_dir):
+    return sorted(path for path in Path(cycle_dir).glob("*/*_tiles") if path.is_dir())
+
+# (layer, z, x, TMS row, path) for every tile of a tile directory
+def tile_rows(cycle_dir, tiledir):
+    layer = tiledir.relative_to(cycle_dir).as_posix()
+    for path in tiledir.glob("*/*/*.pbf"):
+        z, x, y = int(path.parent.parent.name), int(path.parent.name), int(path.stem)
+        yield layer, z, x, (1 << z) - 1 - y, path
+
+def pack(cycle_dir, archivefile, compress=False):
+    cycle_dir = Path(cycle_dir)
+    # Written under another name and renamed once complete, like grib2nc.py
+    partfile = f"{archivefile}.part"
+    if os.path.exists(partfile):
+        os.remove(partfile)
+    db = sqlite3.connect(partfile)
+    db.executescript(SCHEMA)
+    db.executemany("INSERT INTO metadata VALUES ('', ?, ?)",
+                   [("name", cycle_dir.name), ("format", "pbf"), ("compression", "gzip" if compress else "none")])
+    ntiles = 0
+    for tiledir in tile_dirs(cycle_dir):
+        rows = []
+        for layer, z, x, row, path in tile_rows(cycle_dir, tiledir):
+            data = path.read_bytes()
+            rows.append((layer, z, x, row, gzip.compress(data, compresslevel=6, mtime=0) if compress else data))
+        db.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?, ?)", rows)
+        ntiles += len(rows)
+        if (tiledir / "metadata.json").exists():
+            metadata = json.loads((tiledir / "metadata.json").read_text())
+            db.executemany("INSERT INTO metadata VALUES (?, ?, ?)",
+                           [(tiledir.relative_to(cycle_dir).as_posix(), name, str(value)) for name, value in metadata.items()])
+    db.commit()
+    db.close()
+    os.replace(partfile, archivefile)
+    return ntiles
+
+def open_archive(archivefile):
+    return sqlite3.connect(f"file:{archivefile}?mode=ro", uri=True)
+
+# The tile at z/x/y (XYZ, as in the directory layout) of a layer as stored
+# (gzipped with --gzip), or None if the layer has no tile there
+def stored_tile(db, layer, z, x, y):
+    row = db.execute("SELECT tile_data FROM tiles WHERE layer = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                     (layer, z, x, (1 << z) - 1 - y)).fetchone()
+    return None if row is None else row[0]
+
+def gzipped(data):
+    return data[:2] == b"\x1f\x8b"
+
+# The same tile decompressed
+def read_tile(db, layer, z, x, y):
+    data = stored_tile(db, layer, z, x, y)
+    return gzip.decompress(data) if data is not None and gzipped(data) else data
+
+# A layer's metadata.json entries, empty if it had none
+def read_metadata(db, layer):
+    return dict(db.execute("SELECT name, value FROM metadata WHERE layer = ?", (layer,)).fetchall())
+
+# Compare every tile file of the cycle with the archive's copy. Returns the
+# paths that are missing or differ.
+def verify(cycle_dir, archivefile):
+    cycle_dir = Path(cycle_dir)
+    db = open_archive(archivefile)
+    bad = []
+    for tiledir in tile_dirs(cycle_dir):
+        for layer, z, x, row, path in tile_rows(cycle_dir, tiledir):
+            if read_tile(db, layer, z, x, (1 << z) - 1 - row) != path.read_bytes():
+                bad.append(str(path))
+    db.close()
+    return bad
+
+# (status, headers, body) for a path of the unzipped cycle layout:
+# /<cycle>/<layer>/<z>/<x>/<y>.pbf or /<cycle>/<layer>/metadata.json, read
+# from <directory>/<cycle>.tiles.sqlite
+def respond(directory, path):
+    not_found = ("404 Not Found", [("Content-Type", "text/plain")], b"Not found\n")
+    parts = path.strip("/").split("/")
+    archivefile = Path(directory) / f"{parts[0]}.tiles.sqlite"
+    if len(parts) < 3 or not archivefile.is_file():
+        return not_found
+    with closing(open_archive(archivefile)) as db:
+        if parts[-1] == "metadata.json":
+            metadata = read_metadata(db, "/".join(parts[1:-1]))
+            if not metadata:
+                return not_found
+            return "200 OK", [("Content-Type", "application/json")], json.dumps(metadata, indent=4).encode()
+        if len(parts) < 5 or not parts[-1].endswith(".pbf"):
+            return not_found
+        try:
+            z, x, y = int(parts[-3]), int(parts[-2]), int(parts[-1].removesuffix(".pbf"))
+        except ValueError:
+            return not_found
+        data = stored_tile(db, "/".join(parts[1:-3]), z, x, y)
+    if data is None:
+        return not_found
+    headers = [("Content-Type", "application/x-protobuf")]
+    if gzipped(data):
+        headers.append(("Content-Encoding", "gzip"))
+    return "200 OK", headers, data
+
+# A WSGI app serving the archives in directory at the URLs the unzipped tile
+# directories had, gzipped tiles as stored with Content-Encoding: gzip
+def tile_app(directory):
+    def app(environ, start_response):
+        status, headers, body = respond(directory, environ.get("PATH_INFO", ""))
+        start_response(status, headers + [("Content-Length", str(len(body)))])
+        return [body]
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack a cycle's vector tiles into one archive, or read a tile back")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_parser = commands.add_parser("pack", help="pack <cycle_dir>/*/*_tiles into ARCHIVE")
+    pack_parser.add_argument("cycle_dir", help="<geojson_path>/<YYYYMMDD_HH>")
+    pack_parser.add_argument("archive")
+    pack_parser.add_argument("--gzip", action="store_true", help="gzip each tile")
+    pack_parser.add_argument("--remove", action="store_true",
+                             help="check every tile against the archive, then delete the tile directories")
+    get_parser = commands.add_parser("get", help="write one tile to stdout")
+    get_parser.add_argument("archive")
+    get_parser.add_argument("layer", help="tile directory relative to the cycle, e.g. gc_gfs/gc_t2_tiles")
+    for name in ["z", "x", "y"]:
+        get_parser.add_argument(name, type=int)
+    serve_parser = commands.add_parser("serve", help="serve the archives in a directory at the old tile URLs")
+    serve_parser.add_argument("directory", help="directory of <cycle>.tiles.sqlite archives")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        logging.info(f"Serving {args.directory} on http://{args.host}:{args.port}/<cycle>/<layer>/<z>/<x>/<y>.pbf")
+        make_server(args.host, args.port, tile_app(args.directory)).serve_forever()
+    elif args.command == "get":
+        tile = read_tile(open_archive(args.archive), args.layer, args.z, args.x, args.y)
+        if tile is None:
+            logging.error(f"No tile {args.layer}/{args.z}/{args.x}/{args.y}")
+            sys.exit(1)
+        sys.stdout.buffer.write(tile)
+    else:
+        ntiles = pack(args.cycle_dir, args.archive, args.gzip)
+        logging.info(f"Packed {ntiles} tiles into {args.archive} ({os.path.getsize(args.archive) / 1e6:.1f} MB)")
+        if args.remove:
+            bad = verify(args.cycle_dir, args.archive)
+            if bad:
+                logging.error(f"{len(bad)} tiles differ from the archive, keeping the tile directories: {' '.join(bad[:10])}")
+                sys.exit(1)
+            for tiledir in tile_dirs(args.cycle_dir):
+                shutil.rmtree(tiledir)
@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import xarray as xr
+from netCDF4 import Dataset as DS
+from ncwriter import ChunkWriter, codec_options
+from synthetic_grib import synthetic_field
+from bench_codecs import pack16
+import contouring
+
+# Time reading apcptotal, the precipitation total since initialization, for
+# every step of a 41-step run: a task per step summing every step up to its own
+# with read_field (861 reads of apcp), against the single task keeping a
+# running total (contouring.apcp_totals, 41 reads). Each runs in its own
+# process, like a pool worker, and reports its peak RSS. The run is synthetic
+# apcp (or --file).
+
+STEPS = 41
+
+def write_run(path, workers):
+    f = DS(path, 'w', format='NETCDF4')
+    f.createDimension('time', STEPS)
+    f.createDimension('latitude', 721)
+    f.createDimension('longitude', 1440)
+    f.createVariable('time', 'i4', ('time',))[:] = 1704067200 + 21600 * np.arange(STEPS)
+    f.createVariable('latitude', 'f4', ('latitude',))[:] = np.linspace(90, -90, 721)
+    f.createVariable('longitude', 'f4', ('longitude',))[:] = np.arange(0, 360, 0.25)
+    f.createVariable('apcp', 'f4', ('time', 'latitude', 'longitude'), chunksizes=(1, 721, 1440), **codec_options())
+    f.close()
+
+    rng = np.random.default_rng(0)
+    writer = ChunkWriter(path, workers)
+    for step in range(STEPS):
+        writer.write('apcp', (step,), pack16(synthetic_field('tp', 0, step * 6, rng)))
+    writer.close()
+
+def per_step(ds):
+    for step in range(STEPS):
+        yield step, contouring.read_field(ds, 'gc', 'apcptotal', step)
+
+def running_total(ds):
+    contouring.model = 'gc'
+    return contouring.apcp_totals(ds, range(STEPS))
+
+READERS = {'per step': per_step, 'running total': running_total}
+
+# Run in a fresh process: every step in turn, printing the seconds, peak RSS
+# and a checksum of the totals
+def worker(path, reader):
+    with xr.open_dataset(path) as ds:
+        start = time.perf_counter()
+        checksum = sum(float(total.astype('f8').sum()) for step, total in READERS[reader](ds))
+        seconds = time.perf_counter() - start
+    print(json.dumps({"seconds": seconds, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                      "checksum": checksum}))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time reading apcptotal for every step, per step against a running total")
+    parser.add_argument("--file", help="model NetCDF with apcp (default: a synthetic 41-step run)")
+    parser.add_argument("--workers", type=int, default=4, help="compression threads for writing")
+    parser.add_argument("--worker", nargs=2, metavar=("FILE", "READER"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as outdir:
+        path = args.file or os.path.join(outdir, "run.nc")
+        if not args.file:
+            write_run(path, args.workers)
+        results = {}
+        for reader in READERS:
+            # Judged by its output: some builds crash at exit with h5py and
+            # netCDF4 loaded in one process
+            result = subprocess.run([sys.executable, __file__, "--worker", path, reader], capture_output=True, text=True)
+            if not result.stdout.strip():
+                sys.exit(result.stderr)
+            results[reader] = json.loads(result.stdout.splitlines()[-1])
+    print(f"apcptotal for all {STEPS} steps, one worker process each")
+    print("| read | reads | time s | worker peak RSS MB |")
+    print("|---|---|---|---|")
+    for reader, reads in [('per step', STEPS * (STEPS + 1) // 2), ('running total', STEPS)]:
+        print(f"| {reader} | {reads} | {results[reader]['seconds']:.2f} | {results[reader]['max_rss_mb']:.0f} |")
+    print(f"identical: {results['per step']['checksum'] == results['running total']['checksum']}")
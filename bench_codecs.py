@@ -0,0 +1,84 @@
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from netCDF4 import Dataset as DS
+from ncwriter import ChunkWriter, codec_options, codec_available
+from synthetic_grib import synthetic_field
+
+# (codec, complevel, shuffle) combinations compared by default
+CONFIGS = [
+    ('none', 0, False),
+    ('zlib', 1, True),
+    ('zlib', 4, False),
+    ('zlib', 4, True),
+    ('zlib', 6, True),
+    ('zstd', 1, True),
+    ('zstd', 4, True),
+    ('blosc_lz4', 5, True),
+    ('blosc_zstd', 3, True),
+]
+
+# Fields written per configuration: (shortName, level)
+FIELDS = [('t', 500), ('z', 500), ('q', 850), ('u', 250), ('v', 850), ('w', 700),
+          ('2t', 0), ('msl', 0), ('tcwv', 0), ('tp', 0)]
+
+# Emulate the 16-bit simple packing of the model GRIB output so the floats
+# carry the same number of significant bits as fields decoded by grib2nc
+def pack16(values):
+    ref = values.min()
+    scale = (values.max() - ref) / 65535 or 1
+    return (ref + np.round((values - ref) / scale) * scale).astype('f4')
+
+def bench(fields, codec, complevel, shuffle, workers, outdir):
+    path = os.path.join(outdir, f"{codec}_{complevel}_{int(shuffle)}.nc")
+    f = DS(path, 'w', format='NETCDF4')
+    if not codec_available(f, codec):
+        f.close()
+        return None
+    f.createDimension('time', len(fields))
+    f.createDimension('latitude', 721)
+    f.createDimension('longitude', 1440)
+    f.createVariable('field', 'f4', ('time', 'latitude', 'longitude'), chunksizes=(1, 721, 1440),
+                     **codec_options(codec, complevel, shuffle))
+    f.close()
+
+    start = time.perf_counter()
+    writer = ChunkWriter(path, workers)
+    for i, values in enumerate(fields):
+        writer.write('field', (i,), values)
+    writer.close()
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with DS(path) as f:
+        for i in range(len(fields)):
+            f.variables['field'][i]
+    read_time = time.perf_counter() - start
+
+    raw = sum(values.nbytes for values in fields)
+    size = os.path.getsize(path)
+    return raw / size, raw / write_time / 2**20, raw / read_time / 2**20, size
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare NetCDF codecs on synthetic 0.25 degree fields")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 4],
+                        help="compression thread counts to compare")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    fields = [pack16(synthetic_field(shortName, level, 6, rng)) for shortName, level in FIELDS]
+
+    print("| codec | level | shuffle | workers | ratio | write MB/s | read MB/s | size MB |")
+    print("|---|---|---|---|---|---|---|---|")
+    with tempfile.TemporaryDirectory() as outdir:
+        for codec, complevel, shuffle in CONFIGS:
+            for workers in args.workers:
+                result = bench(fields, codec, complevel, shuffle, workers, outdir)
+                if result is None:
+                    print(f"| {codec} | {complevel} | {shuffle} | {workers} | unavailable | | | |")
+                    continue
+                ratio, write_rate, read_rate, size = result
+                print(f"| {codec} | {complevel} | {shuffle} | {workers} | {ratio:.2f} | "
+                      f"{write_rate:.0f} | {read_rate:.0f} | {size / 2**20:.1f} |")
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import xarray as xr
+import contouring
+
+# First difference between two contour FeatureCollections, or None if the
+# files are identical
+def difference(file_a, file_b):
+    with open(file_a, 'rb') as f, open(file_b, 'rb') as g:
+        text_a, text_b = f.read(), g.read()
+    if text_a == text_b:
+        return None
+    a, b = json.loads(text_a)['features'], json.loads(text_b)['features']
+    titles_a = [feature['properties']['title'] for feature in a]
+    titles_b = [feature['properties']['title'] for feature in b]
+    if titles_a != titles_b:
+        only = sorted(set(titles_a) ^ set(titles_b))
+        return f"{len(a)} vs {len(b)} features, {len(only)} bands in one only (e.g. {only[0].strip()})"
+    for feature_a, feature_b in zip(a, b):
+        title = feature_a['properties']['title'].strip()
+        if feature_a['properties'] != feature_b['properties']:
+            return f"band {title}: properties differ"
+        polygons_a, polygons_b = feature_a['geometry']['coordinates'], feature_b['geometry']['coordinates']
+        if len(polygons_a) != len(polygons_b):
+            return f"band {title}: {len(polygons_a)} vs {len(polygons_b)} polygons"
+        for i, (polygon_a, polygon_b) in enumerate(zip(polygons_a, polygons_b)):
+            if polygon_a != polygon_b:
+                return (f"band {title}, polygon {i}: {len(polygon_a)} vs {len(polygon_b)} rings, "
+                        f"{sum(map(len, polygon_a))} vs {sum(map(len, polygon_b))} points")
+    return "formatting only"
+
+# Time the matplotlib + geojsoncontour path against the contourpy backend on
+# every contoured field of one step and report how the files differ. Returns
+# the number of fields that differ.
+def bench(model_file, model, step, variables, outdir):
+    contouring.model = model
+    contouring.lons, contouring.lons_extended, contouring.lats = contouring.prepare_lons_lats(model)
+    totals = {'matplotlib': 0., 'contourpy': 0.}
+    fields = differing = 0
+    print("| field | matplotlib s | contourpy s | speedup | difference |")
+    print("|---|---|---|---|---|")
+    with xr.open_dataset(model_file) as ds:
+        for var in variables:
+            if not contouring.has_variable(ds, model, var):
+                continue
+            for lev in contouring.LEVELS if contouring.myvars[var]["type"]=="pl" else [None]:
+                settings = contouring.myvars[var][lev or 'sfc']
+                varlev = var + str(lev) if lev else var
+                field = contouring.prepare_field(var, contouring.read_field(ds, model, var, step, lev),
+                                                 settings['filter'])
+                times = {}
+                for backend in totals:
+                    contouring.backend = backend
+                    start = time.perf_counter()
+                    contouring.contour(varlev, field, settings['contourlevels'], settings['colormap'],
+                                       settings['extend'], os.path.join(outdir, f"{backend}.geojson"))
+                    times[backend] = time.perf_counter() - start
+                    totals[backend] += times[backend]
+                diff = difference(os.path.join(outdir, "matplotlib.geojson"), os.path.join(outdir, "contourpy.geojson"))
+                fields += 1
+                differing += diff is not None
+                print(f"| {varlev} | {times['matplotlib']:.2f} | {times['contourpy']:.2f} | "
+                      f"{times['matplotlib'] / times['contourpy']:.1f}x | {diff or 'identical'} |")
+    print(f"| total | {totals['matplotlib']:.1f} | {totals['contourpy']:.1f} | "
+          f"{totals['matplotlib'] / totals['contourpy']:.1f}x | {fields - differing} of {fields} identical |")
+    return differing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare contouring backends field by field")
+    parser.add_argument("model_file")
+    parser.add_argument("model", help="model name as passed to contouring.py (e.g. gc)")
+    parser.add_argument("--step", type=int, default=1)
+    parser.add_argument("--vars", nargs="+", default=list(contouring.myvars))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as outdir:
+        differing = bench(args.model_file, args.model, args.step, args.vars, outdir)
+    sys.exit(1 if differing else 0)
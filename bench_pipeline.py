@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess as sp
+from pathlib import Path
+
+# Benchmark grib2nc.py, contouring.py and winds.py end to end on synthetic
+# 0.25 degree data, without a GPU, live initial conditions or the NAS. The
+# fixtures are a GRIB written by synthetic_grib.py (the model's shortNames
+# and levels, --steps steps) and the NetCDF grib2nc.py makes from it. Each
+# script runs as its own process at each worker count and reports wall time,
+# throughput and peak memory. Results go to a JSON file that --compare checks
+# against an earlier one, e.g. from the previous revision.
+
+HERE = Path(__file__).resolve().parent
+MB = 1 << 20
+
+# Resident memory (bytes) of a process and all its descendants
+def tree_rss(pid):
+    children = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        pending += children.get(current, [])
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            pass
+    return total
+
+# Run a command, sampling the memory of its process tree. Returns wall
+# seconds, exit code, the peak RSS of its largest single process and the peak
+# summed RSS of the tree (pool workers included), both in MB.
+def measure(command, interval=0.1):
+    start = time.perf_counter()
+    proc = sp.Popen(command, stdout=sp.DEVNULL, stderr=sp.PIPE, text=True)
+    peak = [0]
+    done = threading.Event()
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], tree_rss(proc.pid))
+            done.wait(interval)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    stderr = proc.stderr.read()
+    # On Linux the maxrss wait4 reports also covers the descendants the
+    # process waited for, i.e. it is the largest single process of the tree
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        print(stderr[-2000:], file=sys.stderr)
+    return wall, proc.returncode, usage.ru_maxrss / 1024, peak[0] / MB
+
+def fixtures(workdir, steps, python):
+    grib = workdir / f"synthetic_{steps}.grib"
+    if not grib.exists():
+        print(f"Writing {grib}", file=sys.stderr)
+        sp.run([python, HERE / "synthetic_grib.py", f"{grib}.part", "--steps", str(steps)], check=True)
+        os.replace(f"{grib}.part", grib)
+    if not Path(f"{grib}.nc").exists():
+        print(f"Converting {grib}", file=sys.stderr)
+        sp.run([python, HERE / "grib2nc.py", grib, "GFS", "graphcast", "20240101", "0000"], check=True)
+    return grib, Path(f"{grib}.nc")
+
+# GeoJSON files and tile directories a run wrote (not the placeholders for
+# missing variables)
+def count_outputs(outdir):
+    return sum(1 for path in Path(outdir).glob("*/*/*") if path.name.endswith((".geojson.simple", "_tiles")))
+
+def bench(args):
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    grib, nc = fixtures(workdir, args.steps, args.python)
+    nmessages = int(sp.run([args.python, "-c", f"import gribindex; print(len(gribindex.build_index('{grib}')[0]))"],
+                           cwd=HERE, capture_output=True, text=True, check=True).stdout)
+    results = []
+    for script in args.scripts:
+        for workers in args.workers:
+            run_dir = workdir / f"run_{script}_{workers}"
+            sp.run(["rm", "-rf", run_dir], check=True)
+            run_dir.mkdir()
+            if script == "grib2nc":
+                # Converts a link to the fixture, so the output lands in run_dir
+                (run_dir / grib.name).symlink_to(grib)
+                command = [args.python, HERE / "grib2nc.py", run_dir / grib.name, "GFS", "graphcast", "20240101", "0000",
+                           "--decode-workers", str(workers), "--compress-workers", str(max(workers, 1))]
+            else:
+                command = [args.python_contours, HERE / f"{'contouring' if script == 'contour' else 'winds'}.py",
+                           "2024", "01", "01", "00", "gc", "gfs", nc, run_dir, "--workers", str(workers), "--steps", str(args.steps)]
+            print(f"{script} with {workers} workers", file=sys.stderr)
+            wall, code, rss, tree = measure([str(part) for part in command])
+            result = {"script": script, "workers": workers, "wall_s": round(wall, 2), "exit": code,
+                      "peak_process_rss_mb": round(rss, 1), "peak_tree_rss_mb": round(tree, 1)}
+            if script == "grib2nc":
+                result.update(messages=nmessages, messages_per_s=round(nmessages / wall, 2),
+                              mb_per_s=round(grib.stat().st_size / MB / wall, 1))
+            else:
+                outputs = count_outputs(run_dir)
+                result.update(outputs=outputs, outputs_per_s=round(outputs / wall, 2))
+            result["steps_per_s"] = round(args.steps / wall, 3)
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+            if not args.keep:
+                sp.run(["rm", "-rf", run_dir], check=True)
+    return results
+
+def revision():
+    head = sp.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    dirty = sp.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    return f"{head}{'-dirty' if dirty else ''}"
+
+# Print the change in wall time and memory against an earlier results file.
+# Returns the runs that got slower by more than `threshold` (a fraction).
+def compare(report, baseline, threshold):
+    before = {(result["script"], result["workers"]): result for result in baseline["results"]}
+    print(f"| script | workers | wall s ({baseline['revision']}) | wall s ({report['revision']}) | change | tree RSS MB | change |")
+    print("|---|---|---|---|---|---|---|")
+    slower = []
+    for result in report["results"]:
+        old = before.get((result["script"], result["workers"]))
+        if old is None:
+            continue
+        change = result["wall_s"] / old["wall_s"] - 1
+        memory = result["peak_tree_rss_mb"] / old["peak_tree_rss_mb"] - 1
+        print(f"| {result['script']} | {result['workers']} | {old['wall_s']} | {result['wall_s']} | {change:+.0%} | "
+              f"{result['peak_tree_rss_mb']} | {memory:+.0%} |")
+        if change > threshold:
+            slower.append(f"{result['script']}/{result['workers']}")
+    return slower
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark grib2nc.py, contouring.py and winds.py on synthetic data")
+    parser.add_argument("--workdir", default="bench_data", help="fixtures are cached here between runs")
+    parser.add_argument("--steps", type=int, default=3, help="forecast steps in the fixtures (41 for a full run)")
+    parser.add_argument("--scripts", nargs="+", choices=["grib2nc", "contour", "winds"], default=["grib2nc", "contour", "winds"])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 4], help="worker counts to run each script with")
+    parser.add_argument("--python", default=sys.executable, help="python with pygrib/eccodes (grib2nc.py, fixtures)")
+    parser.add_argument("--python-contours", default=sys.executable, help="python for contouring.py and winds.py")
+    parser.add_argument("--output", help="write the results as JSON here")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression (fraction)")
+    parser.add_argument("--keep", action="store_true", help="keep each run's output")
+    args = parser.parse_args()
+
+    report = {"revision": revision(), "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+              "host": socket.gethostname(), "cpus": os.cpu_count(), "steps": args.steps, "results": bench(args)}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    failed = [f"{result['script']}/{result['workers']}" for result in report["results"] if result["exit"]]
+    if failed:
+        print(f"Failed: {' '.join(failed)}", file=sys.stderr)
+    slower = []
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(report, json.load(f), args.threshold)
+        if slower:
+            print(f"Slower by more than {args.threshold:.0%}: {' '.join(slower)}", file=sys.stderr)
+    if failed or slower:
+        sys.exit(1)
@@ -0,0 +1,77 @@
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import xarray as xr
+from scipy.ndimage import gaussian_filter
+import contouring
+
+# Field preparation as contouring.py did it before prepare_field: a smoothed
+# copy, a flipped view and a float64 array for the wrap column
+def prepare_field_float64(var, variabledata, sigma):
+    variabledata = contouring.convert_units(var, variabledata.copy())
+    variabledata = gaussian_filter(variabledata,sigma=sigma,mode='wrap')
+    variabledata = np.flipud(variabledata)
+
+    variabledata_extended = np.zeros((721,1441))
+    variabledata_extended[:,:-1] = variabledata
+    variabledata_extended[:,-1] = variabledata[:,0]
+    return variabledata_extended
+
+# prepare_field as run_field calls it, into the worker's reused buffer. The
+# field is copied first since units are converted in place.
+def prepare_field_buffered(var, variabledata, sigma):
+    return contouring.prepare_field(var, variabledata.copy(), sigma,
+                                    out=contouring.buffer('prepared', (721, 1441)))
+
+# Both paths prepare every field of the step one at a time, as the contour
+# tasks do, and drop it
+def prepare_all(prepare, fields):
+    for var, data, sigma in fields:
+        prepare(var, data, sigma)
+
+# Best time over a few repeats, and the peak traced allocation (MB) of one
+# pass starting without buffers, so the buffer a worker allocates for its
+# first field counts
+def measure(func, *args, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    contouring.buffers.clear()
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return best, peak
+
+def bench(model_file, model, step):
+    contouring.model = model
+    fields = []
+    with xr.open_dataset(model_file) as ds:
+        for var, settings in contouring.myvars.items():
+            if not contouring.has_variable(ds, model, var):
+                continue
+            for lev in contouring.LEVELS if settings["type"]=="pl" else [None]:
+                fields.append((var, contouring.read_field(ds, model, var, step, lev), settings[lev or 'sfc']['filter']))
+
+    old_time, old_peak = measure(prepare_all, prepare_field_float64, fields)
+    new_time, new_peak = measure(prepare_all, prepare_field_buffered, fields)
+    identical = all(np.array_equal(prepare_field_float64(var, data, sigma), prepare_field_buffered(var, data, sigma))
+                    for var, data, sigma in fields)
+    print(f"{len(fields)} fields at step {step}")
+    print("| path | time s | ms per field | peak MB |")
+    print("|---|---|---|---|")
+    print(f"| float64 wrap | {old_time:.2f} | {1000 * old_time / len(fields):.1f} | {old_peak:.0f} |")
+    print(f"| float32, reused buffer | {new_time:.2f} | {1000 * new_time / len(fields):.1f} | {new_peak:.0f} |")
+    print(f"identical: {identical}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time field preparation against the previous float64 path")
+    parser.add_argument("model_file")
+    parser.add_argument("model", help="model name as passed to contouring.py (e.g. gc)")
+    parser.add_argument("--step", type=int, default=1)
+    args = parser.parse_args()
+
+    bench(args.model_file, args.model, args.step)
@@ -0,0 +1,121 @@
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from netCDF4 import Dataset as DS
+import timeseries
+from ncwriter import ChunkWriter, codec_options
+from synthetic_grib import synthetic_field
+from bench_codecs import pack16
+
+# Compare time-series queries on a model NetCDF, chunked one field per chunk
+# (1,1,721,1440), against its time-series companion (41,1,32,32). The NetCDF
+# is a full 41-step run of a few synthetic variables written like grib2nc.py
+# writes them (or --file, e.g. a real run). Each query is timed with the file
+# freshly opened, at a different random point, and the median is reported.
+# Files are read from the page cache after the first query, so the numbers
+# are decompression and HDF5 overheads rather than disk.
+
+# Fields of the synthetic run: NetCDF name, GRIB shortName, levels (None for
+# surface variables)
+VARIABLES = [('t', 't', [850, 500, 250]), ('u', 'u', [850, 500, 250]), ('t2', '2t', None), ('msl', 'msl', None)]
+STEPS = 41
+
+def write_run(path, workers):
+    f = DS(path, 'w', format='NETCDF4')
+    f.createDimension('time', STEPS)
+    f.createDimension('level', 3)
+    f.createDimension('latitude', 721)
+    f.createDimension('longitude', 1440)
+    for name, values, units in [('time', 1704067200 + 21600 * np.arange(STEPS), 'seconds since 1970-1-1'),
+                                ('level', [850, 500, 250], 'hPa'),
+                                ('latitude', np.linspace(90, -90, 721), 'degree'),
+                                ('longitude', np.arange(0, 360, 0.25), 'degree')]:
+        var = f.createVariable(name, 'i4' if name in ['time', 'level'] else 'f4', (name,))
+        var[:] = values
+        var.units = units
+    for name, shortName, levels in VARIABLES:
+        dims = ('time', 'level', 'latitude', 'longitude') if levels else ('time', 'latitude', 'longitude')
+        chunks = (1, 1, 721, 1440) if levels else (1, 721, 1440)
+        f.createVariable(name, 'f4', dims, chunksizes=chunks, **codec_options())
+    f.close()
+
+    rng = np.random.default_rng(0)
+    writer = ChunkWriter(path, workers)
+    for step in range(STEPS):
+        for name, shortName, levels in VARIABLES:
+            for i, level in enumerate(levels or [0]):
+                index = (step, i) if levels else (step,)
+                writer.write(name, index, pack16(synthetic_field(shortName, level, step * 6, rng)))
+    writer.close()
+
+# Median seconds of `query(path, lat, lon, companion)` over `repeats` random
+# points, each with the file reopened. Also returns the last result.
+def median_latency(query, path, companion, repeats, seed=0):
+    rng = np.random.default_rng(seed)
+    times = []
+    for _ in range(repeats):
+        for ds in timeseries.datasets.values():
+            ds.close()
+        timeseries.datasets.clear()
+        lat, lon = rng.uniform(-80, 80), rng.uniform(-180, 180)
+        start = time.perf_counter()
+        result = query(path, lat, lon, companion)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), result
+
+def query_point(variables, levels=None):
+    return lambda path, lat, lon, companion: timeseries.point([path], lat, lon, variables, levels, companion)
+
+def query_region(variables):
+    return lambda path, lat, lon, companion: timeseries.region([path], (lat, lat + 10), (lon, lon + 10), variables,
+                                                               companion=companion)
+
+# One whole field, as contouring reads it
+def query_field(path, lat, lon, companion):
+    ds = timeseries.open_run(path, companion)
+    return ds['t2'].isel(time=int(abs(lat)) % STEPS).load()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare time-series query latency on a model NetCDF and its companion")
+    parser.add_argument("--file", help="model NetCDF to query (default: a synthetic 41-step run)")
+    parser.add_argument("--workers", type=int, default=4, help="compression threads for writing")
+    parser.add_argument("--repeats", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as outdir:
+        path = args.file or os.path.join(outdir, "run.nc")
+        if not args.file:
+            start = time.perf_counter()
+            write_run(path, args.workers)
+            print(f"Wrote the synthetic run in {time.perf_counter() - start:.1f} s")
+        start = time.perf_counter()
+        companion = timeseries.write_companion(path, os.path.join(outdir, "run.ts.nc") if args.file else None,
+                                               workers=args.workers)
+        print(f"Wrote the companion in {time.perf_counter() - start:.1f} s")
+        print(f"Sizes: NetCDF {os.path.getsize(path) / 2**20:.0f} MB, companion {os.path.getsize(companion) / 2**20:.0f} MB")
+        if args.file:
+            # Queries find the companion next to the NetCDF
+            path = os.path.join(outdir, "run.nc")
+            os.symlink(os.path.abspath(args.file), path)
+
+        with DS(path) as f:
+            fields = {name: int(np.prod(var.shape[1:-2])) for name, var in f.variables.items()
+                      if var.dimensions[-2:] == ('latitude', 'longitude')}
+        queries = [("point, t2", query_point(['t2'])),
+                   ("point, t at 500 hPa", query_point(['t'], [500])),
+                   (f"point, all {sum(fields.values())} variables and levels", query_point(list(fields))),
+                   ("10x10 degree region, t2", query_region(['t2'])),
+                   ("one t2 field (contouring)", query_field)]
+        print("| query | NetCDF ms | companion ms | speedup |")
+        print("|---|---|---|---|")
+        for label, query in queries:
+            main_time, main_result = median_latency(query, path, False, args.repeats)
+            companion_time, companion_result = median_latency(query, path, True, args.repeats)
+            if isinstance(main_result, dict):
+                main_result, companion_result = list(main_result.values())[0], list(companion_result.values())[0]
+            assert main_result.equals(companion_result), label
+            print(f"| {label} | {main_time * 1000:.0f} | {companion_time * 1000:.0f} | {main_time / companion_time:.3g}x |")
+        for ds in timeseries.datasets.values():
+            ds.close()
@@ -0,0 +1,61 @@
+import os
+import time
+import filecmp
+import argparse
+import tempfile
+import geojson
+import winds
+
+# The per-point writer winds.py used before write_barbs: a geojson.Feature
+# for every point, dumped with geojson
+def write_barbs_per_point(magnitude, direction, outfile):
+    features = []
+    for i in range(winds.latitudes.shape[0]):
+        for j in range(winds.longitudes.shape[0]):
+            lat = winds.latitudes[i]
+            lon = winds.longitudes[j]
+            if winds.model in ['fcnv2','pw','gc','gfs','au'] and lon > 180:
+                lon = lon - 360
+            feature = geojson.Feature(
+                    geometry=geojson.Point((float(lon), float(lat))),
+                    properties={
+                            "direction": float(direction[i,j]),
+                            "magnitude": float(magnitude[i,j])
+                    }
+            )
+            features.append(feature)
+    with open(outfile, 'w') as f:
+        geojson.dump(geojson.FeatureCollection(features), f)
+
+# Time both writers on every wind barb file of the given steps and check the
+# files are identical
+def bench(model_file, model, steps, outdir):
+    job = (model, 'bench', model_file, outdir)
+    winds.set_job(job)
+    ds = winds.open_model_file(model_file)
+    print("| step | files | per point s | arrays s | speedup | identical |")
+    print("|---|---|---|---|---|---|")
+    for step in steps:
+        times = {'per point': 0., 'arrays': 0.}
+        identical = True
+        levels = list(range(len(ds['level']))) + [None]
+        for lev in levels:
+            magnitude, direction = winds.barbs(ds, step, lev)
+            for name, writer in [('per point', write_barbs_per_point), ('arrays', winds.write_barbs)]:
+                start = time.perf_counter()
+                writer(magnitude, direction, os.path.join(outdir, f"{name}.geojson"))
+                times[name] += time.perf_counter() - start
+            identical = identical and filecmp.cmp(os.path.join(outdir, "per point.geojson"),
+                                                  os.path.join(outdir, "arrays.geojson"), shallow=False)
+        print(f"| {step} | {len(levels)} | {times['per point']:.2f} | {times['arrays']:.2f} | "
+              f"{times['per point'] / times['arrays']:.1f}x | {identical} |")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the per-point and array wind barb writers")
+    parser.add_argument("model_file")
+    parser.add_argument("model", help="model name as passed to winds.py (e.g. gc)")
+    parser.add_argument("--steps", nargs="+", type=int, default=[0, 1, 2])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as outdir:
+        bench(args.model_file, args.model, args.steps, outdir)
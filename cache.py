@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from pathlib import Path
+from functools import lru_cache
+import numpy as np
+import metrics
+
+# Content-addressed cache of contouring, wind barb and tiling outputs, so a
+# rerun of a cycle only redoes the products whose inputs changed. A product is
+# keyed by a hash of everything it is made from: the field values read from
+# the NetCDF, the variable and level, smoothing, contour levels and colors,
+# the output settings and the source of the code that makes it. Each entry is
+# <directory>/<key[:2]>/<key>/ holding the product (a file or a tile
+# directory) and entry.json (what it is, its size and when it was made).
+# Entries are copied in and out, so nothing in a cycle's directory shares
+# storage with the cache. Off unless `directory` is set (--cache).
+
+directory = None
+
+HERE = Path(__file__).resolve().parent
+
+# Hash of the arrays and values a product is made from. Arrays are hashed by
+# dtype, shape and bytes, anything else by repr.
+def key(*parts):
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            digest.update(f"{part.dtype}{part.shape}".encode())
+            digest.update(part.data)
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+# Hash of the source of the given modules (file names next to this one), so
+# changing the code invalidates what it made
+@lru_cache(maxsize=None)
+def code(*names):
+    return key(*[(HERE / name).read_bytes() for name in names])
+
+def entry_path(product_key):
+    return Path(directory) / product_key[:2] / product_key
+
+def copy(source, target):
+    target = Path(target)
+    if source.is_dir():
+        if target.exists():
+            shutil.rmtree(target)
+        shutil.copytree(source, target)
+    else:
+        shutil.copyfile(source, target)
+
+def size(path):
+    path = Path(path)
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size
+
+# Put the cached product at `target`. Returns False if there is none.
+def fetch(product_key, target):
+    if directory is None:
+        return False
+    start = time.time()
+    entry = entry_path(product_key)
+    try:
+        copy(entry / "product", target)
+    except (FileNotFoundError, shutil.Error):
+        # Not cached, or evicted while being copied
+        return False
+    # Marks the entry as recently used for evict()
+    os.utime(entry)
+    metrics.record("cache.hit", start, time.time(), product=Path(target).name)
+    return True
+
+# Add a product that was just made. An entry stored concurrently by another
+# worker is kept.
+def store(product_key, product, **info):
+    if directory is None:
+        return
+    entry = entry_path(product_key)
+    if entry.exists():
+        return
+    part = entry.with_name(f"{entry.name}.{os.getpid()}.part")
+    part.mkdir(parents=True, exist_ok=True)
+    copy(Path(product), part / "product")
+    (part / "entry.json").write_text(json.dumps({**info, "name": Path(product).name, "size": size(product),
+                                                 "created": time.time()}))
+    try:
+        os.rename(part, entry)
+    except OSError:
+        shutil.rmtree(part)
+
+# Remove entries not used for `max_age` seconds, then the least recently used
+# until the cache holds at most `max_bytes`. Returns the number of entries
+# removed and the bytes left.
+def evict(max_age=None, max_bytes=None):
+    entries = []
+    for entry in Path(directory).glob("??/*"):
+        # Left by a worker that died while storing
+        if entry.name.endswith(".part"):
+            if time.time() - entry.stat().st_mtime > 3600:
+                shutil.rmtree(entry, ignore_errors=True)
+            continue
+        try:
+            info = json.loads((entry / "entry.json").read_text())
+        except (OSError, ValueError):
+            shutil.rmtree(entry, ignore_errors=True)
+            continue
+        entries.append((entry.stat().st_mtime, info["size"], entry))
+    entries.sort()
+    total = sum(entry_size for used, entry_size, entry in entries)
+    removed = 0
+    for used, entry_size, entry in entries:
+        if (max_age is not None and time.time() - used > max_age) or (max_bytes is not None and total > max_bytes):
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= entry_size
+            removed += 1
+    for shard in Path(directory).glob("??"):
+        if not any(shard.iterdir()):
+            shard.rmdir()
+    return removed, total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evict old entries from the contour and tile cache")
+    parser.add_argument("directory")
+    parser.add_argument("--max-age-days", type=float, help="remove entries not used for this long")
+    parser.add_argument("--max-size-gb", type=float, help="then remove the least recently used down to this size")
+    args = parser.parse_args()
+
+    directory = args.directory
+    removed, total = evict(args.max_age_days and args.max_age_days * 86400,
+                           args.max_size_gb and args.max_size_gb * 1e9)
+    print(f"Removed {removed} entries, {total / 1e9:.2f} GB left")
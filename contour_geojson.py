@@ -0,0 +1,170 @@
+import json
+import numpy as np
+import contourpy
+from matplotlib import cm
+from matplotlib.colors import ListedColormap, Normalize, NoNorm, rgb2hex
+from polysimplify import ranges, simplify_rings
+
+# Filled contours straight from contourpy, written in the same GeoJSON layout
+# as geojsoncontour 0.4.0 contourf_to_geojson on a matplotlib 3.7 contourf,
+# the versions the contouring environment pins: one MultiPolygon feature per
+# band (empty bands included), one polygon per contourpy OuterCode polygon,
+# colored and titled the same way. Skips the figure, the PathCollections and
+# the geojson object layer. geojsoncontour 0.5 with matplotlib 3.8 or later
+# writes a different layout (no empty bands, holes grouped by winding).
+
+# Band colors of a matplotlib contourf with the given levels and extend,
+# either sampled from a colormap or taken from a list of colors
+def band_colors(levels, extend, cmap=None, colors=None):
+    levels = np.asarray(levels, np.float64)
+    extend_min = extend in ['min', 'both']
+    extend_max = extend in ['max', 'both']
+    if colors is not None:
+        ncolors = len(levels) - 1
+        i0 = 0
+        use_set_under_over = len(colors) == ncolors + extend_min + extend_max and (extend_min or extend_max)
+        if use_set_under_over and extend_min:
+            i0 = 1
+        cmap = ListedColormap(colors[i0:], N=ncolors)
+        if use_set_under_over:
+            if extend_min:
+                cmap.set_under(colors[0])
+            if extend_max:
+                cmap.set_over(colors[-1])
+        values = list(range(-1 if extend_min else 0, ncolors + (1 if extend_max else 0)))
+        mappable = cm.ScalarMappable(norm=NoNorm(), cmap=cmap)
+    else:
+        bounds = extended_levels(levels, extend)
+        values = 0.5 * (bounds[:-1] + bounds[1:])
+        mappable = cm.ScalarMappable(norm=Normalize(levels.min(), levels.max()), cmap=cmap)
+    return [rgb2hex(rgba) for rgba in mappable.to_rgba(values)]
+
+# Levels with the open-ended bands matplotlib adds for extend
+def extended_levels(levels, extend):
+    levels = list(levels)
+    if extend in ['min', 'both']:
+        levels.insert(0, -1e250)
+    if extend in ['max', 'both']:
+        levels.append(1e250)
+    return np.asarray(levels, np.float64)
+
+# Band titles, as geojsoncontour writes them
+def band_titles(levels, extend):
+    titles = ["%.2f" % levels[i] + '-' + "%.2f" % levels[i+1] for i in range(len(levels)-1)]
+    if extend in ['min', 'both']:
+        titles = ["<%.2f" % levels[0]] + titles
+    if extend in ['max', 'both']:
+        titles = titles + [">%.2f" % levels[-1]]
+    return titles
+
+# Path codes used by contourpy's OuterCode fill type
+MOVETO = 1
+CLOSEPOLY = 79
+
+# Slices of the rings of a contourpy OuterCode polygon (outer ring followed by
+# holes), following matplotlib's Path.to_polygons: the CLOSEPOLY vertex is
+# dropped and rings under 3 points are skipped
+def ring_slices(kinds):
+    starts = np.flatnonzero(kinds == MOVETO).tolist()
+    for start, end in zip(starts, starts[1:] + [len(kinds)]):
+        stop = end - 1 if kinds[end-1] == CLOSEPOLY else end
+        if stop - start >= 3:
+            yield start, stop
+
+# Polygons as nested lists. Like Path.to_polygons, the first point is repeated
+# at the end of a ring if it is not there already.
+def band_polygons(points, codes, ndigits):
+    polygons = []
+    for pts, kinds in zip(points, codes):
+        coords = np.around(pts, ndigits).tolist()
+        rings = []
+        for start, stop in ring_slices(kinds):
+            ring = coords[start:stop]
+            if (pts[start] != pts[stop-1]).any():
+                ring.append(coords[start])
+            rings.append(ring)
+        polygons.append(rings)
+    return polygons
+
+# Rings of a band's polygons back to back, for polysimplify: the rounded
+# points (rings left open), each ring's length and the polygon it belongs to.
+# Same rings as ring_slices, without the per-polygon loop.
+def band_rings(points, codes, ndigits):
+    if not points:
+        return np.empty((0, 2)), np.empty(0, np.int64), np.empty(0, np.int64)
+    pts, kinds = np.concatenate(points), np.concatenate(codes)
+    polygon_of = np.repeat(np.arange(len(points)), [len(p) for p in points])
+    starts = np.flatnonzero(kinds == MOVETO)
+    ends = np.append(starts[1:], len(kinds))
+    stops = np.where(kinds[ends-1] == CLOSEPOLY, ends - 1, ends)
+    valid = stops - starts >= 3
+    starts, stops = starts[valid], stops[valid]
+    stops = stops - (pts[starts] == pts[stops-1]).all(axis=1)
+    index, _ = ranges(starts, stops - starts)
+    return np.around(pts[index], ndigits), stops - starts, polygon_of[starts]
+
+# Group simplified rings back into polygons, dropping polygons whose outer
+# ring collapsed
+def ring_polygons(rings, polygon_of):
+    polygons = []
+    previous = -1
+    for ring, polygon in zip(rings, polygon_of.tolist()):
+        if polygon != previous:
+            previous = polygon
+            outer = ring is not None
+            if outer:
+                polygons.append([ring])
+        elif outer and ring is not None:
+            polygons[-1].append(ring)
+    return polygons
+
+# FeatureCollection of the filled contours of z on the x/y grid. With
+# `retain`, the polygons of all bands are simplified together the way
+# `mapshaper -simplify dp <retain>` would.
+def contourf_geojson(x, y, z, levels, extend, cmap=None, colors=None, ndigits=2,
+                     stroke_width=1, fill_opacity=.9, unit='', retain=None):
+    z = np.ma.masked_invalid(np.asarray(z, np.float64), copy=False)
+    generator = contourpy.contour_generator(
+        np.asarray(x, np.float64), np.asarray(y, np.float64), z, name='mpl2014', corner_mask=True,
+        line_type=contourpy.LineType.SeparateCode, fill_type=contourpy.FillType.OuterCode)
+
+    bounds = extended_levels(levels, extend)
+    lowers, uppers = bounds[:-1].copy(), bounds[1:]
+    # Include minimum values in the lowest band
+    if float(z.min()) == lowers[0]:
+        lowers[0] -= 1
+
+    bands = [generator.filled(lower, upper) for lower, upper in zip(lowers, uppers)]
+    if retain is None:
+        coordinates = [band_polygons(points, codes, ndigits) for points, codes in bands]
+    else:
+        rings = [band_rings(points, codes, ndigits) for points, codes in bands]
+        simplified = simplify_rings(np.concatenate([r[0] for r in rings]),
+                                    np.concatenate([r[1] for r in rings]), retain)
+        coordinates = []
+        for _, lengths, polygon_of in rings:
+            coordinates.append(ring_polygons(simplified[:len(lengths)], polygon_of))
+            simplified = simplified[len(lengths):]
+
+    features = []
+    for polygons, color, title in zip(coordinates, band_colors(levels, extend, cmap, colors),
+                                      band_titles(levels, extend)):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "MultiPolygon", "coordinates": polygons},
+            "properties": {
+                "stroke": color,
+                "stroke-width": stroke_width,
+                "stroke-opacity": 1,
+                "fill": color,
+                "fill-opacity": fill_opacity,
+                "title": "{} {}".format(title, unit)
+            }
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+# json.dumps runs on the C encoder; json.dump (as used by geojson.dump) streams
+# through the pure Python one
+def write_geojson(collection, outfile):
+    with open(outfile, 'w') as f:
+        f.write(json.dumps(collection, sort_keys=True, separators=(',', ':')))
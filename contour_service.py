@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import logging
+import argparse
+from pathlib import Path
+import contouring
+import winds
+import tiling
+import cache
+from scheduling import TaskPool
+
+logging.basicConfig(level=logging.INFO)
+
+# Contour and draw wind barbs for every model of a cycle on one worker pool.
+# Jobs are (model, init_cond, model_file). A job's tasks are queued as soon as
+# its NetCDF exists (grib2nc.py renames it into place once complete), so the
+# pool works on one model while the next is still being produced, and the
+# imports and worker startup are paid once per cycle.
+
+def job_outdir(geojson_path, cycle, model, init_cond):
+    outdir = Path(f"{geojson_path}/{cycle}/{model}_{init_cond}")
+    outdir.mkdir(parents=True, exist_ok=True)
+    return outdir
+
+# Returns the names of the failed tasks and of the jobs whose NetCDF never
+# appeared within `timeout` seconds, or by the time stop_file exists
+def serve(jobs, geojson_path, cycle, workers, poll=30, timeout=6*3600, stop_file=None):
+    pool = TaskPool(workers)
+    pending = list(jobs)
+    deadline = time.monotonic() + timeout
+    while pending:
+        # Checked before the NetCDFs, so one that appeared just before the
+        # stop file is still queued
+        stopping = stop_file is not None and os.path.exists(stop_file)
+        for model, init_cond, model_file in list(pending):
+            if not os.path.exists(model_file):
+                continue
+            pending.remove((model, init_cond, model_file))
+            job = (model, init_cond, model_file, job_outdir(geojson_path, cycle, model, init_cond))
+            # Contours largest first, then the short wind barb tasks
+            contour_tasks = contouring.job_tasks(job)
+            barb_tasks = winds.barb_tasks(job)
+            logging.info(f"{model_file} is ready, queueing {len(contour_tasks)} contour "
+                         f"and {len(barb_tasks)} wind barb tasks")
+            pool.submit(contouring.run_task, contour_tasks, name=contouring.task_name)
+            pool.submit(winds.run_task, barb_tasks, name=winds.task_name)
+        if pending and (stopping or time.monotonic() > deadline):
+            break
+        if pending:
+            pool.collect(timeout=poll)
+    pool.collect()
+    pool.close()
+    missing = [model_file for model, init_cond, model_file in pending]
+    return pool.failed, missing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Contour and draw wind barbs for several models on one worker pool")
+    for name in ["year", "month", "day", "init", "geojson_path"]:
+        parser.add_argument(name)
+    parser.add_argument("--job", nargs=3, action="append", required=True,
+                        metavar=("MODEL", "INIT_COND", "MODEL_FILE"),
+                        help="model to process once MODEL_FILE exists (repeat for each model)")
+    parser.add_argument("--workers", type=int, default=14, help="worker processes")
+    parser.add_argument("--backend", choices=["contourpy", "matplotlib"], default="contourpy")
+    parser.add_argument("--simplifier", choices=["python", "mapshaper"], default="python")
+    parser.add_argument("--tippecanoe", help="tile each GeoJSON file with this tippecanoe binary as soon as it is written")
+    parser.add_argument("--maximum-zoom", type=int, default=tiling.maxzoom, help="maximum tile zoom with --tippecanoe")
+    parser.add_argument("--poll", type=float, default=30, help="seconds between checks for new NetCDF files")
+    parser.add_argument("--timeout", type=float, default=6*3600,
+                        help="seconds to wait for all NetCDF files before giving up on the missing ones")
+    parser.add_argument("--stop-file", help="stop waiting for missing NetCDF files once this file exists")
+    parser.add_argument("--cache", help="reuse outputs whose inputs are unchanged from (and add them to) this cache directory")
+    args = parser.parse_args()
+    if args.simplifier == "python" and args.backend == "matplotlib":
+        parser.error("--simplifier python needs --backend contourpy")
+
+    # Set before the pool starts so the workers inherit them
+    contouring.backend, contouring.simplifier = args.backend, args.simplifier
+    tiling.tippecanoe, tiling.maxzoom = args.tippecanoe, args.maximum_zoom
+    cache.directory = args.cache
+
+    failed, missing = serve([tuple(job) for job in args.job], args.geojson_path,
+                            f"{args.year}{args.month}{args.day}_{args.init}", args.workers, args.poll, args.timeout,
+                            args.stop_file)
+    for model_file in missing:
+        logging.error(f"{model_file} never appeared")
+    if failed:
+        logging.error(f"{len(failed)} tasks failed: {' '.join(failed)}")
+    if failed or missing:
+        sys.exit(1)
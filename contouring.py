@@ -5,19 +5,26 @@ import numpy as np
 import xarray as xr
 import matplotlib.pyplot as plt
 from pathlib import Path
-from datetime import datetime
 from scipy.ndimage import gaussian_filter
-from multiprocessing import Pool
 import logging
 import geojsoncontour
-from metpy.calc import relative_humidity_from_specific_humidity
-from metpy.units import units
+import argparse
+from contour_geojson import contourf_geojson, write_geojson
+from scheduling import run_tasks
+import tiling
+import metrics
+import cache
 
 logging.basicConfig(level=logging.INFO)
 
 # ---------------------------------------------
 # Constants and configuration
 # ---------------------------------------------
+# Defaults for the command line options
+backend = 'contourpy'
+simplifier = 'python'
+mapshaper = "/mnt/aiweathernas/aiwp-realtime/node_modules/.bin/mapshaper"
+
 PRECIP_COLORS = [
     "#80ff00", "#00cd00", "#008b00", "#104e8b", "#1e8fff", "#00b3ee",
     "#00eeee", "#8968cd", "#902cee", "#8b008b"
@@ -173,32 +180,98 @@ def prepare_lons_lats(model):
     lats = np.arange(-90, 90.25, 0.25)
     return lons, lons_extended, lats
 
-def calculate_derived_variables(data,model):
-    windmag10 = np.sqrt(data['u10']**2 + data['v10']**2)
-    data['windmag10'] = (('time', 'latitude', 'longitude'), windmag10.data)
-
-    windmag = np.sqrt(data['u']**2 + data['v']**2)
-    data['windmag'] = (('time', 'level', 'latitude', 'longitude'), windmag.data)
-
-    if model in ['gc','pw','au','aifs']:
-
-        spfh = data['q']
-        pres_vals = data['level'].values
-        pres = np.zeros((41,13,721,1440))
-        for i, lev in enumerate(pres_vals):
-            pres[:, i, :, :] = lev
-        temp_C = data['t'].values - 273.15
-        rh = relative_humidity_from_specific_humidity(
-            pres * units.hPa, temp_C * units.degC, spfh
-        ).to('percent').magnitude.astype('float32')
-        data['r'] = (('time', 'level', 'latitude', 'longitude'), rh)
-
-    if model in ["gc","gfs","ifs","aifs"]:
-
-        apcptotal = np.cumsum(data['apcp'].values, axis=0)
-        data['apcptotal'] = (('time', 'latitude', 'longitude'), apcptotal)
+# Ratio of the molecular weights of water and dry air, as in MetPy
+EPSILON = np.float32(18.015268 / 28.96546)
+
+# Relative humidity (%) from specific humidity (kg/kg) and temperature (K) on
+# one pressure level (hPa), evaluated in float32 without building a pressure
+# array. This is relative_humidity_from_specific_humidity of MetPy 1.5.1, the
+# version the contouring environment pins and the published contours were made
+# with: w/ws with Bolton (1980) saturation vapor pressure. MetPy 1.6 changed to
+# the WMO definition with Ambaum (2020) saturation vapor pressure, which is ~2%
+# lower (up to 22 %RH near 1000 hPa), so don't compare against a newer MetPy.
+def relative_humidity(q, t, pressure):
+    es = np.float32(6.112) * np.exp(np.float32(17.67) * (t - np.float32(273.15)) / (t - np.float32(29.65)))
+    ws = EPSILON * es / (np.float32(pressure) - es)
+    return np.float32(100) * (q / (1 - q)) / ws
+
+# NetCDF variables each derived variable is calculated from, and the models
+# it is derived for (None for all)
+derived_vars = {
+    "windmag10": (['u10', 'v10'], None),
+    "windmag": (['u', 'v'], None),
+    "r": (['q', 't'], ['gc','pw','au','aifs']),
+    "apcptotal": (['apcp'], ['gc','gfs','ifs','aifs'])
+}
 
-    return data
+def is_derived(var, model):
+    if var not in derived_vars:
+        return False
+    models = derived_vars[var][1]
+    return models is None or model in models
+
+def has_variable(ds, model, var):
+    if is_derived(var, model):
+        return all(name in ds.data_vars for name in derived_vars[var][0])
+    return var in ds.data_vars
+
+# Read one float32 field of a variable at a timestep (and pressure level).
+# Derived variables are calculated from the fields they need when asked for,
+# so a worker holds a few fields at a time rather than whole variables.
+def read_field(ds, model, var, step, lev=None):
+    if lev is None:
+        index = (step,)
+    else:
+        index = (step, int(np.where(ds.level.values == lev)[0][0]))
+
+    def raw(name, index=index):
+        return ds[name][index].values.astype('float32')
+
+    if not is_derived(var, model):
+        return raw(var)
+    if var in ['windmag10', 'windmag']:
+        u, v = derived_vars[var][0]
+        return np.sqrt(raw(u)**2 + raw(v)**2)
+    if var == 'r':
+        return relative_humidity(raw('q'), raw('t'), lev)
+    if var == 'apcptotal':
+        total = raw('apcp', (0,))
+        for i in range(1, step+1):
+            total += raw('apcp', (i,))
+        return total
+
+# Unit conversions applied before contouring, in place on float32 fields
+def convert_units(var, variabledata):
+    if var=='z':
+        variabledata /= 9.80665
+    elif var=='t' or var=='t2':
+        variabledata -= 273.15
+    elif var=='apcp' or var=='apcptotal':
+        variabledata *= 39.3701
+    elif var=='msl':
+        variabledata /= 100.
+    return variabledata
+
+# Per-process buffers reused from field to field, keyed by shape
+buffers = {}
+
+def buffer(name, shape):
+    if (name, shape) not in buffers:
+        buffers[(name, shape)] = np.empty(shape, dtype='float32')
+    return buffers[(name, shape)]
+
+# Smooth a float32 field, flip it north-up and repeat the first longitude at
+# the end so the contours close across the dateline. Units are converted in
+# place, and the filter writes north-up straight into `out` (lat, lon+1), so
+# no flipped copy or float64 array is made.
+def prepare_field(var, variabledata, sigma, out=None):
+    nlat, nlon = variabledata.shape
+    if out is None:
+        out = np.empty((nlat, nlon+1), dtype='float32')
+    variabledata = convert_units(var, np.asarray(variabledata, dtype='float32'))
+    gaussian_filter(variabledata, sigma=sigma, mode='wrap', output=out[::-1, :-1])
+    out[:, -1] = out[:, 0]
+    return out
 
 def plot(varlev,variabledata_extended,contourlevels,cmap,extend):
     figure = plt.figure()
@@ -217,6 +290,18 @@ def plot(varlev,variabledata_extended,contourlevels,cmap,extend):
 def geojson(contours,outfile):
     geojsoncontour.contourf_to_geojson(contourf=contours,geojson_filepath=outfile,ndigits=2)
 
+# Write the filled contours of a prepared field to outfile. The contourpy
+# backend produces the same file as the pinned matplotlib 3.7 + geojsoncontour
+# 0.4.0 without building a figure.
+def contour(varlev,variabledata_extended,contourlevels,cmap,extend,outfile,retain=None):
+    if backend == 'matplotlib':
+        geojson(plot(varlev,variabledata_extended,contourlevels,cmap,extend),outfile)
+        return
+    colors = {'apcp': PRECIP_COLORS, 'apcptotal': TOTAL_PRECIP_COLORS}.get(varlev)
+    collection = contourf_geojson(lons_extended,lats,variabledata_extended,contourlevels,extend,
+                                  cmap=None if colors else cmap,colors=colors,ndigits=2,retain=retain)
+    write_geojson(collection,outfile)
+
 def empty_geojson(filename):
     empty_geojson = {
         "type": "FeatureCollection",
@@ -225,101 +310,173 @@ def empty_geojson(filename):
     with open(filename, "w") as f:
         json.dump(empty_geojson, f)
 
+# Raises CalledProcessError if mapshaper fails, rather than leaving a blank layer
 def simplify(geojsonfile):
     command = f"{mapshaper} {geojsonfile} -simplify dp 30% -o {geojsonfile}.simple"
-    try:
-        sp.run(command,shell=True,check=True)
-    except:
-        empty_geojson(f"{geojsonfile}.simple")
-
-def run_processor(step):
-    for var in myvars.keys():
-        if var in data.data_vars:
-            if myvars[var]["type"]=="pl":
-                for lev in LEVELS:
-                    contourlevels = myvars[var][lev]['contourlevels']
-                    cmap = myvars[var][lev]['colormap']
-                    units = myvars[var][lev]['units']
-                    extend = myvars[var][lev]['extend']
-                    sigma = myvars[var][lev]['filter']
-                    varlev = var + str(lev)
-                    fhour = str(step*6).zfill(3)
-
-                    levidx = np.where(data.level.values == lev)[0][0] 
-                    variabledata = data[var][step,levidx,:,:]
-                    
-                    if var=='z':
-                        variabledata = variabledata/9.80665
-                    elif var=='t':
-                        variabledata = variabledata - 273.15
-
-                    variabledata = gaussian_filter(variabledata,sigma=sigma,mode='wrap')
-                    variabledata = np.flipud(variabledata)
-                    
-                    variabledata_extended = np.zeros((721,1441))
-                    variabledata_extended[:,:-1] = variabledata
-                    variabledata_extended[:,-1] = variabledata[:,0]
-
-                    contours = plot(varlev,variabledata_extended,contourlevels,cmap,extend)
-
-                    outfile = f"{outdir}/{model}_{init_cond}_{varlev}_{fhour}.geojson"
-                    geojson(contours,outfile)
-                    simplify(outfile)
-
-            elif myvars[var]["type"]=="sfc":
-                contourlevels = myvars[var]['sfc']['contourlevels']
-                cmap = myvars[var]['sfc']['colormap']
-                units = myvars[var]['sfc']['units']
-                extend = myvars[var]['sfc']['extend']
-                sigma = myvars[var]['sfc']['filter']
-                varlev = var
-                fhour = str(step*6).zfill(3)
-
-                variabledata = data[var][step,:,:]
-
-                if var=='t2':
-                    variabledata = variabledata - 273.15
-                elif var=='apcp' or var=='apcptotal':
-                    variabledata = variabledata * 39.3701
-                elif var=='msl':
-                    variabledata = variabledata/100.
-            
-                variabledata = gaussian_filter(variabledata,sigma=sigma,mode='wrap')
-                variabledata = np.flipud(variabledata)
-
-                variabledata_extended = np.zeros((721,1441))
-                variabledata_extended[:,:-1] = variabledata
-                variabledata_extended[:,-1] = variabledata[:,0]
-
-                contours = plot(varlev,variabledata_extended,contourlevels,cmap,extend)
-
-                outfile = f"{outdir}/{model}_{init_cond}_{varlev}_{fhour}.geojson"
-                geojson(contours,outfile)
-                simplify(outfile)
-
+    with metrics.stage("mapshaper", bytes_in=metrics.size(geojsonfile)) as fields:
+        result = metrics.run(command, fields, shell=True)
+        if result.returncode:
+            raise sp.CalledProcessError(result.returncode, command, stderr=result.stderr)
+        fields["bytes_out"] = metrics.size(f"{geojsonfile}.simple")
+
+# A task contours one field: (job, step, var, lev), where job is
+# (model, init_cond, model_file, outdir). Workers switch to a task's job and
+# keep its NetCDF open for the tasks that follow.
+job = None
+datasets = {}
+
+def set_job(new_job):
+    global job, model, init_cond, model_file, outdir, lons, lons_extended, lats
+    if new_job != job:
+        job = new_job
+        model, init_cond, model_file, outdir = job
+        lons, lons_extended, lats = prepare_lons_lats(model)
+
+def open_model_file(path):
+    if path not in datasets:
+        datasets[path] = xr.open_dataset(path)
+    return datasets[path]
+
+# One task per field, except apcptotal: one task contours it at every step
+# (a tuple of steps), keeping a running total of apcp
+def field_tasks(job, steps=range(0,41)):
+    tasks = [(job, step, var, lev) for step in steps for var in myvars if var != 'apcptotal'
+             for lev in (LEVELS if myvars[var]["type"]=="pl" else [None])]
+    if len(steps):
+        tasks.append((job, tuple(steps), 'apcptotal', None))
+    return tasks
+
+# Tasks of a job, largest first. The NetCDF is closed again before returning,
+# so no open handle is forked into the workers.
+def job_tasks(job, steps=range(0,41)):
+    tasks = field_tasks(job, steps)
+    with xr.open_dataset(job[2]) as ds:
+        tasks.sort(key=lambda task: task_cost(ds, task), reverse=True)
+    return tasks
+
+def task_name(task):
+    job, step, var, lev = task
+    if var == 'apcptotal':
+        return f"{job[0]}_{job[1]}_{var}_{str(step[0]*6).zfill(3)}-{str(step[-1]*6).zfill(3)}"
+    return f"{job[0]}_{job[1]}_{var}{lev or ''}_{str(step*6).zfill(3)}"
+
+# Relative cost for largest-first ordering. Contouring time mostly follows the
+# number of contour levels, the apcptotal task contours every step, and
+# missing variables only write a placeholder.
+def task_cost(ds, task):
+    job, step, var, lev = task
+    if not has_variable(ds, job[0], var):
+        return 0
+    cost = len(myvars[var][lev or 'sfc']['contourlevels'])
+    if var == 'apcptotal':
+        cost *= len(step)
+    return cost
+
+# Cache key of a field's product: the values read from the NetCDF (before
+# unit conversion), how they are smoothed, contoured and simplified, and the
+# tippecanoe settings when tiled here
+def field_key(var, lev, variabledata, settings, outfile):
+    code = ["contouring.py", "contour_geojson.py", "polysimplify.py"]
+    tiled = None
+    if tiling.tippecanoe:
+        code.append("tiling.py")
+        tiled = tiling.tippecanoe_settings(f"{outfile}.geojson.simple")
+    return cache.key("contour", cache.code(*code), model, var, lev, variabledata, settings,
+                     {'apcp': PRECIP_COLORS, 'apcptotal': TOTAL_PRECIP_COLORS}.get(var), backend, simplifier, tiled)
+
+def run_task(task):
+    task_job, step, var, lev = task
+    set_job(task_job)
+    ds = open_model_file(model_file)
+    if var != 'apcptotal':
+        fields = [(step, None)]
+    elif has_variable(ds, model, var):
+        fields = apcp_totals(ds, step)
+    else:
+        fields = [(s, None) for s in step]
+    for step, variabledata in fields:
+        metrics.labels.update(model=model, init_cond=init_cond, step=step, var=var + str(lev or ''))
+        with metrics.stage("contour"):
+            run_field(ds, step, var, lev, variabledata)
+
+# apcptotal, the precipitation accumulated since initialization, as (step,
+# field) at each of `steps`. Each step adds one read of apcp to the running
+# total instead of reading every step up to it again, which over a run is
+# 41 reads rather than 861. Summed in the same order as read_field.
+def apcp_totals(ds, steps):
+    total = None
+    for step in range(max(steps) + 1):
+        with metrics.stage("contour.read", step=step):
+            field = read_field(ds, model, 'apcp', step)
+        if total is None:
+            total = field
+        else:
+            total += field
+        if step in steps:
+            # run_field converts units in place
+            yield step, total.copy()
+
+# Contour one field, read here unless given as variabledata
+def run_field(ds, step, var, lev, variabledata=None):
+    fhour = str(step*6).zfill(3)
+    varlev = var + str(lev) if lev else var
+    outfile = f"{outdir}/{model}_{init_cond}_{varlev}_{fhour}"
+    if not has_variable(ds, model, var):
+        empty_geojson(f"{outfile}.simple")
+        return
+
+    settings = myvars[var][lev or 'sfc']
+    if variabledata is None:
+        with metrics.stage("contour.read"):
+            variabledata = read_field(ds, model, var, step, lev)
+    # The tiles when they are made here, otherwise the GeoJSON for tiling.py
+    product = tiling.tile_paths(f"{outfile}.geojson.simple")[0] if tiling.tippecanoe else f"{outfile}.geojson.simple"
+    product_key = field_key(var, lev, variabledata, settings, outfile) if cache.directory else None
+    if product_key and cache.fetch(product_key, product):
+        return
+    with metrics.stage("contour.prepare"):
+        variabledata_extended = prepare_field(var, variabledata, settings['filter'],
+                                              out=buffer('prepared', (len(lats), len(lons_extended))))
+    contourargs = (varlev,variabledata_extended,settings['contourlevels'],settings['colormap'],settings['extend'])
+    with metrics.stage("contour.contourf") as fields:
+        if simplifier == 'python':
+            # Simplified in memory, written straight to the file that gets tiled
+            contour(*contourargs,f"{outfile}.geojson.simple",retain=0.3)
+            fields["bytes_out"] = metrics.size(f"{outfile}.geojson.simple")
         else:
-            if myvars[var]["type"]=="pl":
-                for lev in LEVELS:
-                    varlev = var + str(lev)
-                    outfile = f"{outdir}/{model}_{init_cond}_{varlev}_{fhour}"
-                    empty_geojson(f"{outfile}.simple")
-            elif myvars[var]["type"]=="sfc":
-                varlev = var
-                outfile = f"{outdir}/{model}_{init_cond}_{varlev}_{fhour}"
-                empty_geojson(f"{outfile}.simple")
+            contour(*contourargs,f"{outfile}.geojson")
+            fields["bytes_out"] = metrics.size(f"{outfile}.geojson")
+    if simplifier != 'python':
+        simplify(f"{outfile}.geojson")
+    if tiling.tippecanoe:
+        tiling.tile_file(f"{outfile}.geojson.simple", cached=False)
+    if product_key:
+        cache.store(product_key, product, model=model, var=varlev, step=step)
 
 
 if __name__ == "__main__":
-    year, month, day, init, model, init_cond, model_file, geojson_path = sys.argv[1:9]
-    outdir = Path(f"{geojson_path}/{year}{month}{day}_{init}/{model}_{init_cond}")
+    parser = argparse.ArgumentParser(description="Contour a model NetCDF into simplified GeoJSON files")
+    for name in ["year", "month", "day", "init", "model", "init_cond", "model_file", "geojson_path"]:
+        parser.add_argument(name)
+    parser.add_argument("--backend", choices=["contourpy", "matplotlib"], default="contourpy",
+                        help="contourpy writes the same GeoJSON as matplotlib + geojsoncontour, faster")
+    parser.add_argument("--simplifier", choices=["python", "mapshaper"], default="python",
+                        help="python simplifies in memory (polysimplify.py, contourpy backend only) "
+                             "instead of running mapshaper on every file")
+    parser.add_argument("--workers", type=int, default=14, help="worker processes")
+    parser.add_argument("--steps", type=int, default=41, help="process the first N steps")
+    parser.add_argument("--cache", help="reuse fields whose inputs are unchanged from (and add them to) this cache directory")
+    args = parser.parse_args()
+    if args.simplifier == "python" and args.backend == "matplotlib":
+        parser.error("--simplifier python needs --backend contourpy")
+
+    backend, simplifier = args.backend, args.simplifier
+    cache.directory = args.cache
+    outdir = Path(f"{args.geojson_path}/{args.year}{args.month}{args.day}_{args.init}/{args.model}_{args.init_cond}")
     outdir.mkdir(parents=True, exist_ok=True)
-    mapshaper = f"/mnt/aiweathernas/aiwp-realtime/node_modules/.bin/mapshaper"
-
-    lons, lons_extended, lats = prepare_lons_lats(model)
-    
-    data = xr.open_dataset(model_file)
-    data = calculate_derived_variables(data, model)
-    data.load()
 
-    with Pool(processes=14) as pool:
-        pool.map(run_processor, range(0,41))
+    failed = run_tasks(run_task, job_tasks((args.model, args.init_cond, args.model_file, outdir), range(args.steps)),
+                       args.workers, name=task_name)
+    if failed:
+        logging.error(f"{len(failed)} fields failed: {' '.join(failed)}")
+        sys.exit(1)
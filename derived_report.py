@@ -0,0 +1,92 @@
+import sys
+import argparse
+import tracemalloc
+import numpy as np
+import xarray as xr
+import metpy
+from metpy.calc import relative_humidity_from_specific_humidity
+from metpy.units import units
+from contouring import LEVELS, is_derived, read_field
+
+# The MetPy version contouring.relative_humidity follows (newer versions use a
+# different formula), and the largest relative difference from it that passes
+METPY_VERSION = "1.5.1"
+TOLERANCE = 1e-5
+
+# Derived variables as contouring.py used to calculate them: whole arrays over
+# the selected steps, relative humidity with MetPy and a float64 pressure cube
+def metpy_derived(ds, model, steps):
+    data = ds.isel(time=steps).load()
+    derived = {}
+    derived['windmag10'] = np.sqrt(data['u10']**2 + data['v10']**2).values
+    derived['windmag'] = np.sqrt(data['u']**2 + data['v']**2).values
+    if is_derived('r', model):
+        pres = np.zeros(data['q'].shape)
+        for i, lev in enumerate(data['level'].values):
+            pres[:, i, :, :] = lev
+        temp_C = data['t'].values - 273.15
+        derived['r'] = relative_humidity_from_specific_humidity(
+            pres * units.hPa, temp_C * units.degC, data['q']
+        ).to('percent').magnitude.astype('float32')
+    if is_derived('apcptotal', model):
+        apcp = ds['apcp'][:max(steps)+1].values
+        derived['apcptotal'] = np.cumsum(apcp, axis=0)[steps]
+    return derived
+
+# Peak traced allocation (MB) while calling func
+def peak_memory(func, *args):
+    tracemalloc.start()
+    result = func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, peak
+
+# Print the differences per variable and level and return the fields (variable
+# and level) that differ by more than `tolerance` relative, or are NaN or
+# infinite at different points
+def compare(model_file, model, steps, tolerance=TOLERANCE):
+    failed = []
+    with xr.open_dataset(model_file) as ds:
+        reference, old_peak = peak_memory(metpy_derived, ds, model, steps)
+        new_peak = 0
+        print("| variable | level | max abs diff | max rel diff | non-finite mismatches |")
+        print("|---|---|---|---|---|")
+        for var, values in reference.items():
+            for lev in LEVELS if values.ndim == 4 else [None]:
+                max_abs = max_rel = 0.
+                nonfinite = 0
+                for i, step in enumerate(steps):
+                    expected = values[i] if lev is None else values[i, list(ds.level.values).index(lev)]
+                    field, peak = peak_memory(read_field, ds, model, var, step, lev)
+                    new_peak = max(new_peak, peak)
+                    # NaN or infinite where the other isn't the same
+                    valid = np.isfinite(field) & np.isfinite(expected)
+                    same = (field == expected) | (np.isnan(field) & np.isnan(expected))
+                    nonfinite += int((~valid & ~same).sum())
+                    diff = np.abs(field[valid].astype('f8') - expected[valid])
+                    if diff.size:
+                        max_abs = max(max_abs, diff.max())
+                    nonzero = expected[valid] != 0
+                    if nonzero.any():
+                        max_rel = max(max_rel, (diff[nonzero] / np.abs(expected[valid][nonzero])).max())
+                print(f"| {var} | {lev or 'sfc'} | {max_abs:.3g} | {max_rel:.3g} | {nonfinite} |")
+                if max_rel > tolerance or nonfinite:
+                    failed.append(f"{var} {lev or 'sfc'}")
+    print(f"\nPeak memory: {old_peak:.0f} MB for whole arrays over {len(steps)} steps, "
+          f"{new_peak:.0f} MB for the largest single derived field")
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the float32 derived variables in contouring.py against MetPy")
+    parser.add_argument("model_file")
+    parser.add_argument("model", help="model name as passed to contouring.py (e.g. gc)")
+    parser.add_argument("--steps", nargs="+", type=int, default=[0, 1, 2])
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="largest relative difference that passes")
+    args = parser.parse_args()
+
+    if metpy.__version__ != METPY_VERSION:
+        sys.exit(f"derived_report.py needs MetPy {METPY_VERSION}, found {metpy.__version__}")
+    failed = compare(args.model_file, args.model, args.steps, args.tolerance)
+    if failed:
+        print(f"Above the tolerance of {args.tolerance:g}: {', '.join(failed)}")
+        sys.exit(1)
@@ -1,85 +1,139 @@
-# ** Don't modify any of this **
+# Convert an AI model's GRIB output to the NetCDF published on NODD. The
+# variable names, units, dimensions and global attributes below are the
+# published format that users read; change them (and bump `version`) only when
+# the format is meant to change.
 
 import numpy as np
-import xarray as xr
-import pygrib as pg
-import math
 import datetime
-import sys
+import os
+import logging
+import argparse
 from netCDF4 import Dataset as DS
+from multiprocessing import Pool
+from gribindex import build_index, follow_index, read_message, decode_records
+from ncwriter import CODECS, ChunkWriter, codec_options, codec_available, precision_options
+from references import write_references
+from timeseries import write_companion
+import metrics
+
+# Mapping of variable names and their descriptions/units
+varmap = {
+    "u10": ['10 metre U wind component', 'm s-1'],
+    "v10": ['10 metre V wind component', 'm s-1'],
+    "t2": ['2 metre temperature', 'K'],
+    "msl": ['Pressure reduced to MSL', 'Pa'],
+    "u100": ['100 metre U wind component', 'm s-1'],
+    "v100": ['100 metre V wind component', 'm s-1'],
+    "sp": ['Surface pressure', 'Pa'],
+    "tcwv": ['Precipitable water', 'kg m-2'],
+    "apcp": ['6-hr accumulated precipitation', 'm'],
+    "u": ['U component of wind', 'm s-1'],
+    "v": ['V component of wind', 'm s-1'],
+    "t": ['Temperature', 'K'],
+    "z": ['Geopotential', 'm2 s-2'],
+    "r": ['Relative humidity', '%'],
+    "q": ['Specific humidity', 'kg kg-1'],
+    "w": ['Vertical velocity', 'Pa s-1']
+}
+
+# Mapping from ECMWF to GFS names
+ec2gfsmap = {
+    "u": "u",
+    "v": "v",
+    "w": "w",
+    "z": "z",
+    "q": "q",
+    "r": "r",
+    "t": "t",
+    "10u": "u10",
+    "10v": "v10",
+    "100u": "u100",
+    "100v": "v100",
+    "2t": "t2",
+    "msl": "msl",
+    "sp": "sp",
+    "tcwv": "tcwv",
+    "tp": "apcp"
+}
+
+# Lossy precision applied per variable with --trim-precision. ('bits', n)
+# keeps n mantissa bits (BitRound), ('digits', n) keeps n decimal places.
+# The setting is recorded in the variable attributes.
+precision_table = {
+    "u10": ('bits', 10),
+    "v10": ('bits', 10),
+    "t2": ('bits', 12),
+    "msl": ('bits', 14),
+    "u100": ('bits', 10),
+    "v100": ('bits', 10),
+    "sp": ('bits', 14),
+    "tcwv": ('bits', 10),
+    "apcp": ('bits', 10),
+    "u": ('bits', 10),
+    "v": ('bits', 10),
+    "t": ('bits', 12),
+    "z": ('bits', 14),
+    "r": ('bits', 9),
+    "q": ('bits', 10),
+    "w": ('bits', 9)
+}
+
+# Last forecast step (hours) written by every model
+LAST_STEP = 240
 
 # Define the main function to convert GRIB files to NetCDF
-def grib2nc(infile, initconditions, model, date, time):
-
-    # Mapping of variable names and their descriptions/units
-    varmap = {
-        "u10": ['10 metre U wind component', 'm s-1'],
-        "v10": ['10 metre V wind component', 'm s-1'],
-        "t2": ['2 metre temperature', 'K'],
-        "msl": ['Pressure reduced to MSL', 'Pa'],
-        "u100": ['100 metre U wind component', 'm s-1'],
-        "v100": ['100 metre V wind component', 'm s-1'],
-        "sp": ['Surface pressure', 'Pa'],
-        "tcwv": ['Precipitable water', 'kg m-2'],
-        "apcp": ['6-hr accumulated precipitation', 'm'],
-        "u": ['U component of wind', 'm s-1'],
-        "v": ['V component of wind', 'm s-1'],
-        "t": ['Temperature', 'K'],
-        "z": ['Geopotential', 'm2 s-2'],
-        "r": ['Relative humidity', '%'],
-        "q": ['Specific humidity', 'kg kg-1'],
-        "w": ['Vertical velocity', 'Pa s-1']
-    }
-
-    # Mapping from ECMWF to GFS names
-    ec2gfsmap = {
-        "u": "u",
-        "v": "v",
-        "w": "w",
-        "z": "z",
-        "q": "q",
-        "r": "r",
-        "t": "t",
-        "10u": "u10",
-        "10v": "v10",
-        "100u": "u100",
-        "100v": "v100",
-        "2t": "t2",
-        "msl": "msl",
-        "sp": "sp",
-        "tcwv": "tcwv",
-        "tp": "apcp"
-    }
-
-    # Initialize lists to store variables and levels
+def grib2nc(infile, initconditions, model, date, time, follow=False, poll=10, timeout=3600,
+            codec='zlib', complevel=4, shuffle=True, compress_workers=4, precision=None,
+            references=False, reference_url=None, decode_workers=0, timeseries=False):
+
+    # Build a header-only index so the file is decoded exactly once. When
+    # following a file that is still being written, wait until the first step
+    # is complete so every variable and level is known before defining them.
+    if follow:
+        batches = follow_index(infile, poll, timeout)
+        index = []
+        for records in batches:
+            index += records
+            if len({record['step'] for record in index}) > 1:
+                break
+        if not index:
+            raise RuntimeError(f"No GRIB messages appeared in {infile} within {timeout} s")
+    else:
+        index, _ = build_index(infile)
+
+    # Identify pressure level and surface variables
     unique_pl_vars = []
     unique_sfc_vars = []
     levels = []
+    for record in index:
+        if record['levelType'] == "pl":
+            if record['level'] not in levels:
+                levels.append(record['level'])
+            if record['shortName'] not in unique_pl_vars:
+                unique_pl_vars.append(record['shortName'])
+        else:
+            if record['shortName'] not in unique_sfc_vars:
+                if record['shortName'] in ['lsm','z']:
+                    continue
+                unique_sfc_vars.append(record['shortName'])
+    levels.sort(reverse=True)
+    levelmap = {level: c for c, level in enumerate(levels)}
 
     # Open the GRIB file and extract grid shape and lat/lon coordinates
-    with pg.open(infile) as grib:
-        y_shape, x_shape = grib[1].values.shape
-        lats, lons = grib[1].latlons()
+    with open(infile, 'rb') as grib:
+        y_shape, x_shape = index[0]['Ny'], index[0]['Nx']
+        lats, lons = read_message(grib, index[0]).latlons()
         lats = lats[:, 0]
         lons = lons[0, :]
 
-        # Identify pressure level and surface variables
-        for grb in grib:
-            if grb.levelType == "pl":
-                if grb.level not in levels:
-                    levels.append(grb.level)
-                if grb.shortName not in unique_pl_vars:
-                    unique_pl_vars.append(grb.shortName)
-            else:
-                if grb.shortName not in unique_sfc_vars:
-                    if grb.shortName in ['lsm','z']:
-                        continue
-                    unique_sfc_vars.append(grb.shortName)
-        levels.sort(reverse=True)
-        levelmap = {level: c for c, level in enumerate(levels)}
-
-        # Create NetCDF file and define dimensions
-        f = DS(f"{infile}.nc", 'w', format='NETCDF4')
+        # Create NetCDF file and define dimensions. It is written as .nc.part
+        # and renamed to .nc once complete, so anything waiting for the .nc
+        # (contour_service.py) never opens a partial file.
+        partfile = f"{infile}.nc.part"
+        f = DS(partfile, 'w', format='NETCDF4')
+        if not codec_available(f, codec):
+            raise ValueError(f"netCDF-C was built without the filter plugin for {codec}")
+        compression = codec_options(codec, complevel, shuffle)
         f.createDimension('time', 41)
         f.createDimension('level', 13)
         f.createDimension('longitude', 1440)
@@ -111,48 +165,73 @@ def grib2nc(infile, initconditions, model, date, time):
         for variable in unique_pl_vars + unique_sfc_vars:
             if model=="graphcast" and variable=='r':
                 continue
-            dims = ('time', 'level', 'latitude', 'longitude') if variable in unique_pl_vars else ('time', 'latitude', 'longitude')
-            chunksizes = (1, 1, y_shape, x_shape) if 'level' in dims else (1, y_shape, x_shape)
-            gfsequivalent = ec2gfsmap[variable]
-            create_variable(
-                f, gfsequivalent, dims, None, {
-                    'long_name': varmap[gfsequivalent][0],
-                    'units': varmap[gfsequivalent][1]
-                },
-                chunksizes
-            )
-
-        # Populate NetCDF variables with data from GRIB
-        grib.seek(0)
-        for grb in grib:
-            shortName = grb.shortName
-            timestep = int(grb.step / 6)
-            level = grb.level
-            levelType = grb.levelType
-            if (shortName == 'z' and levelType == 'sfc') or shortName not in ec2gfsmap.keys():
-                continue
-            if (shortName =='r' and model=='graphcast'):
-                continue
-            gfsequivalent = ec2gfsmap[shortName]
-            vals = grb.values
-
-            if levelType == 'pl':
-                levelind = levelmap[level]
-                f.variables[gfsequivalent][timestep, levelind, :, :] = vals
-            elif levelType == 'sfc':
-                f.variables[gfsequivalent][timestep, :, :] = vals
-
-        # Recalculate apcp as 6-hourly differences if present
-        if model=="graphcast":
-            if 'apcp' in f.variables:
-                apcp_data = f.variables['apcp'][:]
-                # Calculate 6-hourly differences (with apcp[0] as-is)
-                apcp_diff = np.empty_like(apcp_data)
-                apcp_diff[0] = apcp_data[0]  # First timestep stays the same
-                apcp_diff[1:] = apcp_data[1:] - apcp_data[:-1]
-                f.variables['apcp'][:] = apcp_diff
+            define_variable(f, variable, variable in unique_pl_vars, y_shape, x_shape, compression, precision)
+        f.close()
+
+        # Decode GRIB messages on a process pool, in order, while a single
+        # writer compresses chunks on a thread pool and fills the NetCDF
+        pool = Pool(decode_workers) if decode_workers else None
+        writer = ChunkWriter(partfile, compress_workers)
+
+        # Populate NetCDF variables with data from GRIB, picking up new messages
+        # as they are appended in follow mode until the last step is complete
+        written = {}
+        apcp_prev = None
+        records = index
+        while True:
+            wanted = []
+            for record in sorted(records, key=lambda record: record['step']):
+                shortName = record['shortName']
+                levelType = record['levelType']
+                if (shortName == 'z' and levelType == 'sfc') or shortName not in ec2gfsmap.keys():
+                    continue
+                if (shortName =='r' and model=='graphcast'):
+                    continue
+                if ec2gfsmap[shortName] not in writer.variables:
+                    writer.define(define_variable, shortName, levelType == 'pl', y_shape, x_shape, compression, precision)
+                wanted.append(record)
+
+            for record, vals in decode_records(infile, wanted, pool, 2 * decode_workers):
+                shortName = record['shortName']
+                timestep = int(record['step'] / 6)
+                level = record['level']
+                levelType = record['levelType']
+                gfsequivalent = ec2gfsmap[shortName]
+
+                # GraphCast apcp is accumulated from initialization, so store
+                # 6-hourly differences (apcp[0] as-is). Only the previous
+                # step's accumulation is kept in memory.
+                if model=="graphcast" and gfsequivalent=='apcp':
+                    accumulated = np.asarray(vals, dtype='f4')
+                    if apcp_prev is not None:
+                        vals = accumulated - apcp_prev
+                    apcp_prev = accumulated
+
+                # Includes compression with --compress-workers 0, and waiting
+                # for the compression threads to catch up otherwise
+                with metrics.stage("grib2nc.write", step=record['step'], var=gfsequivalent, level=level):
+                    if levelType == 'pl':
+                        levelind = levelmap[level]
+                        writer.write(gfsequivalent, (timestep, levelind), vals)
+                    elif levelType == 'sfc':
+                        writer.write(gfsequivalent, (timestep,), vals)
+                written.setdefault(record['step'], set()).add((shortName, level))
+
+            if not follow or step_complete(written, LAST_STEP):
+                break
+            writer.flush()
+            records = next(batches, None)
+            if records is None:
+                logging.warning(f"{infile} stopped growing before step {LAST_STEP} was complete")
+                break
+
+        writer.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
 
         # Add global attributes to the NetCDF file
+        f = DS(partfile, 'a')
         f.Conventions = 'CF-1.8'
         f.version = '3_2025-02-20'
         f.model_name = model
@@ -163,11 +242,46 @@ def grib2nc(infile, initconditions, model, date, time):
         f.forecast_hour_step = f"6"
         f.creation_time = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
         f.close()
+        os.replace(partfile, f"{infile}.nc")
+
+    # Write kerchunk references so the file can be opened as Zarr with
+    # byte-range reads once it is uploaded to `reference_url`
+    if references:
+        with metrics.stage("grib2nc.references"):
+            write_references(f"{infile}.nc", f"{infile}.json", reference_url)
+
+    # Write the time-series companion <infile>.ts.nc (see timeseries.py) with
+    # the same codec
+    if timeseries:
+        with metrics.stage("grib2nc.timeseries") as fields:
+            write_companion(f"{infile}.nc", codec=codec, complevel=complevel, shuffle=shuffle,
+                            workers=compress_workers)
+            fields["bytes_out"] = metrics.size(f"{infile}.ts.nc")
+
+# A step is complete once it holds every field written for the step before it
+def step_complete(written, step):
+    return step in written and written.get(step - 6, set()) <= written[step]
+
+# Define a data variable using the GFS name, units and chunking, with the
+# variable's entry in `precision` (if any) applied on write
+def define_variable(f, variable, pl, y_shape, x_shape, compression=None, precision=None):
+    dims = ('time', 'level', 'latitude', 'longitude') if pl else ('time', 'latitude', 'longitude')
+    chunksizes = (1, 1, y_shape, x_shape) if 'level' in dims else (1, y_shape, x_shape)
+    gfsequivalent = ec2gfsmap[variable]
+    compression = {**(compression or codec_options()), **precision_options((precision or {}).get(gfsequivalent))}
+    create_variable(
+        f, gfsequivalent, dims, None, {
+            'long_name': varmap[gfsequivalent][0],
+            'units': varmap[gfsequivalent][1]
+        },
+        chunksizes, compression
+    )
 
 # Functions to create variables in the NetCDF file
-def create_variable(f, name, dimensions, data, attrs, chunksizes):
+def create_variable(f, name, dimensions, data, attrs, chunksizes, compression=None):
     dtype = 'i4' if name in ['time', 'level'] else 'f4'
-    var = f.createVariable(name, dtype, dimensions, compression='zlib', complevel=4, chunksizes=chunksizes)
+    compression = compression or codec_options()
+    var = f.createVariable(name, dtype, dimensions, chunksizes=chunksizes, **compression)
     if data is not None:
         var[:] = data
     for attr_name, attr_value in attrs.items():
@@ -180,14 +294,55 @@ def create_variable_nochunk(f, name, dimensions, data, attrs):
     for attr_name, attr_value in attrs.items():
         var.setncattr(attr_name, attr_value)
 
-infile = sys.argv[1]
-initconditions = sys.argv[2]
-model = sys.argv[3]
-date = sys.argv[4]
-time = sys.argv[5]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert AI model GRIB output to NetCDF")
+    parser.add_argument("infile")
+    parser.add_argument("initconditions")
+    parser.add_argument("model")
+    parser.add_argument("date")
+    parser.add_argument("time")
+    parser.add_argument("--follow", action="store_true",
+                        help="convert steps as the model appends them to infile")
+    parser.add_argument("--poll", type=float, default=10,
+                        help="seconds between checks for new messages in follow mode")
+    parser.add_argument("--timeout", type=float, default=3600,
+                        help="give up following after this many seconds without new messages")
+    parser.add_argument("--codec", choices=CODECS, default="zlib",
+                        help="compression codec for data variables")
+    parser.add_argument("--complevel", type=int, default=4)
+    parser.add_argument("--no-shuffle", dest="shuffle", action="store_false",
+                        help="disable the byte shuffle filter")
+    parser.add_argument("--compress-workers", type=int, default=4,
+                        help="threads compressing NetCDF chunks (0 compresses serially inside netCDF4)")
+    parser.add_argument("--decode-workers", type=int, default=0,
+                        help="processes decoding GRIB messages (0 decodes in the main process)")
+    parser.add_argument("--trim-precision", action="store_true",
+                        help="apply the lossy per-variable precision_table")
+    parser.add_argument("--precision", nargs="+", default=[], metavar="VAR=bits:N|digits:N",
+                        help="override (or add) precision settings, e.g. t=bits:11 apcp=digits:4")
+    parser.add_argument("--references", action="store_true",
+                        help="also write kerchunk references to <infile>.json")
+    parser.add_argument("--reference-url",
+                        help="URL the NetCDF will be served from, recorded in the references")
+    parser.add_argument("--timeseries", action="store_true",
+                        help="also write the time-series companion <infile>.ts.nc")
+    args = parser.parse_args()
+
+    precision = dict(precision_table) if args.trim_precision else {}
+    for item in args.precision:
+        variable, setting = item.split("=")
+        kind, n = setting.split(":")
+        precision[variable] = (kind, int(n))
 
-#Call the function
-grib2nc(infile, initconditions, model, date, time)
+    # Labels every metrics record, decode workers' included
+    metrics.labels.update(model=args.model, init=args.initconditions)
 
-#Call the function
-grib2nc(infile, initconditions, model, date, time)
+    #Call the function
+    with metrics.stage("grib2nc") as fields:
+        grib2nc(args.infile, args.initconditions, args.model, args.date, args.time,
+                follow=args.follow, poll=args.poll, timeout=args.timeout,
+                codec=args.codec, complevel=args.complevel, shuffle=args.shuffle,
+                compress_workers=args.compress_workers, precision=precision or None,
+                references=args.references, reference_url=args.reference_url,
+                decode_workers=args.decode_workers, timeseries=args.timeseries)
+        fields.update(bytes_in=metrics.size(args.infile), bytes_out=metrics.size(f"{args.infile}.nc"))
@@ -0,0 +1,126 @@
+import os
+import json
+import struct
+import time
+from collections import deque
+import pygrib as pg
+import metrics
+
+# Header keys recorded for every message in the index
+INDEX_KEYS = ['shortName', 'levelType', 'level', 'step', 'Nx', 'Ny']
+
+# Walk the GRIB section 0 headers and yield (offset, length) of every complete
+# message starting at byte `start`. Nothing past section 0 is read here, and a
+# partially written trailing message is left for the next call.
+def scan_messages(grib, start=0):
+    grib.seek(start)
+    offset = start
+    while True:
+        header = grib.read(16)
+        if len(header) < 16:
+            return
+        if header[:4] != b'GRIB':
+            # Skip padding between messages
+            skip = header.find(b'GRIB', 1)
+            if skip == -1:
+                offset += 13
+                grib.seek(offset)
+                continue
+            offset += skip
+            grib.seek(offset)
+            continue
+        edition = header[7]
+        if edition == 2:
+            length = struct.unpack('>Q', header[8:16])[0]
+        elif edition == 1:
+            length = int.from_bytes(header[4:7], 'big')
+        else:
+            raise ValueError(f"Unsupported GRIB edition {edition} at byte {offset}")
+        grib.seek(0, 2)
+        if offset + length > grib.tell():
+            return
+        yield offset, length
+        offset += length
+        grib.seek(offset)
+
+# Decode the header keys of a single message without unpacking its values
+def read_header(grib, offset, length):
+    grib.seek(offset)
+    grb = pg.fromstring(grib.read(length))
+    record = {key: grb[key] for key in INDEX_KEYS}
+    record['offset'] = offset
+    record['length'] = length
+    return record
+
+# Build a header-only index of `infile`, optionally resuming at byte `start`.
+# Returns the records and the offset where the next message will begin.
+def build_index(infile, start=0):
+    records = []
+    next_offset = start
+    with open(infile, 'rb') as grib:
+        for offset, length in list(scan_messages(grib, start)):
+            records.append(read_header(grib, offset, length))
+            next_offset = offset + length
+    return records, next_offset
+
+# Yield batches of newly completed messages while `infile` is still being
+# written. Stops once the file has not grown for `timeout` seconds.
+def follow_index(infile, poll=10, timeout=3600, start=0):
+    next_offset = start
+    last_growth = time.monotonic()
+    while True:
+        if os.path.exists(infile):
+            records, next_offset = build_index(infile, next_offset)
+            if records:
+                last_growth = time.monotonic()
+                yield records
+                continue
+        if time.monotonic() - last_growth > timeout:
+            return
+        time.sleep(poll)
+
+# Fetch one indexed message as a pygrib message (values are decoded on access)
+def read_message(grib, record):
+    grib.seek(record['offset'])
+    return pg.fromstring(grib.read(record['length']))
+
+def read_values(grib, record):
+    return read_message(grib, record).values
+
+# Persist the index next to the GRIB file so other tools can reuse it
+def save_index(records, outfile):
+    with open(outfile, 'w') as f:
+        json.dump(records, f)
+
+def load_index(infile):
+    with open(infile) as f:
+        return json.load(f)
+
+# GRIB file handles opened by each decode worker process
+_grib_files = {}
+
+# Decode one indexed message to float32, as stored in the NetCDF
+def decode_record(infile, record):
+    if infile not in _grib_files:
+        _grib_files[infile] = open(infile, 'rb')
+    with metrics.stage("grib2nc.decode", step=record['step'], shortName=record['shortName'],
+                       level=record['level'], bytes_in=record['length']):
+        return read_values(_grib_files[infile], record).astype('f4')
+
+# Yield (record, values) in the order given. With a multiprocessing pool the
+# messages are decoded in parallel by byte offset, with at most `depth`
+# messages in flight so decoded fields cannot pile up ahead of the caller.
+def decode_records(infile, records, pool=None, depth=8):
+    if pool is None:
+        for record in records:
+            yield record, decode_record(infile, record)
+        return
+    pending = deque()
+    for record in records:
+        pending.append((record, pool.apply_async(decode_record, (infile, record))))
+        if len(pending) >= depth:
+            record, result = pending.popleft()
+            yield record, result.get()
+    while pending:
+        record, result = pending.popleft()
+        yield record, result.get()
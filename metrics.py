@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import resource
+import argparse
+import subprocess as sp
+from contextlib import contextmanager
+from collections import defaultdict
+
+# Timing and resource records for the stages of a cycle, as JSON lines. Off
+# unless AIWP_METRICS names the cycle's metrics file (pipeline.py --metrics
+# sets it for everything it starts). Every process of the cycle, pool workers
+# included, appends one line per finished stage:
+#   {"stage": "contour", "model": "gc", "step": 3, "var": "t2", ..., "start": ...,
+#    "end": ..., "seconds": ..., "bytes_in": ..., "bytes_out": ..., "max_rss_mb": ..., "pid": ...}
+# max_rss_mb is the peak RSS of the process so far, or of the command for
+# external steps. `summary` and `prometheus` below aggregate a file by stage.
+
+path = os.environ.get("AIWP_METRICS")
+# Added to every record of this process, e.g. the model being converted. Set
+# before a pool starts so the workers inherit them.
+labels = {}
+
+def record(stage, start, end, **fields):
+    if not path:
+        return
+    line = {"stage": stage, **labels, "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            **fields, "start": round(start, 3), "end": round(end, 3), "seconds": round(end - start, 3), "pid": os.getpid()}
+    # One write per line to a file opened for appending, so lines from
+    # concurrent processes don't interleave
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(line) + "\n").encode())
+    finally:
+        os.close(fd)
+
+# Record the enclosed block as a stage. Yields the record's fields, so the
+# block can add what it measures (bytes_out, ...). A block that raises is
+# recorded with ok=False, unless it set ok itself.
+@contextmanager
+def stage(name, **fields):
+    if not path:
+        yield fields
+        return
+    start = time.time()
+    ok = False
+    try:
+        yield fields
+        ok = True
+    finally:
+        record(name, start, time.time(), **{"ok": ok, **fields})
+
+def size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+# subprocess.run(command, stderr=PIPE, text=True) that also puts the command's
+# peak RSS in `fields`. On Linux wait4 reports the largest of the command and
+# the descendants it waited for.
+def run(command, fields, **kwargs):
+    proc = sp.Popen(command, stderr=sp.PIPE, text=True, **kwargs)
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    fields["max_rss_mb"] = round(usage.ru_maxrss / 1024, 1)
+    return sp.CompletedProcess(command, proc.returncode, None, stderr)
+
+def load(filename):
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# Per stage (and model, where recorded): count, failures, summed seconds,
+# elapsed seconds from the first start to the last end, bytes and peak RSS
+def aggregate(records):
+    groups = defaultdict(list)
+    for line in records:
+        groups[(line["stage"], str(line.get("model", "")))].append(line)
+    rows = []
+    for (name, model), lines in groups.items():
+        rows.append({"stage": name, "model": model, "count": len(lines),
+                     "failed": sum(not line.get("ok", True) for line in lines),
+                     "seconds": sum(line["seconds"] for line in lines),
+                     "elapsed": max(line["end"] for line in lines) - min(line["start"] for line in lines),
+                     "bytes_in": sum(line.get("bytes_in", 0) for line in lines),
+                     "bytes_out": sum(line.get("bytes_out", 0) for line in lines),
+                     "max_rss_mb": max(line.get("max_rss_mb", 0) for line in lines)})
+    return sorted(rows, key=lambda row: row["seconds"], reverse=True)
+
+def summary(records):
+    print(f"{'stage':<24} {'model':<12} {'count':>6} {'failed':>6} {'seconds':>9} {'elapsed':>9} "
+          f"{'MB in':>9} {'MB out':>9} {'RSS MB':>8}")
+    for row in aggregate(records):
+        print(f"{row['stage']:<24} {row['model']:<12} {row['count']:>6} {row['failed']:>6} {row['seconds']:>9.1f} "
+              f"{row['elapsed']:>9.1f} {row['bytes_in'] / 1e6:>9.1f} {row['bytes_out'] / 1e6:>9.1f} {row['max_rss_mb']:>8.0f}")
+
+# The aggregates in the Prometheus text format, written under another name
+# and renamed so the node_exporter textfile collector never reads half a file
+def write_prometheus(records, filename, cycle):
+    metrics = [("count", "aiwp_stage_runs", "Finished runs of the stage"),
+               ("failed", "aiwp_stage_failures", "Failed runs of the stage"),
+               ("seconds", "aiwp_stage_seconds", "Summed duration of the stage's runs"),
+               ("elapsed", "aiwp_stage_elapsed_seconds", "First start to last end of the stage"),
+               ("bytes_in", "aiwp_stage_bytes_in", "Bytes read by the stage"),
+               ("bytes_out", "aiwp_stage_bytes_out", "Bytes written by the stage"),
+               ("max_rss_mb", "aiwp_stage_max_rss_megabytes", "Peak RSS of the stage's processes")]
+    rows = aggregate(records)
+    text = []
+    for key, name, description in metrics:
+        text += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+        for row in rows:
+            text.append(f'{name}{{cycle="{cycle}",stage="{row["stage"]}",model="{row["model"]}"}} {row[key]:g}')
+    with open(f"{filename}.part", "w") as f:
+        f.write("\n".join(text) + "\n")
+    os.replace(f"{filename}.part", filename)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a cycle's metrics file, or convert it for Prometheus")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary_parser = commands.add_parser("summary", help="print per-stage totals, slowest first")
+    summary_parser.add_argument("metrics")
+    prometheus_parser = commands.add_parser("prometheus", help="write per-stage totals as a Prometheus textfile")
+    prometheus_parser.add_argument("metrics")
+    prometheus_parser.add_argument("textfile")
+    prometheus_parser.add_argument("--cycle", help="cycle label (default: the metrics file name)")
+    args = parser.parse_args()
+
+    records = load(args.metrics)
+    if args.command == "summary":
+        summary(records)
+    else:
+        write_prometheus(records, args.textfile, args.cycle or os.path.basename(args.metrics).split(".")[0])
@@ -0,0 +1,145 @@
+import os
+import json
+import shutil
+import numpy as np
+
+# Mapbox Vector Tiles (spec v2) for point layers, written straight from
+# arrays into a tippecanoe-style {z}/{x}/{y}.pbf directory with uncompressed
+# tiles (tippecanoe -e ... --no-tile-compression --drop-rate=0). Follows
+# tippecanoe's defaults: web mercator, 4096 extent, a buffer of 5/256 of a
+# tile around each tile, points beyond the mercator latitude limit left out,
+# numeric properties stored as doubles.
+
+EXTENT = 4096
+BUFFER = 5 * EXTENT // 256
+MAX_LAT = 85.0511287798066
+
+def varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+# Length-delimited field
+def message(number, payload):
+    return varint(number << 3 | 2) + varint(len(payload)) + payload
+
+# Varints of an array of non-negative integers, back to back
+def varints(values):
+    values = np.asarray(values, np.uint64).ravel()
+    nbytes = np.ones(len(values), np.int64)
+    top = int(values.max()) if len(values) else 0
+    for k in range(1, 10):
+        if top < 1 << 7 * k:
+            break
+        nbytes += values >= np.uint64(1 << 7 * k)
+    offsets = np.cumsum(nbytes) - nbytes
+    out = np.empty(nbytes.sum(), np.uint8)
+    for k in range(nbytes.max()):
+        has = nbytes > k
+        byte = (values[has] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        out[offsets[has] + k] = byte | np.where(nbytes[has] > k + 1, 0x80, 0).astype(np.uint64)
+    return out, nbytes
+
+# Web mercator world coordinates in [0, 1) of the points inside its latitude
+# range, and which points those are
+def world_xy(lon, lat):
+    inside = np.flatnonzero(np.abs(lat) <= MAX_LAT)
+    lat = np.radians(lat[inside])
+    x = ((lon[inside] + 180) / 360) % 1
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2
+    return x, np.clip(y, 0, np.nextafter(1, 0)), inside
+
+# Points of each tile at a zoom, including those within BUFFER of its edges:
+# yields (tile x, tile y, point indices, pixel x, pixel y within the tile)
+def tile_points(x, y, zoom):
+    n = 1 << zoom
+    px = np.floor(x * n * EXTENT).astype(np.int64)
+    py = np.floor(y * n * EXTENT).astype(np.int64)
+    tiles, points = [], []
+    for dx in (-BUFFER, BUFFER):
+        for dy in (-BUFFER, BUFFER):
+            tx = np.clip((px + dx) // EXTENT, 0, n - 1)
+            ty = np.clip((py + dy) // EXTENT, 0, n - 1)
+            tiles.append(tx * n + ty)
+            points.append(np.arange(len(px)))
+    # The four buffer corners usually land in the same tile; keep each
+    # (tile, point) pair once, sorted by tile
+    pairs = np.unique(np.concatenate(tiles) * len(px) + np.concatenate(points))
+    tile, point = np.divmod(pairs, len(px))
+    starts = np.flatnonzero(np.diff(tile, prepend=-1))
+    for start, stop in zip(starts, np.append(starts[1:], len(tile))):
+        tx, ty = divmod(int(tile[start]), n)
+        index = point[start:stop]
+        yield tx, ty, index, px[index] - tx * EXTENT, py[index] - ty * EXTENT
+
+# One layer of point features with numeric properties (name -> array). Every
+# field of a point feature is a varint, so the features are encoded as rows of
+# varints in one go. Values are not deduplicated: value i*k+j is property j of
+# feature i.
+def encode_point_layer(name, px, py, properties):
+    keys = list(properties)
+    n, k = len(px), len(keys)
+    vi = np.arange(n * k, dtype=np.int64).reshape(n, k)
+    tags = np.empty((n, 2 * k), np.int64)
+    tags[:, 0::2] = np.arange(k)
+    tags[:, 1::2] = vi
+    zx = zigzag(np.asarray(px, np.int64))
+    zy = zigzag(np.asarray(py, np.int64))
+    _, tag_bytes = varints(tags)
+    _, x_bytes = varints(zx)
+    _, y_bytes = varints(zy)
+    tag_len = tag_bytes.reshape(n, 2 * k).sum(axis=1)
+    geom_len = 1 + x_bytes + y_bytes
+    # Feature: tags (field 2), type POINT (field 3), geometry (field 4)
+    rows = np.column_stack([
+        np.full(n, 0x12), np.zeros(n, np.int64), np.full(n, 0x12), tag_len, tags,
+        np.full(n, 0x18), np.ones(n, np.int64), np.full(n, 0x22), geom_len, np.full(n, 9), zx, zy])
+    _, tag_len_bytes = varints(tag_len)
+    _, geom_len_bytes = varints(geom_len)
+    rows[:, 1] = 1 + tag_len_bytes + tag_len + 2 + 1 + geom_len_bytes + geom_len
+    features, _ = varints(rows)
+
+    # Value messages (field 4) holding doubles: 0x22, 9, 0x19, 8 bytes
+    doubles = np.column_stack([np.asarray(properties[key], np.float64) for key in keys]).reshape(-1)
+    values = np.empty((len(doubles), 11), np.uint8)
+    values[:, :3] = [0x22, 0x09, 0x19]
+    values[:, 3:] = doubles.astype('<f8').view(np.uint8).reshape(-1, 8)
+
+    layer = (b'\x78\x02' + message(1, name.encode()) + features.tobytes()
+             + b''.join(message(3, key.encode()) for key in keys)
+             + values.tobytes() + b'\x28' + varint(EXTENT))
+    return message(3, layer)
+
+# Write the tiles of a point layer for zooms minzoom..maxzoom to tiledir,
+# replacing what was there, with a tippecanoe-style metadata.json
+def write_point_tiles(tiledir, layer, lon, lat, properties, minzoom, maxzoom):
+    if os.path.isdir(tiledir):
+        shutil.rmtree(tiledir)
+    lon, lat = np.asarray(lon, np.float64), np.asarray(lat, np.float64)
+    x, y, inside = world_xy(lon, lat)
+    properties = {key: np.asarray(values)[inside] for key, values in properties.items()}
+    for zoom in range(minzoom, maxzoom + 1):
+        for tx, ty, index, px, py in tile_points(x, y, zoom):
+            os.makedirs(f"{tiledir}/{zoom}/{tx}", exist_ok=True)
+            tile = encode_point_layer(layer, px, py, {key: values[index] for key, values in properties.items()})
+            with open(f"{tiledir}/{zoom}/{tx}/{ty}.pbf", 'wb') as f:
+                f.write(tile)
+
+    bounds = [lon[inside].min(), max(lat[inside].min(), -MAX_LAT), lon[inside].max(), min(lat[inside].max(), MAX_LAT)]
+    vector_layers = [{"id": layer, "description": "", "minzoom": minzoom, "maxzoom": maxzoom,
+                      "fields": {key: "Number" for key in properties}}]
+    metadata = {
+        "name": layer, "description": layer, "version": "2", "type": "overlay", "format": "pbf",
+        "minzoom": str(minzoom), "maxzoom": str(maxzoom),
+        "bounds": ",".join(f"{value:.6f}" for value in bounds),
+        "center": f"{(bounds[0] + bounds[2]) / 2:.6f},{(bounds[1] + bounds[3]) / 2:.6f},{maxzoom}",
+        "json": json.dumps({"vector_layers": vector_layers}),
+    }
+    with open(f"{tiledir}/metadata.json", 'w') as f:
+        json.dump(metadata, f, indent=4)
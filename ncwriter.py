@@ -0,0 +1,230 @@
+import zlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from netCDF4 import Dataset as DS
+from netCDF4 import default_fillvals
+import metrics
+
+# Optional dependencies for the parallel write path
+try:
+    import h5py
+except ImportError:
+    h5py = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import numcodecs
+except ImportError:
+    numcodecs = None
+
+# Codecs that can be selected for data variables
+CODECS = ['zlib', 'zstd', 'blosc_lz4', 'blosc_lz4hc', 'blosc_zlib', 'blosc_zstd', 'none']
+
+# HDF5 filter ids and the blosc compressor codes used by netCDF-C
+SHUFFLE_FILTER = 2
+DEFLATE_FILTER = 1
+ZSTD_FILTER = 32015
+BLOSC_FILTER = 32001
+blosc_compressors = {0: 'blosclz', 1: 'lz4', 2: 'lz4hc', 3: 'snappy', 4: 'zlib', 5: 'zstd'}
+
+# Keyword arguments for netCDF4's createVariable for a given codec
+def codec_options(codec='zlib', complevel=4, shuffle=True):
+    if codec == 'none':
+        return {'compression': None}
+    if codec.startswith('blosc'):
+        return {'compression': codec, 'complevel': complevel, 'shuffle': False,
+                'blosc_shuffle': 1 if shuffle else 0}
+    return {'compression': codec, 'complevel': complevel, 'shuffle': shuffle}
+
+# Check that netCDF-C has the HDF5 filter plugin needed for a codec
+def codec_available(f, codec):
+    if codec == 'zstd':
+        return f.has_zstd_filter()
+    if codec.startswith('blosc'):
+        return f.has_blosc_filter()
+    return True
+
+# Zero all but `keepbits` explicit mantissa bits of float32 values, rounding to
+# nearest. Same arithmetic as netCDF-C's BitRound quantize mode.
+def bitround(values, keepbits):
+    drop = 23 - keepbits
+    if drop <= 0:
+        return values
+    bits = np.ascontiguousarray(values, dtype='f4').view(np.uint32)
+    mask = np.uint32((0xFFFFFFFF << drop) & 0xFFFFFFFF)
+    half = np.uint32(1 << (drop - 1))
+    return ((bits + half) & mask).view(np.float32)
+
+# Round to a power-of-two step finer than 10**-digits. Same arithmetic as
+# netCDF4's least_significant_digit option.
+def round_digits(values, digits):
+    exp = np.log10(10. ** -digits)
+    exp = int(np.floor(exp)) if exp < 0 else int(np.ceil(exp))
+    scale = 2. ** np.ceil(np.log2(10. ** -exp))
+    return (np.around(scale * values) / scale).astype(values.dtype)
+
+# Apply a ('bits', n) or ('digits', n) precision setting, leaving fill values alone
+def trim_precision(values, setting, fill_value):
+    kind, n = setting
+    trimmed = bitround(values, n) if kind == 'bits' else round_digits(values, n)
+    return np.where(values == fill_value, values, trimmed)
+
+# createVariable keyword arguments that make netCDF4 apply a precision setting
+# and record it in the variable attributes
+def precision_options(setting):
+    if setting is None:
+        return {}
+    kind, n = setting
+    if kind == 'bits':
+        return {'significant_digits': n, 'quantize_mode': 'BitRound'}
+    if kind == 'digits':
+        return {'least_significant_digit': n}
+    raise ValueError(f"Unknown precision setting {setting}")
+
+# Precision setting recorded on an HDF5 dataset by netCDF4, if any
+def recorded_precision(dataset):
+    if '_QuantizeBitRoundNumberOfSignificantBits' in dataset.attrs:
+        return ('bits', int(dataset.attrs['_QuantizeBitRoundNumberOfSignificantBits'][0]))
+    if 'least_significant_digit' in dataset.attrs:
+        return ('digits', int(dataset.attrs['least_significant_digit'][0]))
+    return None
+
+# Apply an HDF5 filter pipeline to one chunk in Python. Shuffle, deflate and
+# zstd produce exactly the bytes HDF5 would store; blosc produces a frame the
+# blosc plugin decodes. Runs on the worker threads; zlib, zstandard and blosc
+# all release the GIL while compressing.
+def compress_chunk(values, pipeline):
+    data = values.tobytes()
+    for filter_id, cd_values in pipeline:
+        if filter_id == SHUFFLE_FILTER:
+            data = np.frombuffer(data, np.uint8).reshape(-1, values.itemsize).T.tobytes()
+        elif filter_id == DEFLATE_FILTER:
+            data = zlib.compress(data, cd_values[0])
+        elif filter_id == ZSTD_FILTER:
+            data = zstandard.ZstdCompressor(level=cd_values[0]).compress(data)
+        elif filter_id == BLOSC_FILTER:
+            blosc = numcodecs.Blosc(cname=blosc_compressors[cd_values[6]], clevel=cd_values[4],
+                                    shuffle=cd_values[5], blocksize=0)
+            # Blosc is always the only filter, so hand it the typed array to
+            # shuffle on the element size
+            data = blosc.encode(np.frombuffer(data, dtype=values.dtype))
+        else:
+            raise ValueError(f"No Python implementation of HDF5 filter {filter_id}")
+    return data
+
+# compress_chunk on a worker thread, recorded as a metrics stage
+def compress_field(values, pipeline, name, index):
+    with metrics.stage("grib2nc.compress", var=name, index=list(index), bytes_in=values.nbytes) as fields:
+        data = compress_chunk(values, pipeline)
+        fields["bytes_out"] = len(data)
+    return data
+
+# Filters on a dataset that this module can reproduce, or None if any is unknown
+def filter_pipeline(dataset):
+    plist = dataset.id.get_create_plist()
+    pipeline = []
+    for i in range(plist.get_nfilters()):
+        filter_id, _, cd_values, _ = plist.get_filter(i)
+        if filter_id == ZSTD_FILTER and zstandard is None:
+            return None
+        if filter_id == BLOSC_FILTER and numcodecs is None:
+            return None
+        if filter_id not in [SHUFFLE_FILTER, DEFLATE_FILTER, ZSTD_FILTER, BLOSC_FILTER]:
+            return None
+        pipeline.append((filter_id, cd_values))
+    return pipeline
+
+# Writes whole-field chunks into an existing NetCDF file. With workers > 0 the
+# chunks are compressed on a thread pool and stored with HDF5 direct chunk
+# writes, bypassing the serial filter pipeline inside the netCDF4 write call.
+# With workers=0, or without h5py, values go through netCDF4 as before.
+class ChunkWriter:
+
+    def __init__(self, path, workers=4):
+        self.path = path
+        self.workers = workers
+        if workers and h5py is None:
+            logging.warning("h5py is not installed, compressing NetCDF chunks serially")
+            self.workers = 0
+        self.pool = ThreadPoolExecutor(self.workers) if self.workers else None
+        self.pending = deque()
+        self.pipelines = {}
+        self.precisions = {}
+        self.open()
+
+    def open(self):
+        if self.workers:
+            self.h5 = h5py.File(self.path, 'r+')
+        else:
+            self.nc = DS(self.path, 'a')
+
+    @property
+    def variables(self):
+        return list(self.h5.keys()) if self.workers else list(self.nc.variables)
+
+    # Define new variables with netCDF4 so they carry the usual metadata
+    def define(self, func, *args, **kwargs):
+        if self.workers:
+            self.flush()
+            self.h5.close()
+            with DS(self.path, 'a') as f:
+                func(f, *args, **kwargs)
+            self.pipelines.clear()
+            self.precisions.clear()
+            self.open()
+        else:
+            func(self.nc, *args, **kwargs)
+
+    # Write one field at the leading `index` (e.g. (timestep, levelind)) of a
+    # variable chunked as one field per chunk
+    def write(self, name, index, values):
+        if not self.workers:
+            self.nc.variables[name][index] = values
+            return
+        dataset = self.h5[name]
+        if name not in self.pipelines:
+            pipeline = filter_pipeline(dataset)
+            if dataset.chunks is None or dataset.chunks[len(index):] != dataset.shape[len(index):]:
+                pipeline = None
+            self.pipelines[name] = pipeline
+            self.precisions[name] = recorded_precision(dataset)
+        pipeline = self.pipelines[name]
+        fill_value = default_fillvals[dataset.dtype.str[1:]]
+        chunk = np.ma.filled(values, fill_value)
+        chunk = np.ascontiguousarray(chunk, dtype=dataset.dtype)
+        # Direct chunk writes bypass netCDF4's quantization, so apply it here
+        if self.precisions[name] is not None:
+            chunk = trim_precision(chunk, self.precisions[name], fill_value)
+        if pipeline is None:
+            dataset[index] = chunk
+            return
+        offset = tuple(index) + (0,) * (dataset.ndim - len(index))
+        future = self.pool.submit(compress_field, chunk, pipeline, name, index)
+        self.pending.append((dataset, offset, future))
+        # Bound the number of fields held in memory
+        while len(self.pending) > 2 * self.workers:
+            self.store_next()
+
+    def store_next(self):
+        dataset, offset, future = self.pending.popleft()
+        dataset.id.write_direct_chunk(offset, future.result())
+
+    def flush(self):
+        if self.workers:
+            while self.pending:
+                self.store_next()
+            self.h5.flush()
+        else:
+            self.nc.sync()
+
+    def close(self):
+        self.flush()
+        if self.workers:
+            self.h5.close()
+            self.pool.shutdown()
+        else:
+            self.nc.close()
@@ -0,0 +1,338 @@
+import os
+import sys
+import time
+import shlex
+import logging
+import argparse
+import subprocess as sp
+from pathlib import Path
+import metrics
+import cache
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+# Run a forecast cycle as a dependency graph instead of the run scripts'
+# fixed order. Each stage is one or more commands run one after another and
+# takes a slot of its class (gpu, cpu or io) while it runs, so e.g. one model
+# runs on the GPU at a time while the previous model is uploaded and
+# contoured. A stage starts as soon as the stages it needs have succeeded (or
+# just finished, for `always` stages) and, for `follows`, once the stages it
+# follows have started. A stage whose needs failed is skipped. With --metrics,
+# every stage is recorded (duration, exit, peak RSS of its commands, bytes of
+# its inputs and outputs) in the cycle's metrics file, which the scripts it
+# runs add their own records to.
+
+class Stage:
+    def __init__(self, name, commands, slot=None, needs=(), follows=(), always=False, cwd=None, inputs=(), outputs=()):
+        self.name = name
+        self.commands = commands
+        self.slot = slot
+        self.needs = list(needs)
+        self.follows = list(follows)
+        self.always = always
+        self.cwd = cwd
+        # Files whose sizes are recorded as the stage's bytes in and out
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+# Returns {stage name: 'done', 'failed' or 'skipped'} and {stage name:
+# seconds it ran}, logging each stage as it finishes. Stages named in `done`
+# are not run and count as done (finished by an earlier, interrupted run).
+# Stages are started in list order when several are ready, so list the ones
+# that should win a contended slot first. With `stub`, every command
+# is run as `stub <command>` instead, to try out the graph locally.
+def run_stages(stages, slots, poll=1, stub=None, done=()):
+    by_name = {stage.name: stage for stage in stages}
+    state = {stage.name: 'done' if stage.name in done else 'waiting' for stage in stages}
+    for name in done:
+        logging.info(f"{name} done in an earlier run")
+    running = {}
+    times = {}
+    while any(value in ('waiting', 'running') for value in state.values()):
+        for stage in stages:
+            if stage.name not in running:
+                continue
+            proc, remaining, start, peak = running[stage.name]
+            finished = reap(proc)
+            if finished is None:
+                continue
+            code, rss = finished
+            peak = max(peak, rss)
+            if code == 0 and remaining:
+                running[stage.name] = (launch(remaining[0], stage.cwd, stub), remaining[1:], start, peak)
+                continue
+            del running[stage.name]
+            times[stage.name] = time.time() - start
+            state[stage.name] = 'done' if code == 0 else 'failed'
+            logging.info(f"{stage.name} {'done' if code == 0 else f'FAILED (exit {code})'} in {times[stage.name]:.0f}s")
+            record_stage(stage, start, state[stage.name], exit=code, max_rss_mb=round(peak, 1))
+
+        for stage in stages:
+            if state[stage.name] == 'running' and any(state[name] == 'failed' for name in stage.follows):
+                # Nothing more is coming for it (e.g. a conversion following a failed model)
+                proc = running[stage.name][0]
+                if proc and proc.returncode is None:
+                    proc.terminate()
+            if state[stage.name] != 'waiting':
+                continue
+            needs = [state[name] for name in stage.needs]
+            if any(value in ('failed', 'skipped') for value in needs + [state[name] for name in stage.follows]) and not stage.always:
+                state[stage.name] = 'skipped'
+                logging.warning(f"{stage.name} skipped")
+                record_stage(stage, time.time(), 'skipped')
+                continue
+            if any(value in ('waiting', 'running') for value in needs):
+                continue
+            if any(state[name] == 'waiting' for name in stage.follows):
+                continue
+            if stage.slot and sum(by_name[name].slot == stage.slot for name in running) >= slots[stage.slot]:
+                continue
+            logging.info(f"{stage.name} starting")
+            running[stage.name] = (launch(stage.commands[0], stage.cwd, stub), stage.commands[1:], time.time(), 0.)
+            state[stage.name] = 'running'
+        time.sleep(poll)
+    return state, times
+
+# Exit code and peak RSS (MB) of a finished command, or None while it runs.
+# Reaped with wait4 rather than Popen.poll to get its resource usage.
+def reap(proc):
+    if proc is None:
+        return 127, 0.
+    pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+    if pid == 0:
+        return None
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, usage.ru_maxrss / 1024
+
+def record_stage(stage, start, state, **fields):
+    cwd = Path(stage.cwd or '.')
+    metrics.record(stage.name, start, time.time(), state=state, ok=state == 'done', slot=stage.slot,
+                   bytes_in=sum(metrics.size(cwd / path) for path in stage.inputs),
+                   bytes_out=sum(metrics.size(cwd / path) for path in stage.outputs), **fields)
+
+# The started process, or None if the command could not be started
+def launch(command, cwd, stub):
+    logging.info(shlex.join(command))
+    try:
+        return sp.Popen(([stub] if stub else []) + command, cwd=cwd)
+    except OSError as e:
+        logging.error(f"Could not start {command[0]}: {e}")
+        return None
+
+# Models as (name in the scripts, ai-models model, output prefix, extra ai-models arguments)
+MODELS = [
+    ('fcnv2', 'fourcastnetv2-small', 'FOUR_v200', []),
+    ('pw', 'panguweather', 'PANG_v100', []),
+    ('gc', 'graphcast', 'GRAP_v100', []),
+    ('au', 'aurora', 'AURO_v100', ['--model-version', '0.25-finetuned']),
+]
+AI_MODELS_INPUT = {'gfs': 'gfs', 'ifs': 'opendata'}
+
+# Local path (without .nc) and S3 key of a model's output, as in the scripts
+def model_paths(args, prefix):
+    product = f"{prefix}_{args.init.upper()}"
+    tail = f"{product}_{args.year}{args.month}{args.day}{args.hh}_f000_f240_06"
+    return (f"{args.cwd}/output_data/{product}/{args.year}/{args.month}{args.day}/{tail}",
+            f"{args.s3bucket}/{product}/{args.year}/{args.month}{args.day}/{tail}")
+
+# The stages of run_<init>_with_contouring.sh for one cycle (without
+# geojson_path, those of run_<init>.sh): per model run -> convert ->
+# remove GRIB / upload, one contouring service for the cycle, then tile ->
+# publish. Listed by kind, so conversions win a contended cpu slot over
+# tiling and the GRIB being written is never left unfollowed.
+def cycle_stages(args):
+    date, ic = f"{args.year}{args.month}{args.day}", args.init.upper()
+    cwd = args.cwd
+    runs, converts, removes, uploads, contours, companions = [], [], [], [], [], []
+    jobs = []
+    for name, model, prefix, extra in MODELS:
+        if name not in args.models:
+            continue
+        path, s3 = model_paths(args, prefix)
+        runs.append(
+            Stage(f"run_{name}", [[args.aimodels, "--input", AI_MODELS_INPUT[args.init], "--assets", f"{cwd}/assets/{name}",
+                                   "--date", date, "--time", f"{args.hh}00", "--path", path, model] + extra], slot='gpu',
+                  outputs=[path]))
+        # Follows the GRIB while the model writes it
+        convert = [args.python, f"{cwd}/grib2nc.py", path, ic, model, date, f"{args.hh}00", "--follow",
+                   "--decode-workers", str(args.grib2nc_decode_workers),
+                   "--compress-workers", str(args.grib2nc_compress_workers)]
+        if args.references:
+            convert += ["--references", "--reference-url", f"{s3}.nc"]
+        converts.append(
+            Stage(f"convert_{name}", [convert], slot='cpu', follows=[f"run_{name}"], inputs=[path],
+                  outputs=[f"{path}{suffix}" for suffix in products(args)]))
+        removes.append(Stage(f"remove_grib_{name}", [["rm", path]], needs=[f"run_{name}", f"convert_{name}"]))
+        if args.uploader == 'aws':
+            upload = [[args.aws, "s3", "cp", f"{path}{suffix}", f"{s3}{suffix}", "--profile", "noaa"] for suffix in products(args)]
+        else:
+            upload = [[args.python, f"{cwd}/upload.py"] + [arg for suffix in products(args) for arg in [f"{path}{suffix}", f"{s3}{suffix}"]]
+                      + ["--profile", "noaa"]]
+        uploads.append(Stage(f"upload_{name}", upload, slot='io', needs=[f"convert_{name}"],
+                             inputs=[f"{path}{suffix}" for suffix in products(args)]))
+        if args.timeseries:
+            companions.append(Stage(f"timeseries_{name}", [[args.python, f"{cwd}/timeseries.py", "write", f"{path}.nc",
+                                                            "--workers", str(args.grib2nc_compress_workers)]],
+                                    slot='cpu', needs=[f"convert_{name}"], inputs=[f"{path}.nc"], outputs=[f"{path}.ts.nc"]))
+        jobs.append((name, f"{path}.nc"))
+
+    if args.geojson_path:
+        # One contour_service.py for the whole cycle, started at once so its
+        # imports and workers are up before the first NetCDF. It has no slot:
+        # its pool of contour_workers is the cycle's contouring. It queues each
+        # model as its NetCDF appears, and stops waiting for the rest once
+        # every conversion has finished.
+        converted = stop_file(args)
+        command = [args.python_contours, f"{cwd}/contour_service.py", args.year, args.month, args.day, args.hh,
+                   args.geojson_path, "--workers", str(args.contour_workers), "--maximum-zoom", str(args.maximum_zoom),
+                   "--poll", "5", "--stop-file", converted]
+        for name, netcdf in jobs:
+            command += ["--job", name, args.init, netcdf]
+        if args.tippecanoe:
+            command += ["--tippecanoe", args.tippecanoe]
+        if args.cache:
+            command += ["--cache", args.cache]
+        contours.append(Stage("contour", [command], inputs=[netcdf for name, netcdf in jobs]))
+        contours.append(Stage("converted", [["touch", converted]], needs=[stage.name for stage in converts], always=True))
+
+    stages = runs + converts + removes + uploads + contours
+    if args.geojson_path:
+        cycle = f"{date}_{args.hh}"
+        # Like the scripts, tile and publish whatever was contoured even if a model failed
+        stages.append(Stage("tile", [[args.python_contours, f"{cwd}/tiling.py", f"{args.geojson_path}/{cycle}",
+                                      "--tippecanoe", args.tippecanoe or "tippecanoe",
+                                      "--maximum-zoom", str(args.maximum_zoom)] + (["--cache", args.cache] if args.cache else [])],
+                            slot='cpu', needs=["contour"], always=True))
+        remote = "/mnt/data1/aiweather/geojsons/"
+        if args.tile_output == 'archive':
+            published = f"{cycle}.tiles.sqlite"
+            publish = [[args.python_contours, f"{cwd}/archive.py", "pack", cycle, f"{cycle}.tiles.sqlite", "--gzip", "--remove"],
+                       ["scp", f"{cycle}.tiles.sqlite", f"{args.aiweather_address}:{remote}"]]
+        else:
+            published = f"{cycle}.zip"
+            publish = [["zip", "-r", "-0", f"{cycle}.zip", cycle],
+                       ["scp", f"{cycle}.zip", f"{args.aiweather_address}:{remote}"],
+                       ["ssh", args.aiweather_address, f"unzip {remote}{cycle}.zip -d {remote}"]]
+        stages.append(Stage("publish", publish, slot='io', needs=["tile"], always=True, cwd=args.geojson_path,
+                            outputs=[published]))
+    # Last, so time-series companions only take cpu slots nothing else is waiting for
+    return stages + companions
+
+# Created once every conversion has finished, so the contouring service stops
+# waiting for NetCDFs of conversions that failed
+def stop_file(args):
+    return f"{args.geojson_path}/{args.year}{args.month}{args.day}_{args.hh}.converted"
+
+# Files each conversion makes and each upload sends: the NetCDF, and with
+# --references the kerchunk references next to it
+def products(args):
+    return [".nc", ".json"] if args.references else [".nc"]
+
+# Models whose conversion an earlier run of the cycle finished (grib2nc.py
+# renames the NetCDF into place when complete, then writes the references)
+def converted(args):
+    return [name for name, model, prefix, extra in MODELS
+            if name in args.models and all(Path(f"{model_paths(args, prefix)[0]}{suffix}").exists() for suffix in products(args))]
+
+# What the scripts did before starting: output directories, and no GRIBs or
+# NetCDFs left by an interrupted run for grib2nc.py --follow or
+# contour_service.py to pick up. With --resume, converted models keep their
+# NetCDFs (and time-series companions). Also evicts old entries from the cache.
+def prepare(args):
+    keep = converted(args) if args.resume else []
+    for name, model, prefix, extra in MODELS:
+        if name in args.models:
+            path = Path(model_paths(args, prefix)[0])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            for stale in [path] if name in keep else [path, Path(f"{path}.nc"), Path(f"{path}.json"), Path(f"{path}.ts.nc")]:
+                stale.unlink(missing_ok=True)
+    if args.geojson_path:
+        Path(args.geojson_path).mkdir(parents=True, exist_ok=True)
+        Path(stop_file(args)).unlink(missing_ok=True)
+    if args.cache:
+        cache.directory = args.cache
+        Path(args.cache).mkdir(parents=True, exist_ok=True)
+        removed, total = cache.evict(args.cache_max_age_days * 86400, args.cache_max_size_gb * 1e9)
+        logging.info(f"Evicted {removed} cache entries, {total / 1e9:.1f} GB left in {args.cache}")
+    return keep
+
+# Stages of kept models (see prepare) that an earlier run finished
+def resumed(args, keep):
+    done = [f"{kind}_{name}" for name in keep for kind in ["run", "convert", "remove_grib"]]
+    done += [f"timeseries_{name}" for name, model, prefix, extra in MODELS
+             if name in keep and Path(f"{model_paths(args, prefix)[0]}.ts.nc").exists()]
+    return done
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run, convert, upload, contour and tile a forecast cycle as a dependency graph")
+    for name in ["year", "month", "day", "hh"]:
+        parser.add_argument(name)
+    parser.add_argument("init", choices=["gfs", "ifs"], help="initial conditions")
+    parser.add_argument("--cwd", required=True, help="aiwp-realtime working directory (output_data, assets and the scripts)")
+    parser.add_argument("--python", default=sys.executable, help="python for grib2nc.py")
+    parser.add_argument("--aimodels", required=True, help="ai-models (IFS) or ai-models-gfs (GFS) binary")
+    parser.add_argument("--uploader", choices=["python", "aws"], default="aws",
+                        help="upload with aws s3 cp or upload.py (parallel parts, unchanged files skipped; needs boto3)")
+    parser.add_argument("--references", action="store_true",
+                        help="also write kerchunk references (<file>.json) for each NetCDF and upload them next to it")
+    parser.add_argument("--aws", default="aws")
+    parser.add_argument("--s3bucket", default="s3://noaa-oar-mlwp-data")
+    parser.add_argument("--models", nargs="+", default=[model[0] for model in MODELS], choices=[model[0] for model in MODELS])
+    parser.add_argument("--grib2nc-decode-workers", type=int, default=2)
+    parser.add_argument("--grib2nc-compress-workers", type=int, default=4)
+    parser.add_argument("--geojson-path", help="contour, tile and publish into this directory (skipped if not given)")
+    parser.add_argument("--python-contours", default=sys.executable, help="python for the contouring and tiling scripts")
+    parser.add_argument("--contour-workers", type=int, default=14, help="worker processes of the cycle's contouring service")
+    parser.add_argument("--tippecanoe")
+    parser.add_argument("--maximum-zoom", type=int, default=4)
+    parser.add_argument("--tile-output", choices=["zip", "archive"], default="zip")
+    parser.add_argument("--aiweather-address", default="jradford@www2.cira.colostate.edu")
+    parser.add_argument("--gpu", type=int, default=1, help="model runs at a time")
+    parser.add_argument("--cpu", type=int, default=3, help="conversion, tiling and time-series stages at a time")
+    parser.add_argument("--io", type=int, default=2, help="upload and publish stages at a time")
+    parser.add_argument("--cache", help="content-addressed cache of contour and tile outputs, so reruns only redo what changed")
+    parser.add_argument("--cache-max-age-days", type=float, default=7, help="evict cache entries not used for this long")
+    parser.add_argument("--cache-max-size-gb", type=float, default=50, help="then evict the least recently used down to this size")
+    parser.add_argument("--resume", action="store_true",
+                        help="keep NetCDFs an earlier run of the cycle finished, and skip their model runs and conversions")
+    parser.add_argument("--timeseries", action="store_true",
+                        help="also write each NetCDF's time-series companion (<file>.ts.nc, see timeseries.py)")
+    parser.add_argument("--metrics", help="record every stage's timing and resources in this JSON lines file")
+    parser.add_argument("--prometheus", help="also write the cycle's per-stage totals here as a Prometheus textfile")
+    parser.add_argument("--ic-wait-start", type=float,
+                        help="when the script started waiting for initial conditions (epoch seconds), recorded as ic_wait")
+    parser.add_argument("--dry-run", action="store_true", help="print the stages and exit")
+    parser.add_argument("--stub", help="run every command as `STUB command...` (for trying the graph locally)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    stages = cycle_stages(args)
+    if args.dry_run:
+        for stage in stages:
+            print(f"{stage.name} [{stage.slot or '-'}] needs={','.join(stage.needs) or '-'} follows={','.join(stage.follows) or '-'}"
+                  f"{' always' if stage.always else ''}")
+            for command in stage.commands:
+                print(f"    {shlex.join(command)}")
+        sys.exit(0)
+
+    if args.metrics:
+        # Inherited by every command the stages run
+        Path(args.metrics).parent.mkdir(parents=True, exist_ok=True)
+        os.environ["AIWP_METRICS"] = metrics.path = args.metrics
+        metrics.labels.update(cycle=f"{args.year}{args.month}{args.day}_{args.hh}", init=args.init)
+    keep = prepare(args)
+    start = time.time()
+    if args.ic_wait_start:
+        metrics.record("ic_wait", args.ic_wait_start, start)
+    state, times = run_stages(stages, {'gpu': args.gpu, 'cpu': args.cpu, 'io': args.io}, stub=args.stub,
+                              done=resumed(args, keep))
+    logging.info(f"Cycle took {time.time() - start:.0f}s")
+    metrics.record("cycle", start, time.time(), ok=all(value == 'done' for value in state.values()))
+    if args.metrics and args.prometheus:
+        metrics.write_prometheus(metrics.load(args.metrics), args.prometheus, metrics.labels["cycle"])
+    failed = [name for name, value in state.items() if value != 'done']
+    if failed:
+        logging.error(f"Not done: {' '.join(f'{name} ({state[name]})' for name in failed)}")
+        sys.exit(1)
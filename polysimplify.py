@@ -0,0 +1,170 @@
+import numpy as np
+
+# Topology-preserving Douglas-Peucker simplification of contour polygons, the
+# in-process equivalent of `mapshaper -simplify dp 30%`. As in mapshaper:
+#
+# - rings are cut into arcs at the vertices where the rings sharing a boundary
+#   change, and each arc is simplified once, so neighbouring bands keep
+#   sharing their boundaries exactly (no gaps or overlaps)
+# - distances are measured in 3D on the sphere for lon/lat coordinates
+# - each vertex's threshold is its Douglas-Peucker distance, capped by the
+#   distance of the vertex that split its parent segment
+# - one threshold is picked across all arcs so that `retain` of the removable
+#   (non-endpoint) vertices are kept
+# - rings left with fewer than 3 vertices are dropped, along with the holes of
+#   dropped outer rings
+#
+# mapshaper also repairs the rare segment intersections simplification can
+# create; that step is not reproduced.
+
+# Earth radius mapshaper uses for spherical simplification
+R = 6378137.
+
+def to_xyz(coords):
+    lon, lat = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    coslat = np.cos(lat)
+    return np.stack([R * coslat * np.cos(lon), R * coslat * np.sin(lon), R * np.sin(lat)], axis=1)
+
+# Squared distance from points p to the segments a-b
+def segment_distance_sq(p, a, b):
+    ab = b - a
+    length_sq = (ab**2).sum(axis=1)
+    t = np.where(length_sq > 0, ((p - a) * ab).sum(axis=1) / np.where(length_sq > 0, length_sq, 1), 0)
+    closest = a + np.clip(t, 0, 1)[:, None] * ab
+    return ((p - closest)**2).sum(axis=1)
+
+# Index ranges start[i]..start[i]+lengths[i]-1 concatenated, and which range
+# each index came from
+def ranges(start, lengths):
+    which = np.repeat(np.arange(len(start)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - offsets[which] + start[which], which
+
+# Squared Douglas-Peucker thresholds of the vertices of arcs stored back to
+# back in xyz (arc i runs from starts[i] to ends[i] inclusive). Endpoints get
+# inf. All segments at the same recursion depth are processed together.
+def dp_thresholds(xyz, starts, ends):
+    thresholds = np.full(len(xyz), np.inf)
+    caps = np.full(len(starts), np.inf)
+    while len(starts):
+        split = ends - starts > 1
+        starts, ends, caps = starts[split], ends[split], caps[split]
+        if not len(starts):
+            break
+        lengths = ends - starts - 1
+        index, segment = ranges(starts + 1, lengths)
+        offsets = np.cumsum(lengths) - lengths
+        dist = segment_distance_sq(xyz[index], xyz[starts[segment]], xyz[ends[segment]])
+        farthest = np.maximum.reduceat(dist, offsets)
+        # Last vertex at the maximum distance, as mapshaper picks it
+        pick = np.maximum.reduceat(np.where(dist == farthest[segment], index, -1), offsets)
+        farthest = np.minimum(farthest, caps)
+        thresholds[pick] = farthest
+        starts, ends = np.concatenate([starts, pick]), np.concatenate([pick, ends])
+        caps = np.concatenate([farthest, farthest])
+    return thresholds
+
+# Simplify rings that are stored back to back in `points` (ring i has
+# lengths[i] points, the first one not repeated at the end), together, so that
+# rings sharing a boundary are simplified the same way. Returns one closed
+# coordinate list per ring, or None where a ring collapsed.
+def simplify_rings(points, lengths, retain=0.3):
+    result = [None] * len(lengths)
+
+    # Drop repeated consecutive points
+    points = np.asarray(points, np.float64)
+    lengths = np.asarray(lengths)
+    ring_of = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(len(points))
+    previous = np.where(position == starts[ring_of], position + lengths[ring_of] - 1, position - 1)
+    distinct = (points != points[previous]).any(axis=1)
+    lengths = np.bincount(ring_of[distinct], minlength=len(lengths))
+    valid = lengths >= 3
+    points = points[distinct & valid[ring_of]]
+    ring_ids = np.flatnonzero(valid)
+    lengths = lengths[valid]
+    if not len(lengths):
+        return result
+    ring_of = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(len(points))
+    local = position - starts[ring_of]
+
+    # Vertex ids shared by identical coordinates
+    _, vid = np.unique(np.ascontiguousarray(points).view(np.complex128).ravel(), return_inverse=True)
+    vid = vid.ravel()
+    nv = vid.max() + 1
+
+    # A vertex is a node unless every ring through it has the same two
+    # neighbours there, i.e. the same rings share the edges on both sides
+    nxt = np.where(local == lengths[ring_of] - 1, starts[ring_of], position + 1)
+    prv = np.where(local == 0, starts[ring_of] + lengths[ring_of] - 1, position - 1)
+    pair = np.minimum(vid[prv], vid[nxt]) * nv + np.maximum(vid[prv], vid[nxt])
+    order = np.argsort(vid, kind='stable')
+    groups = np.searchsorted(vid[order], np.arange(nv))
+    counts = np.diff(np.append(groups, len(vid)))
+    node = ((np.minimum.reduceat(pair[order], groups) != np.maximum.reduceat(pair[order], groups))
+            | (counts > 2))
+    # Rings with no node become a single closed arc starting at their lowest
+    # vertex id, which every ring along that boundary agrees on
+    no_node = ~np.logical_or.reduceat(node[vid], starts)
+    node[np.minimum.reduceat(vid, starts)[no_node]] = True
+
+    # Rotate each ring to start at a node and close it, then cut it into arcs
+    # between consecutive nodes
+    shift = np.minimum.reduceat(np.where(node[vid], local, len(points)), starts)
+    rotated = starts[ring_of] + (local + shift[ring_of]) % lengths[ring_of]
+    closed = np.empty(len(points) + len(lengths), dtype=np.int64)
+    closed[position + ring_of] = rotated
+    closed_starts = starts + np.arange(len(lengths))
+    closed[closed_starts + lengths] = rotated[starts]
+    closed_ring = np.repeat(np.arange(len(lengths)), lengths + 1)
+    ids = vid[closed]
+    nodes = np.flatnonzero(node[ids])
+    same_ring = closed_ring[nodes[:-1]] == closed_ring[nodes[1:]]
+    arc_start, arc_end = nodes[:-1][same_ring], nodes[1:][same_ring]
+
+    # Identify each arc by its first edge in a canonical direction so the
+    # copies in neighbouring rings (usually reversed) are simplified once
+    forward = ((ids[arc_start] < ids[arc_end])
+               | ((ids[arc_start] == ids[arc_end]) & (ids[arc_start + 1] <= ids[arc_end - 1])))
+    key = np.where(forward, ids[arc_start] * nv + ids[arc_start + 1], ids[arc_end] * nv + ids[arc_end - 1])
+    _, first, arc_id = np.unique(key, return_index=True, return_inverse=True)
+    arc_id = arc_id.ravel()
+
+    # Canonical vertices of the unique arcs, back to back
+    arc_lengths = arc_end[first] - arc_start[first] + 1
+    offset, which = ranges(np.zeros(len(first), dtype=np.int64), arc_lengths)
+    canonical = np.where(forward[first][which], closed[arc_start[first][which] + offset],
+                         closed[arc_end[first][which] - offset])
+    canonical_starts = np.cumsum(arc_lengths) - arc_lengths
+    thresholds = dp_thresholds(to_xyz(points[canonical]), canonical_starts, canonical_starts + arc_lengths - 1)
+
+    # Keep `retain` of the removable vertices, as mapshaper's percentage does
+    removable = thresholds[np.isfinite(thresholds)]
+    kept = np.ones(len(thresholds), dtype=bool)
+    if len(removable):
+        rank = min(int(np.floor((1 - retain) * len(removable))), len(removable) - 1)
+        kept = thresholds >= np.partition(removable, rank)[rank]
+
+    # Map the decision back onto every copy of each arc (its last vertex is
+    # the next arc's first, so it is left to that arc)
+    offset, which = ranges(arc_start, arc_end - arc_start)
+    step = offset - arc_start[which]
+    same_direction = forward[which] == forward[first][arc_id[which]]
+    length = arc_lengths[arc_id[which]]
+    index = canonical_starts[arc_id[which]] + np.where(same_direction, step, length - 1 - step)
+    keep = np.zeros(len(closed), dtype=bool)
+    keep[offset] = kept[index]
+
+    # Closed coordinate lists of the rings that still have 3 vertices
+    kept_lengths = np.bincount(closed_ring[keep], minlength=len(lengths))
+    coords = points[closed[keep]].tolist()
+    offsets = (np.cumsum(kept_lengths) - kept_lengths).tolist()
+    for ring_id, offset, length in zip(ring_ids.tolist(), offsets, kept_lengths.tolist()):
+        if length >= 3:
+            ring = coords[offset:offset + length]
+            ring.append(ring[0])
+            result[ring_id] = ring
+    return result
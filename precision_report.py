@@ -0,0 +1,103 @@
+import argparse
+import numpy as np
+import h5py
+from netCDF4 import Dataset as DS
+from ncwriter import SHUFFLE_FILTER, DEFLATE_FILTER, bitround, round_digits, compress_chunk, recorded_precision
+
+# Default zlib level 4 + shuffle pipeline used to size candidate settings
+default_pipeline = [(SHUFFLE_FILTER, (4,)), (DEFLATE_FILTER, (4,))]
+
+# Indices of the whole fields of a variable at the selected timesteps
+def fields(variable, steps):
+    for t in steps:
+        if variable.ndim == 4:
+            for lev in range(variable.shape[1]):
+                yield (t, lev)
+        else:
+            yield (t,)
+
+# Running max/RMS absolute and max relative error between two sets of fields
+class ErrorStats:
+
+    def __init__(self):
+        self.max_abs = 0.
+        self.max_rel = 0.
+        self.sum_sq = 0.
+        self.count = 0
+
+    def add(self, reference, trimmed):
+        valid = ~np.ma.getmaskarray(reference)
+        reference = np.ma.getdata(reference)[valid].astype('f8')
+        diff = np.ma.getdata(trimmed)[valid].astype('f8') - reference
+        if not diff.size:
+            return
+        self.max_abs = max(self.max_abs, np.abs(diff).max())
+        nonzero = reference != 0
+        if nonzero.any():
+            self.max_rel = max(self.max_rel, np.abs(diff[nonzero] / reference[nonzero]).max())
+        self.sum_sq += (diff**2).sum()
+        self.count += diff.size
+
+    @property
+    def rms(self):
+        return np.sqrt(self.sum_sq / self.count) if self.count else 0.
+
+# Compare a trimmed NetCDF against the unrounded file it was made from
+def compare(reference_file, trimmed_file, steps):
+    print("| variable | setting | max abs err | rms err | max rel err | stored MB (ref) | stored MB (trimmed) |")
+    print("|---|---|---|---|---|---|---|")
+    with DS(reference_file) as ref, DS(trimmed_file) as trim, \
+            h5py.File(reference_file) as ref_h5, h5py.File(trimmed_file) as trim_h5:
+        for name, variable in ref.variables.items():
+            if name in ref.dimensions or name not in trim.variables:
+                continue
+            stats = ErrorStats()
+            for index in fields(variable, steps or range(variable.shape[0])):
+                stats.add(variable[index], trim.variables[name][index])
+            setting = recorded_precision(trim_h5[name])
+            print(f"| {name} | {setting} | {stats.max_abs:.4g} | {stats.rms:.4g} | {stats.max_rel:.3g} | "
+                  f"{ref_h5[name].id.get_storage_size() / 2**20:.1f} | "
+                  f"{trim_h5[name].id.get_storage_size() / 2**20:.1f} |")
+
+# Try candidate settings on sampled fields of an unrounded NetCDF
+def candidates(reference_file, settings, steps):
+    print("| variable | setting | max abs err | rms err | max rel err | zlib ratio |")
+    print("|---|---|---|---|---|---|")
+    with DS(reference_file) as ref:
+        for name, variable in ref.variables.items():
+            if name in ref.dimensions:
+                continue
+            for kind, n in [(None, 0)] + settings:
+                stats = ErrorStats()
+                raw = stored = 0
+                for index in fields(variable, steps or [0, variable.shape[0] // 2, variable.shape[0] - 1]):
+                    values = variable[index]
+                    data = np.ma.filled(values, 0).astype('f4')
+                    if kind == 'bits':
+                        data = bitround(data, n)
+                    elif kind == 'digits':
+                        data = round_digits(data, n)
+                    stats.add(values, data)
+                    raw += data.nbytes
+                    stored += len(compress_chunk(data, default_pipeline))
+                setting = f"{kind}:{n}" if kind else "unrounded"
+                print(f"| {name} | {setting} | {stats.max_abs:.4g} | {stats.rms:.4g} | "
+                      f"{stats.max_rel:.3g} | {raw / stored:.2f} |")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the error and size of lossy precision settings")
+    parser.add_argument("reference", help="NetCDF written without --trim-precision")
+    parser.add_argument("trimmed", nargs="?", help="same forecast written with --trim-precision")
+    parser.add_argument("--bits", nargs="+", type=int, default=[],
+                        help="candidate mantissa bits to try when no trimmed file is given")
+    parser.add_argument("--digits", nargs="+", type=int, default=[],
+                        help="candidate decimal places to try when no trimmed file is given")
+    parser.add_argument("--steps", nargs="+", type=int, default=[],
+                        help="timestep indices to check (default: all when comparing, 3 samples otherwise)")
+    args = parser.parse_args()
+
+    if args.trimmed:
+        compare(args.reference, args.trimmed, args.steps)
+    else:
+        settings = [('bits', n) for n in args.bits] + [('digits', n) for n in args.digits]
+        candidates(args.reference, settings or [('bits', n) for n in (8, 10, 12, 14)], args.steps)
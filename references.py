@@ -0,0 +1,65 @@
+import json
+import argparse
+import numpy as np
+import xarray as xr
+
+# Build kerchunk references that expose a NetCDF4 file as a Zarr store read
+# with byte-range requests. Every chunk points at the "{{u}}" template, set
+# to `url` (e.g. the file's S3 object), so the references can be re-pointed
+# at another copy of the same file.
+def build_references(ncfile, url=None, inline_threshold=300):
+    from kerchunk.hdf import SingleHdf5ToZarr
+    refs = SingleHdf5ToZarr(ncfile, url=ncfile, inline_threshold=inline_threshold).translate()
+    for key, ref in refs['refs'].items():
+        if isinstance(ref, list):
+            refs['refs'][key] = ['{{u}}'] + ref[1:]
+    refs['templates'] = {'u': url or ncfile}
+    return refs
+
+def write_references(ncfile, outfile, url=None):
+    refs = build_references(ncfile, url)
+    with open(outfile, 'w') as f:
+        json.dump(refs, f)
+    return outfile
+
+# Open references with xarray. `target` replaces the recorded URL, e.g. to
+# read the local NetCDF instead of the S3 object.
+def open_references(refs_file, target=None, remote_options=None):
+    with open(refs_file) as f:
+        refs = json.load(f)
+    if target:
+        refs['templates']['u'] = target
+    storage_options = {"fo": refs}
+    if refs['templates']['u'].startswith('s3://'):
+        storage_options.update(remote_protocol="s3", remote_options=remote_options or {"anon": True})
+    return xr.open_dataset("reference://", engine="zarr",
+                           backend_kwargs={"consolidated": False, "storage_options": storage_options})
+
+# Check that the references decode to the same values as the NetCDF itself
+def verify(refs_file, ncfile, steps=None):
+    ok = True
+    with open_references(refs_file, target=ncfile) as refs, xr.open_dataset(ncfile) as nc:
+        if refs.attrs != nc.attrs or set(refs.data_vars) != set(nc.data_vars):
+            print("Attributes or variables differ")
+            ok = False
+        for name in nc.data_vars:
+            ntime = nc[name].shape[0]
+            for t in steps or sorted({0, ntime // 2, ntime - 1}):
+                same = np.array_equal(refs[name][t].values, nc[name][t].values, equal_nan=True)
+                print(f"{name} step {t}: {'ok' if same else 'MISMATCH'}")
+                ok = ok and same
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write or verify kerchunk references for a NetCDF file")
+    parser.add_argument("ncfile")
+    parser.add_argument("refs", help="reference JSON to write or verify")
+    parser.add_argument("--url", help="location the references should point to (default: ncfile)")
+    parser.add_argument("--verify", action="store_true",
+                        help="compare existing references against ncfile instead of writing them")
+    parser.add_argument("--steps", nargs="+", type=int, help="timestep indices to compare")
+    args = parser.parse_args()
+
+    if args.verify:
+        raise SystemExit(0 if verify(args.refs, args.ncfile, args.steps) else 1)
+    write_references(args.ncfile, args.refs, args.url)
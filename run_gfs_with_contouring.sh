@@ -24,6 +24,33 @@ python_contours=${aiwp_realtime_contouring_env_path}/bin/python
 aws=${aiwp_realtime_env_path}/bin/aws
 tippecanoe=${aiwp_realtime_contouring_env_path}/bin/tippecanoe
 
+#grib2nc.py worker processes/threads per conversion (tune against disk and CPU contention)
+grib2nc_decode_workers=2
+grib2nc_compress_workers=4
+
+#Stages of each kind pipeline.py runs at once: model runs, conversions/tiling,
+#and uploads/publishing
+gpu_slots=1
+cpu_slots=3
+io_slots=2
+#Worker processes of the cycle's contouring service (contour_service.py, started with the cycle)
+contour_workers=14
+
+#How tiles go to the web server: "zip" (tile directories, unzipped remotely) or
+#"archive" (one archive.py file per cycle, served by archive.tile_app)
+tile_output=zip
+
+#Per-stage timing and resource records of each cycle (metrics.py summary <file> to read one)
+metrics_path=${aiwp_realtime_cwd_path}/metrics
+
+#Cache of contour and tile outputs, so rerunning a cycle after a failure only redoes what
+#is missing or changed (evicted after 7 days unused, or beyond 50 GB)
+contour_cache=${aiwp_realtime_cwd_path}/contour_cache
+
+#Uploads with upload.py, which skips objects a resumed cycle already uploaded unchanged
+#("aws" for aws s3 cp, which uploads every file again)
+uploader=python
+
 
 #------------------------------
 #-------Remote addresses-------
@@ -59,7 +86,8 @@ MONTH=$(date -u -d "$rounded_datetime" +"%m")
 DAY=$(date -u -d "$rounded_datetime" +"%d")
 HH=$(date -u -d "$rounded_datetime" +"%H")
 
-# Check if initial conditions available
+# Check if initial conditions available (the wait is recorded in the cycle's metrics)
+ic_wait_start=$(date -u +%s)
 url="https://noaa-gfs-bdp-pds.s3.amazonaws.com/gfs.${YEAR}${MONTH}${DAY}/${HH}/atmos/gfs.t${HH}z.pgrb2.0p25.f000"
 # Loop to check the URL every 30 seconds
 while true; do
@@ -78,95 +106,9 @@ while true; do
     sleep 30
 done
 
-#Model output dirs
-fcnv2head=${aiwp_realtime_cwd_path}/output_data/FOUR_v200_GFS/${YEAR}/${MONTH}${DAY}
-pwhead=${aiwp_realtime_cwd_path}/output_data/PANG_v100_GFS/${YEAR}/${MONTH}${DAY}
-gchead=${aiwp_realtime_cwd_path}/output_data/GRAP_v100_GFS/${YEAR}/${MONTH}${DAY}
-auhead=${aiwp_realtime_cwd_path}/output_data/AURO_v100_GFS/${YEAR}/${MONTH}${DAY}
-
-#Model output files
-fcnv2tail=FOUR_v200_GFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06
-pwtail=PANG_v100_GFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06
-gctail=GRAP_v100_GFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06
-autail=AURO_v100_GFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06
-
-#Full model output path
-fcnv2path=${fcnv2head}/${fcnv2tail}
-pwpath=${pwhead}/${pwtail}
-gcpath=${gchead}/${gctail}
-aupath=${auhead}/${autail}
-
-#Model asset paths
-fcnv2assets=${aiwp_realtime_cwd_path}/assets/fcnv2
-pwassets=${aiwp_realtime_cwd_path}/assets/pw
-gcassets=${aiwp_realtime_cwd_path}/assets/gc
-auassets=${aiwp_realtime_cwd_path}/assets/au
-
-#Create output dirs
-mkdir -p ${fcnv2head}
-mkdir -p ${pwhead}
-mkdir -p ${gchead}
-mkdir -p ${auhead}
-
-# This section runs the models serially and converts to netcdfs concurrently
-# If there are issues with monopolizing disk I/O or CPU change these to
-# all run serially.
-
-# Run FourCastNetV2-small
-${aimodels} --input gfs --assets ${fcnv2assets} --date ${YEAR}${MONTH}${DAY} --time ${HH}00 --path ${fcnv2path} fourcastnetv2-small
-${python} ${aiwp_realtime_cwd_path}/grib2nc.py ${fcnv2path} GFS fourcastnetv2-small ${YEAR}${MONTH}${DAY} ${HH}00 &
-
-# Run PanguWeather
-${aimodels} --input gfs --assets ${pwassets} --date ${YEAR}${MONTH}${DAY} --time ${HH}00 --path ${pwpath} panguweather
-${python} ${aiwp_realtime_cwd_path}/grib2nc.py ${pwpath} GFS panguweather ${YEAR}${MONTH}${DAY} ${HH}00 &
-
-# Run GraphCast
-${aimodels} --input gfs --assets ${gcassets} --date ${YEAR}${MONTH}${DAY} --time ${HH}00 --path ${gcpath} graphcast
-${python} ${aiwp_realtime_cwd_path}/grib2nc.py ${gcpath} GFS graphcast ${YEAR}${MONTH}${DAY} ${HH}00 &
-
-# Run Aurora
-${aimodels} --input gfs --assets ${auassets} --date ${YEAR}${MONTH}${DAY} --time ${HH}00 --path ${aupath} aurora --model-version 0.25-finetuned
-${python} ${aiwp_realtime_cwd_path}/grib2nc.py ${aupath} GFS aurora ${YEAR}${MONTH}${DAY} ${HH}00 &
-
-wait
-
-#Remove grib files
-rm ${fcnv2path}
-rm ${pwpath}
-rm ${gcpath}
-rm ${aupath}
-
-#Upload to S3 bucket
-${aws} s3 cp ${fcnv2path}.nc s3://noaa-oar-mlwp-data/FOUR_v200_GFS/${YEAR}/${MONTH}${DAY}/FOUR_v200_GFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06.nc --profile noaa
-${aws} s3 cp ${pwpath}.nc s3://noaa-oar-mlwp-data/PANG_v100_GFS/${YEAR}/${MONTH}${DAY}/PANG_v100_GFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06.nc --profile noaa
-${aws} s3 cp ${gcpath}.nc s3://noaa-oar-mlwp-data/GRAP_v100_GFS/${YEAR}/${MONTH}${DAY}/GRAP_v100_GFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06.nc --profile noaa
-${aws} s3 cp ${aupath}.nc s3://noaa-oar-mlwp-data/AURO_v100_GFS/${YEAR}/${MONTH}${DAY}/AURO_v100_GFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06.nc --profile noaa
-
-${python_contours} contouring.py ${YEAR} ${MONTH} ${DAY} ${HH} fcnv2 gfs ${fcnv2path}.nc ${geojson_path}
-${python_contours} contouring.py ${YEAR} ${MONTH} ${DAY} ${HH} pw gfs ${pwpath}.nc ${geojson_path}
-${python_contours} contouring.py ${YEAR} ${MONTH} ${DAY} ${HH} gc gfs ${gcpath}.nc ${geojson_path}
-${python_contours} contouring.py ${YEAR} ${MONTH} ${DAY} ${HH} au gfs ${aupath}.nc ${geojson_path}
-
-${python_contours} winds.py ${YEAR} ${MONTH} ${DAY} ${HH} fcnv2 gfs ${fcnv2path}.nc ${geojson_path}
-${python_contours} winds.py ${YEAR} ${MONTH} ${DAY} ${HH} pw gfs ${pwpath}.nc ${geojson_path}
-${python_contours} winds.py ${YEAR} ${MONTH} ${DAY} ${HH} gc gfs ${gcpath}.nc ${geojson_path}
-${python_contours} winds.py ${YEAR} ${MONTH} ${DAY} ${HH} au gfs ${aupath}.nc ${geojson_path}
-
-for file in ${geojson_path}/${YEAR}${MONTH}${DAY}_${HH}/*/*.geojson.simple; do
-   filename="${file%%.simple*}"
-   filename="${file%%.geojson*}"
-   basename=$(basename "$filename")
-   if [[ "$file" == *windbarb* ]]; then
-	   ${tippecanoe} --drop-rate=0 --read-parallel -l "${YEAR}${MONTH}${DAY}_${HH}_${basename}" -e "${filename}_tiles" --minimum-zoom=2 --maximum-zoom=4 --no-tile-compression "${file}" --force
-   else
-       ${tippecanoe} --read-parallel -l "${YEAR}${MONTH}${DAY}_${HH}_${basename}" -e "${filename}_tiles" --minimum-zoom=2 --maximum-zoom=4 --no-tile-compression "${file}" --force
-   fi
-done
-
-find ${geojson_path}/ -type f -name "*.geojson" -delete
-find ${geojson_path}/ -type f -name "*.simple" -delete
-
-cd ${geojson_path}
-zip -r -0 ${YEAR}${MONTH}${DAY}_${HH}.zip ${YEAR}${MONTH}${DAY}_${HH}
-scp ${YEAR}${MONTH}${DAY}_${HH}.zip ${aiweather_address}:/mnt/data1/aiweather/geojsons/
-ssh ${aiweather_address} "unzip /mnt/data1/aiweather/geojsons/${YEAR}${MONTH}${DAY}_${HH}.zip -d /mnt/data1/aiweather/geojsons/"
+# Run, convert, upload, contour, tile and publish the cycle as a dependency graph.
+# Each model's NetCDF conversion follows it as it runs, and its upload and contouring
+# start as soon as the NetCDF is complete, while the next model runs. The slot
+# limits above cap how many stages of each kind run at once; contouring runs on
+# its own pool of contour_workers for the whole cycle.
+${python} ${aiwp_realtime_cwd_path}/pipeline.py ${YEAR} ${MONTH} ${DAY} ${HH} gfs --cwd ${aiwp_realtime_cwd_path} --metrics ${metrics_path}/gfs_${YEAR}${MONTH}${DAY}${HH}.jsonl --ic-wait-start ${ic_wait_start} --python ${python} --aimodels ${aimodels} --aws ${aws} --s3bucket ${s3bucket} --uploader ${uploader} --grib2nc-decode-workers ${grib2nc_decode_workers} --grib2nc-compress-workers ${grib2nc_compress_workers} --gpu ${gpu_slots} --cpu ${cpu_slots} --io ${io_slots} --geojson-path ${geojson_path} --python-contours ${python_contours} --contour-workers ${contour_workers} --tippecanoe ${tippecanoe} --tile-output ${tile_output} --cache ${contour_cache} --resume --aiweather-address ${aiweather_address}
@@ -11,6 +11,20 @@ export LD_LIBRARY_PATH=${aiwp_realtime_env_path}/lib/python3.11/site-packages/nv
 aimodels=${aiwp_realtime_env_path}/bin/ai-models
 python=${aiwp_realtime_env_path}/bin/python
 aws=${aiwp_realtime_env_path}/bin/aws
+
+#grib2nc.py worker processes/threads per conversion (tune against disk and CPU contention)
+grib2nc_decode_workers=2
+grib2nc_compress_workers=4
+
+#Stages of each kind pipeline.py runs at once: model runs, conversions/contouring/tiling,
+#and uploads/publishing
+gpu_slots=1
+cpu_slots=3
+io_slots=2
+
+#Per-stage timing and resource records of each cycle (metrics.py summary <file> to read one)
+metrics_path=${aiwp_realtime_cwd_path}/metrics
+
 s3bucket=s3://noaa-oar-mlwp-data
 
 #Remove pre-existing data
@@ -34,7 +48,8 @@ MONTH=$(date -u -d "$rounded_datetime" +"%m")
 DAY=$(date -u -d "$rounded_datetime" +"%d")
 HH=$(date -u -d "$rounded_datetime" +"%H")
 
-# Check if initial conditions available
+# Check if initial conditions available (the wait is recorded in the cycle's metrics)
+ic_wait_start=$(date -u +%s)
 url="https://data.ecmwf.int/forecasts/${YEAR}${MONTH}${DAY}/${HH}z/ifs/0p25/oper/${YEAR}${MONTH}${DAY}${HH}0000-0h-oper-fc.grib2"
 # Loop to check the URL every 30 seconds
 while true; do
@@ -53,61 +68,8 @@ while true; do
     sleep 30
 done
 
-#Preconfigures paths
-fcnv2head=${aiwp_realtime_cwd_path}/output_data/FOUR_v200_IFS/${YEAR}/${MONTH}${DAY}
-pwhead=${aiwp_realtime_cwd_path}/output_data/PANG_v100_IFS/${YEAR}/${MONTH}${DAY}
-gchead=${aiwp_realtime_cwd_path}/output_data/GRAP_v100_IFS/${YEAR}/${MONTH}${DAY}
-auhead=${aiwp_realtime_cwd_path}/output_data/AURO_v100_IFS/${YEAR}/${MONTH}${DAY}
-
-fcnv2tail=FOUR_v200_IFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06
-pwtail=PANG_v100_IFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06
-gctail=GRAP_v100_IFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06
-autail=AURO_v100_IFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06
-
-fcnv2path=${fcnv2head}/${fcnv2tail}
-pwpath=${pwhead}/${pwtail}
-gcpath=${gchead}/${gctail}
-aupath=${auhead}/${autail}
-
-fcnv2assets=${aiwp_realtime_cwd_path}/assets/fcnv2
-pwassets=${aiwp_realtime_cwd_path}/assets/pw
-gcassets=${aiwp_realtime_cwd_path}/assets/gc
-auassets=${aiwp_realtime_cwd_path}/assets/au
-
-mkdir -p ${fcnv2head}
-mkdir -p ${pwhead}
-mkdir -p ${gchead}
-mkdir -p ${auhead}
-
-# This section runs the models serially and converts to netcdfs concurrently
-# If there are issues with monopolizing disk I/O or CPU change these to
-# all run serially.
-
-# Run FourCastNetV2-small
-${aimodels} --input opendata --assets ${fcnv2assets} --date ${YEAR}${MONTH}${DAY} --time ${HH}00 --path ${fcnv2path} fourcastnetv2-small
-${python} ${aiwp_realtime_cwd_path}/grib2nc.py ${fcnv2path} IFS fourcastnetv2-small ${YEAR}${MONTH}${DAY} ${HH}00 &
-
-# Run PanguWeather
-${aimodels} --input opendata --assets ${pwassets} --date ${YEAR}${MONTH}${DAY} --time ${HH}00 --path ${pwpath} panguweather
-${python} ${aiwp_realtime_cwd_path}/grib2nc.py ${pwpath} IFS panguweather ${YEAR}${MONTH}${DAY} ${HH}00 &
-
-# Run GraphCast
-${aimodels} --input opendata --assets ${gcassets} --date ${YEAR}${MONTH}${DAY} --time ${HH}00 --path ${gcpath} graphcast
-${python} ${aiwp_realtime_cwd_path}/grib2nc.py ${gcpath} IFS graphcast ${YEAR}${MONTH}${DAY} ${HH}00 &
-
-# Run Aurora
-${aimodels} --input opendata --assets ${auassets} --date ${YEAR}${MONTH}${DAY} --time ${HH}00 --path ${aupath} aurora --model-version 0.25-finetuned
-${python} ${aiwp_realtime_cwd_path}/grib2nc.py ${aupath} IFS aurora ${YEAR}${MONTH}${DAY} ${HH}00 &
-
-wait
-
-#Remove grib files
-rm ${fcnv2path}
-rm ${pwpath}
-rm ${gcpath}
-rm ${aupath}
-
-${aws} s3 cp ${fcnv2path}.nc s3://noaa-oar-mlwp-data/FOUR_v200_IFS/${YEAR}/${MONTH}${DAY}/FOUR_v200_IFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06.nc --profile noaa
-${aws} s3 cp ${pwpath}.nc s3://noaa-oar-mlwp-data/PANG_v100_IFS/${YEAR}/${MONTH}${DAY}/PANG_v100_IFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06.nc --profile noaa
-${aws} s3 cp ${gcpath}.nc s3://noaa-oar-mlwp-data/GRAP_v100_IFS/${YEAR}/${MONTH}${DAY}/GRAP_v100_IFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06.nc --profile noaa
-${aws} s3 cp ${aupath}.nc s3://noaa-oar-mlwp-data/AURO_v100_IFS/${YEAR}/${MONTH}${DAY}/AURO_v100_IFS_${YEAR}${MONTH}${DAY}${HH}_f000_f240_06.nc --profile noaa
+# Run, convert and upload the cycle as a dependency graph.
+# Each model's NetCDF conversion follows it as it runs, and its upload
+# starts as soon as the NetCDF is complete, while the next model runs. The slot
+# limits above cap how many stages of each kind run at once.
+${python} ${aiwp_realtime_cwd_path}/pipeline.py ${YEAR} ${MONTH} ${DAY} ${HH} ifs --cwd ${aiwp_realtime_cwd_path} --metrics ${metrics_path}/ifs_${YEAR}${MONTH}${DAY}${HH}.jsonl --ic-wait-start ${ic_wait_start} --python ${python} --aimodels ${aimodels} --aws ${aws} --s3bucket ${s3bucket} --grib2nc-decode-workers ${grib2nc_decode_workers} --grib2nc-compress-workers ${grib2nc_compress_workers} --gpu ${gpu_slots} --cpu ${cpu_slots} --io ${io_slots}
@@ -0,0 +1,135 @@
+import os
+import time
+import queue
+import logging
+from functools import partial
+from multiprocessing import Pool, SimpleQueue
+
+# Run many small independent tasks on a process pool. Tasks are handed out one
+# at a time, in the order submitted, as workers free up. With the largest
+# tasks first, the run does not end on a few long tasks while the rest of the
+# pool idles. Every task's duration is logged as it finishes.
+
+# Seconds between checks for workers that died (e.g. were OOM-killed) while
+# collecting results
+CHECK_INTERVAL = 5
+
+# (task id, pid) of each task as a worker starts it, set in the workers
+started = None
+
+def set_started(queue):
+    global started
+    started = queue
+
+# The pool reaps dead workers, so a pid that can't be signalled has exited
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+# Run func(task) in a worker. Exceptions are logged there and reported back
+# instead of stopping the pool.
+def timed(func, name, task, task_id):
+    started.put((task_id, os.getpid()))
+    start = time.perf_counter()
+    ok = True
+    try:
+        func(task)
+    except Exception:
+        logging.exception(f"{name(task)} failed")
+        ok = False
+    return task_id, name(task), os.getpid(), time.perf_counter() - start, ok
+
+# A pool that takes more tasks while it runs, e.g. from jobs whose input
+# only becomes available later. Results come back through a queue so the
+# caller can wait for them and do other polling in between. A task also
+# fails, rather than leaving collect() waiting forever, if the pool can't
+# hand it to a worker (e.g. it doesn't pickle) or its worker dies.
+class TaskPool:
+    def __init__(self, workers):
+        self.workers = workers
+        self.started = SimpleQueue()
+        self.pool = Pool(processes=workers, initializer=set_started, initargs=(self.started,))
+        self.results = queue.Queue()
+        self.pending = {}
+        self.running = {}
+        self.busy = 0.
+        self.failed = []
+        self.start = time.perf_counter()
+        self.submitted = 0
+        self.crashed = False
+
+    @property
+    def outstanding(self):
+        return len(self.pending)
+
+    def submit(self, func, tasks, name=str):
+        for task in tasks:
+            task_id, task_name = self.submitted, name(task)
+            self.submitted += 1
+            self.pending[task_id] = task_name
+            self.pool.apply_async(timed, (func, name, task, task_id), callback=self.results.put,
+                                  error_callback=partial(self.lost, task_id, task_name, None))
+
+    # Queue a failed result for a task that never reported back
+    def lost(self, task_id, task_name, pid, error):
+        logging.error(f"{task_name} failed: {error}")
+        self.results.put((task_id, task_name, pid, 0., False))
+
+    # Fail the task of each worker that died. A worker runs one task at a
+    # time, so the last task it started is the one it died in.
+    def check_workers(self):
+        while not self.started.empty():
+            task_id, pid = self.started.get()
+            self.running[pid] = task_id
+        for pid, task_id in list(self.running.items()):
+            if alive(pid):
+                continue
+            del self.running[pid]
+            if task_id in self.pending:
+                self.crashed = True
+                self.lost(task_id, self.pending[task_id], pid, f"worker {pid} died")
+
+    # Log the results that arrive within `timeout` seconds (or wait for all
+    # outstanding tasks with None). Returns the number still outstanding.
+    def collect(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending:
+            remaining = CHECK_INTERVAL if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                task_id, task_name, pid, seconds, ok = self.results.get(timeout=min(remaining, CHECK_INTERVAL))
+            except queue.Empty:
+                self.check_workers()
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                continue
+            # Already failed as lost
+            if self.pending.pop(task_id, None) is None:
+                continue
+            self.busy += seconds
+            logging.info(f"{task_name} {'done' if ok else 'FAILED'} in {seconds:.2f}s (pid {pid})")
+            if not ok:
+                self.failed.append(task_name)
+        return self.outstanding
+
+    # A task lost with its worker stays in the pool's cache, so the pool would
+    # never finish joining; its workers are stopped instead
+    def close(self):
+        if self.crashed:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+        wall = time.perf_counter() - self.start
+        logging.info(f"Tasks took {wall:.1f}s on {self.workers} workers, "
+                     f"{100 * self.busy / (wall * self.workers):.0f}% busy")
+
+# Returns the names of the tasks that failed
+def run_tasks(func, tasks, workers, name=str):
+    pool = TaskPool(workers)
+    pool.submit(func, tasks, name)
+    pool.collect()
+    pool.close()
+    return pool.failed
@@ -0,0 +1,118 @@
+import time
+import argparse
+import numpy as np
+import eccodes
+
+# Layout of the GRIB files written by ai-models / ai-models-gfs
+LEVELS = [1000, 925, 850, 700, 600, 500, 400, 300, 250, 200, 150, 100, 50]
+PL_VARS = ['z', 'q', 't', 'u', 'v', 'w', 'r']
+SFC_VARS = ['10u', '10v', '2t', 'msl', '100u', '100v', 'sp', 'tcwv', 'tp']
+CONSTANT_VARS = ['z', 'lsm']
+
+# typeOfLevel and level used for each surface shortName
+sfc_levels = {
+    "10u": ('heightAboveGround', 10),
+    "10v": ('heightAboveGround', 10),
+    "100u": ('heightAboveGround', 100),
+    "100v": ('heightAboveGround', 100),
+    "2t": ('heightAboveGround', 2),
+    "msl": ('meanSea', 0),
+    "sp": ('surface', 0),
+    "tcwv": ('entireAtmosphere', 0),
+    "tp": ('surface', 0),
+    "z": ('surface', 0),
+    "lsm": ('surface', 0)
+}
+
+lats = np.linspace(90, -90, 721)
+lons = np.arange(0, 360, 0.25)
+coslat = np.cos(np.deg2rad(lats))[:, None]
+
+# Smooth, roughly realistic field with a travelling wave and a little noise so
+# compression and contouring behave like they do on real model output
+def synthetic_field(shortName, level, step, rng):
+    wave = np.sin(np.deg2rad(3 * lons[None, :] - 2 * step) + np.deg2rad(2 * lats[:, None]))
+    noise = rng.standard_normal((721, 1440))
+    p = level / 1000.
+    if shortName == 'z':
+        vals = 9.80665 * 7400 * np.log(1013 / max(level, 1)) + 600 * coslat + 300 * wave
+    elif shortName == 'q':
+        vals = 0.018 * p**3 * coslat**2 * (1 + 0.2 * wave) + 1e-5 * np.abs(noise)
+    elif shortName in ['t', '2t']:
+        vals = 230 + 60 * p**0.6 * coslat + 5 * wave
+    elif shortName in ['u', 'v', '10u', '10v', '100u', '100v']:
+        vals = 25 * (1 - p) * coslat * wave + 2 * np.cos(np.deg2rad(4 * lats))[:, None]
+    elif shortName == 'w':
+        vals = 0.3 * wave * coslat
+    elif shortName == 'r':
+        vals = 60 + 30 * wave * coslat
+    elif shortName in ['msl', 'sp']:
+        vals = 101300 + 1500 * wave * (1 - coslat) - (8000 if shortName == 'sp' else 0)
+    elif shortName == 'tcwv':
+        vals = 50 * coslat**3 * (1 + 0.3 * wave)
+    elif shortName == 'tp':
+        vals = step / 6 * 0.002 * np.clip(wave, 0, None) * coslat
+        return vals
+    elif shortName == 'lsm':
+        return (wave > 0.5).astype('f8')
+    else:
+        vals = wave
+    return vals + 0.01 * np.abs(vals).mean() * noise
+
+# Encode one 0.25 degree message as GRIB2 bytes
+def make_message(shortName, level, step, values, levelType='pl'):
+    gid = eccodes.codes_grib_new_from_samples('regular_ll_pl_grib2')
+    for key, value in [('Ni', 1440), ('Nj', 721),
+                       ('latitudeOfFirstGridPointInDegrees', 90.),
+                       ('longitudeOfFirstGridPointInDegrees', 0.),
+                       ('latitudeOfLastGridPointInDegrees', -90.),
+                       ('longitudeOfLastGridPointInDegrees', 359.75),
+                       ('iDirectionIncrementInDegrees', .25),
+                       ('jDirectionIncrementInDegrees', .25)]:
+        eccodes.codes_set(gid, key, value)
+    if levelType == 'pl':
+        eccodes.codes_set(gid, 'typeOfLevel', 'isobaricInhPa')
+        eccodes.codes_set(gid, 'level', level)
+    else:
+        typeOfLevel, level = sfc_levels[shortName]
+        eccodes.codes_set(gid, 'typeOfLevel', typeOfLevel)
+        if level:
+            eccodes.codes_set(gid, 'level', level)
+    eccodes.codes_set(gid, 'step', step)
+    eccodes.codes_set(gid, 'shortName', shortName)
+    eccodes.codes_set(gid, 'packingType', 'grid_simple')
+    eccodes.codes_set(gid, 'bitsPerValue', 16)
+    eccodes.codes_set_values(gid, np.asarray(values, dtype='f8').ravel())
+    message = eccodes.codes_get_message(gid)
+    eccodes.codes_release(gid)
+    return message
+
+# Append a full model run to `outfile` one step at a time, pausing `interval`
+# seconds between steps to imitate a model that is still running
+def write_run(outfile, steps=41, interval=0, pl_vars=PL_VARS, sfc_vars=SFC_VARS, levels=LEVELS, seed=0):
+    rng = np.random.default_rng(seed)
+    with open(outfile, 'wb') as f:
+        for i in range(steps):
+            step = i * 6
+            for shortName in pl_vars:
+                for level in levels:
+                    f.write(make_message(shortName, level, step, synthetic_field(shortName, level, step, rng)))
+            for shortName in sfc_vars + (CONSTANT_VARS if step == 0 else []):
+                f.write(make_message(shortName, 0, step, synthetic_field(shortName, 0, step, rng), 'sfc'))
+            f.flush()
+            if interval and i < steps - 1:
+                time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic 0.25 degree GRIB file shaped like ai-models output")
+    parser.add_argument("outfile")
+    parser.add_argument("--steps", type=int, default=41)
+    parser.add_argument("--interval", type=float, default=0,
+                        help="seconds to wait between steps")
+    parser.add_argument("--pl-vars", nargs="+", default=PL_VARS)
+    parser.add_argument("--sfc-vars", nargs="+", default=SFC_VARS)
+    parser.add_argument("--levels", nargs="+", type=int, default=LEVELS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_run(args.outfile, args.steps, args.interval, args.pl_vars, args.sfc_vars, args.levels, args.seed)
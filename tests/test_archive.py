@@ -0,0 +1,64 @@
+import gzip
+import json
+import numpy as np
+import pytest
+import archive
+import mvt
+
+# A cycle directory like contour_service.py leaves it: two models' point tile
+# directories, each with a metadata.json
+@pytest.fixture
+def cycle_dir(tmp_path):
+    cycle_dir = tmp_path / "20240101_00"
+    lon, lat = np.meshgrid(np.arange(0, 360, 10.), np.arange(-80, 81, 10.))
+    for model in ["gc", "pw"]:
+        mvt.write_point_tiles(cycle_dir / f"{model}_gfs" / f"{model}_barbs_000_tiles", f"20240101_00_{model}_barbs_000",
+                              lon.ravel(), lat.ravel(), {"mag": lon.ravel(), "dir": lat.ravel()}, 2, 3)
+    return cycle_dir
+
+def tiles(cycle_dir):
+    return sorted(cycle_dir.glob("*/*_tiles/*/*/*.pbf"))
+
+# Answer of archive.tile_app to a GET of path
+def get(directory, path):
+    response = {}
+    def start_response(status, headers):
+        response.update(status=status, headers=dict(headers))
+    body = b"".join(archive.tile_app(directory)({"PATH_INFO": path}, start_response))
+    return response["status"], response["headers"], body
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_pack(cycle_dir, tmp_path, compress):
+    archivefile = tmp_path / "20240101_00.tiles.sqlite"
+    assert archive.pack(cycle_dir, archivefile, compress) == len(tiles(cycle_dir)) > 0
+    assert archive.verify(cycle_dir, archivefile) == []
+    db = archive.open_archive(archivefile)
+    for path in tiles(cycle_dir):
+        layer = path.parent.parent.parent.relative_to(cycle_dir).as_posix()
+        z, x, y = int(path.parent.parent.name), int(path.parent.name), int(path.stem)
+        assert archive.read_tile(db, layer, z, x, y) == path.read_bytes()
+        assert archive.gzipped(archive.stored_tile(db, layer, z, x, y)) == compress
+    assert archive.read_tile(db, "gc_gfs/gc_barbs_000_tiles", 9, 0, 0) is None
+    db.close()
+
+    # A changed tile is reported
+    tiles(cycle_dir)[0].write_bytes(b"changed")
+    assert archive.verify(cycle_dir, archivefile) == [str(tiles(cycle_dir)[0])]
+
+def test_serve(cycle_dir, tmp_path):
+    archive.pack(cycle_dir, tmp_path / "20240101_00.tiles.sqlite", compress=True)
+    for path in tiles(cycle_dir):
+        status, headers, body = get(tmp_path, "/" + path.relative_to(tmp_path).as_posix())
+        assert status == "200 OK" and headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(body) == path.read_bytes()
+    metadata = cycle_dir / "gc_gfs" / "gc_barbs_000_tiles" / "metadata.json"
+    status, headers, body = get(tmp_path, "/" + metadata.relative_to(tmp_path).as_posix())
+    assert status == "200 OK" and json.loads(body) == json.loads(metadata.read_text())
+    for path in ["/20240101_00/gc_gfs/gc_barbs_000_tiles/9/0/0.pbf", "/20240101_00/gc_gfs/gc_barbs_000_tiles/2/a/0.pbf",
+                 "/20240101_00/gc_gfs/missing_tiles/metadata.json", "/20240102_00/gc_gfs/gc_barbs_000_tiles/2/0/0.pbf", "/"]:
+        assert get(tmp_path, path)[0] == "404 Not Found", path
+
+    # Uncompressed archives are served without Content-Encoding
+    archive.pack(cycle_dir, tmp_path / "20240101_00.tiles.sqlite")
+    status, headers, body = get(tmp_path, "/" + tiles(cycle_dir)[0].relative_to(tmp_path).as_posix())
+    assert "Content-Encoding" not in headers and body == tiles(cycle_dir)[0].read_bytes()
@@ -0,0 +1,68 @@
+import sys
+from pathlib import Path
+import numpy as np
+import pytest
+
+# contour_geojson.contourf_geojson against files written by the pinned
+# contouring environment (matplotlib 3.7.2, geojsoncontour 0.4.0) from the
+# same field, like contouring.py's matplotlib backend. Regenerate them in that
+# environment with `python tests/test_contour_geojson.py`.
+
+FIXTURES = Path(__file__).parent / "fixtures"
+COLORS = ["#80ff00", "#00cd00", "#008b00", "#104e8b", "#1e8fff", "#00b3ee",
+          "#00eeee", "#8968cd", "#902cee", "#8b008b"]
+
+# name: levels, extend, cmap, colors. The bands beyond the field's range are
+# empty, and the rings around the lows and highs make holes.
+CASES = {
+    "viridis_both": (np.arange(-3, 3.5, 0.5), 'both', 'viridis', None),
+    "colors_max": ([0.1, 0.25, 0.5, 0.75, 1, 1.25, 1.5, 1.75, 2, 5], 'max', None, COLORS),
+    "empty_bands": (np.arange(-10, 11, 2), 'neither', 'viridis', None),
+}
+
+# A 2 degree global grid with the first longitude repeated at 360, like
+# contouring.py's lons_extended
+def grid():
+    return np.arange(0, 362, 2.), np.arange(-90, 92, 2.)
+
+# Waves with closed highs and lows, written once to fixtures/field.npy so both
+# environments contour exactly the same values
+def make_field():
+    lons, lats = np.meshgrid(*grid())
+    field = (2 * np.sin(np.deg2rad(3 * lons)) * np.cos(np.deg2rad(2 * lats))
+             + np.cos(np.deg2rad(7 * lons + 5 * lats)) + 0.5 * np.sin(np.deg2rad(11 * lats)))
+    field[:, -1] = field[:, 0]
+    return field.astype('float32')
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_matches_pinned_stack(name, tmp_path):
+    from contour_geojson import contourf_geojson, write_geojson
+    levels, extend, cmap, colors = CASES[name]
+    lons, lats = grid()
+    field = np.load(FIXTURES / "field.npy")
+    write_geojson(contourf_geojson(lons, lats, field, levels, extend, cmap=cmap, colors=colors, ndigits=2),
+                  tmp_path / "contourpy.geojson")
+    assert (tmp_path / "contourpy.geojson").read_text() == (FIXTURES / f"contours_{name}.geojson").read_text()
+
+if __name__ == "__main__":
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import geojsoncontour
+    print(f"matplotlib {matplotlib.__version__}, geojsoncontour {getattr(geojsoncontour, '__version__', '?')}",
+          file=sys.stderr)
+    FIXTURES.mkdir(exist_ok=True)
+    if not (FIXTURES / "field.npy").exists():
+        np.save(FIXTURES / "field.npy", make_field())
+    field = np.load(FIXTURES / "field.npy")
+    lons, lats = grid()
+    for name, (levels, extend, cmap, colors) in CASES.items():
+        figure = plt.figure()
+        ax = figure.add_subplot(111)
+        if colors:
+            contours = ax.contourf(lons, lats, field, levels=levels, colors=colors, extend=extend)
+        else:
+            contours = ax.contourf(lons, lats, field, levels=levels, cmap=cmap, extend=extend)
+        plt.close()
+        geojsoncontour.contourf_to_geojson(contourf=contours, geojson_filepath=str(FIXTURES / f"contours_{name}.geojson"),
+                                           ndigits=2)
@@ -0,0 +1,13 @@
+import time
+import contour_service
+
+# A job whose NetCDF never appears is given up on once the stop file exists,
+# instead of at the timeout
+def test_stop_file(tmp_path):
+    stop = tmp_path / "converted"
+    stop.write_text("")
+    start = time.monotonic()
+    failed, missing = contour_service.serve([("gc", "gfs", str(tmp_path / "gc.nc"))], str(tmp_path), "20240101_00", 1,
+                                            poll=0.1, stop_file=str(stop))
+    assert (failed, missing) == ([], [str(tmp_path / "gc.nc")])
+    assert time.monotonic() - start < 30
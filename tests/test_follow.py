@@ -0,0 +1,82 @@
+import sys
+import json
+import shutil
+import subprocess as sp
+from pathlib import Path
+import numpy as np
+from netCDF4 import Dataset as DS
+
+HERE = Path(__file__).resolve().parent.parent
+
+# A small model-shaped run: all 13 levels of t, plus 2t and msl
+FIELDS = ["--pl-vars", "t", "--sfc-vars", "2t", "msl"]
+
+# grib2nc.grib2nc in its own process (pygrib, eccodes and netCDF4 in one
+# process are left to the scripts), with LAST_STEP lowered to the short run.
+# Prints the number of messages in each batch follow_index found.
+CONVERT = """
+import sys, json, gribindex, grib2nc
+last_step, args, kwargs = json.loads(sys.argv[1])
+batches = []
+def follow_index(*a, **k):
+    for records in gribindex.follow_index(*a, **k):
+        batches.append(len(records))
+        yield records
+grib2nc.follow_index = follow_index
+grib2nc.LAST_STEP = last_step
+grib2nc.grib2nc(*args, **kwargs)
+print(json.dumps(batches))
+"""
+
+def convert(grib, last_step, wait=True, **kwargs):
+    command = [sys.executable, "-c", CONVERT, json.dumps([last_step, [str(grib), "GFS", "graphcast", "20240101", "0000"], kwargs])]
+    proc = sp.Popen(command, cwd=HERE, stdout=sp.PIPE, stderr=sp.PIPE, text=True)
+    return proc.communicate() + (proc.returncode,) if wait else proc
+
+def write(grib, steps, interval=0):
+    return sp.Popen([sys.executable, HERE / "synthetic_grib.py", grib, "--steps", str(steps), "--interval", str(interval)] + FIELDS,
+                    stderr=sp.DEVNULL)
+
+# The first `steps` steps of each variable
+def fields(ncfile, steps):
+    with DS(ncfile) as f:
+        return {name: f.variables[name][:steps] for name in ["t", "t2", "msl"]}
+
+def test_follow_while_written(tmp_path):
+    grib = tmp_path / "run.grib"
+    writer = write(grib, steps=2, interval=3)
+    converter = convert(grib, 6, wait=False, follow=True, poll=0.2, timeout=30)
+    writer.wait()
+    stdout, stderr = converter.communicate()
+    assert writer.returncode == 0 and converter.returncode == 0, stderr
+    # Step 0 was converted before step 6 was written, and the conversion
+    # finished on the last step rather than the timeout
+    assert len(json.loads(stdout)) >= 2
+    assert "stopped growing" not in stderr
+    assert Path(f"{grib}.nc").exists() and not Path(f"{grib}.nc.part").exists()
+
+    # Same NetCDF as converting the finished file
+    shutil.copy(grib, tmp_path / "whole.grib")
+    assert convert(tmp_path / "whole.grib", 6)[2] == 0
+    followed, whole = fields(f"{grib}.nc", 3), fields(tmp_path / "whole.grib.nc", 3)
+    for name in followed:
+        assert np.ma.allequal(followed[name], whole[name]), name
+        assert (np.ma.getmaskarray(followed[name]) == np.ma.getmaskarray(whole[name])).all(), name
+    assert not np.ma.getmaskarray(followed["t"])[:2].any() and np.ma.getmaskarray(followed["t"])[2].all()
+
+def test_stopped_growing(tmp_path):
+    grib = tmp_path / "run.grib"
+    assert write(grib, steps=1).wait() == 0
+    stdout, stderr, code = convert(grib, 6, follow=True, poll=0.2, timeout=1)
+    # Finalized with the steps there are after `timeout` without growth
+    assert code == 0, stderr
+    assert "stopped growing before step 6 was complete" in stderr
+    assert not Path(f"{grib}.nc.part").exists()
+    values = fields(f"{grib}.nc", 2)
+    assert not np.ma.getmaskarray(values["t"])[0].any() and np.ma.getmaskarray(values["t"])[1].all()
+
+def test_nothing_written(tmp_path):
+    grib = tmp_path / "run.grib"
+    stdout, stderr, code = convert(grib, 6, follow=True, poll=0.2, timeout=0.5)
+    assert code != 0 and "No GRIB messages appeared" in stderr
+    assert not Path(f"{grib}.nc").exists()
@@ -0,0 +1,70 @@
+import json
+import math
+from pathlib import Path
+import numpy as np
+import mapbox_vector_tile
+import mvt
+
+# write_point_tiles' tiles decoded with mapbox-vector-tile, against pixel
+# positions worked out point by point with the web mercator formulas. The
+# points are a global grid (over 64 features in some tiles, so tags and lengths
+# take multi-byte varints), points just either side of tile edges (negative
+# and beyond-extent coordinates in the neighbouring tiles' buffers) and a
+# point beyond the mercator latitude limit.
+
+# tippecanoe's extent and buffer (5/256 of a tile)
+EXTENT = 4096
+BUFFER = 80
+
+def points():
+    lon, lat = np.meshgrid(np.arange(-180, 180, 5.), np.arange(-84, 85, 4.))
+    lon, lat = list(lon.ravel()), list(lat.ravel())
+    # Either side of the zoom 2 tile edge at 0 degrees, within the buffer
+    lon += [-0.5, 0.5, 1.5, 89.9]
+    lat += [0.5, -0.5, 40.0, 0.1]
+    # Dropped, like tippecanoe
+    lon.append(30.)
+    lat.append(89.)
+    return np.array(lon), np.array(lat)
+
+# Tiles (x, y) and pixel coordinates within them where a point should appear
+# at a zoom: its own tile and every tile whose buffer it is in
+def expected(lon, lat, zoom):
+    n = 1 << zoom
+    x = (lon + 180) / 360 % 1
+    y = (1 - math.log(math.tan(math.radians(lat)) + 1 / math.cos(math.radians(lat))) / math.pi) / 2
+    px, py = math.floor(x * n * EXTENT), math.floor(y * n * EXTENT)
+    for tx in range(n):
+        for ty in range(n):
+            if (tx * EXTENT - BUFFER <= px < (tx + 1) * EXTENT + BUFFER
+                    and ty * EXTENT - BUFFER <= py < (ty + 1) * EXTENT + BUFFER):
+                yield tx, ty, px - tx * EXTENT, py - ty * EXTENT
+
+def test_decode(tmp_path):
+    lon, lat = points()
+    magnitude = np.arange(len(lon)) * 1.25 - 40
+    direction = lon * 1e6 + lat
+    mvt.write_point_tiles(tmp_path, "20240101_00_gc_barbs", lon, lat, {"mag": magnitude, "dir": direction}, 2, 3)
+
+    for zoom in [2, 3]:
+        want = {}
+        for i in range(len(lon) - 1):
+            for tx, ty, px, py in expected(lon[i], lat[i], zoom):
+                want.setdefault((tx, ty), []).append((px, py, magnitude[i], direction[i]))
+        assert max(len(features) for features in want.values()) > 64
+        assert any(px < 0 or px >= EXTENT for features in want.values() for px, py, mag, dir in features)
+
+        got = {}
+        for path in (tmp_path / str(zoom)).glob("*/*.pbf"):
+            tile = mapbox_vector_tile.decode(path.read_bytes(), default_options={"y_coord_down": True})
+            assert list(tile) == ["20240101_00_gc_barbs"]
+            layer = tile["20240101_00_gc_barbs"]
+            assert layer["extent"] == EXTENT and layer["version"] == 2
+            got[(int(path.parent.name), int(path.stem))] = [
+                (*feature["geometry"]["coordinates"], feature["properties"]["mag"], feature["properties"]["dir"])
+                for feature in layer["features"] if feature["geometry"]["type"] == "Point"]
+        assert {key: sorted(value) for key, value in got.items()} == {key: sorted(value) for key, value in want.items()}
+
+    metadata = json.loads((Path(tmp_path) / "metadata.json").read_text())
+    assert metadata["minzoom"] == "2" and metadata["maxzoom"] == "3"
+    assert json.loads(metadata["json"])["vector_layers"][0]["fields"] == {"mag": "Number", "dir": "Number"}
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from netCDF4 import Dataset as DS
+from ncwriter import CODECS, ChunkWriter, codec_options, codec_available, precision_options
+
+# The same fields written both ways ChunkWriter can: compressed on worker
+# threads and stored as direct chunks, and through netCDF4 (grib2nc.py
+# --compress-workers 0). Reading them back must give the same values,
+# filters and attributes for every codec and precision setting.
+
+SHAPE = (3, 2, 91, 180)
+
+def fields():
+    rng = np.random.default_rng(0)
+    lat, lon = np.meshgrid(np.linspace(-90, 90, SHAPE[2]), np.linspace(0, 358, SHAPE[3]), indexing='ij')
+    for step in range(SHAPE[0]):
+        for level in range(SHAPE[1]):
+            values = 250 + 40 * np.cos(np.radians(lat)) + step * np.sin(np.radians(lon)) + rng.normal(0, 0.5, lat.shape)
+            values = values.astype('f4')
+            # Missing values are written as the fill value, which precision
+            # trimming leaves alone
+            yield (step, level), np.ma.masked_where(np.abs(lat) > 85 - level, values)
+
+# Create the variable as grib2nc.py's define_variable does, then write every
+# field through ChunkWriter. Returns the closed writer, or None if netCDF-C
+# lacks the codec's plugin.
+def write(path, codec, precision, workers):
+    with DS(path, 'w', format='NETCDF4') as f:
+        if not codec_available(f, codec):
+            return None
+        for name, size in zip(['time', 'level', 'latitude', 'longitude'], SHAPE):
+            f.createDimension(name, size)
+        f.createVariable('t', 'f4', ('time', 'level', 'latitude', 'longitude'), chunksizes=(1, 1) + SHAPE[2:],
+                         **codec_options(codec), **precision_options(precision))
+    writer = ChunkWriter(path, workers)
+    for index, values in fields():
+        writer.write('t', index, values)
+    writer.close()
+    return writer
+
+@pytest.mark.parametrize("precision", [None, ('bits', 7), ('digits', 1)])
+@pytest.mark.parametrize("codec", CODECS)
+def test_direct_chunks_match_netcdf4(tmp_path, codec, precision):
+    if write(tmp_path / "serial.nc", codec, precision, 0) is None:
+        pytest.skip(f"netCDF-C has no {codec} filter plugin")
+    writer = write(tmp_path / "direct.nc", codec, precision, 2)
+    # Compressed in Python rather than falling back to HDF5's filters
+    assert writer.workers and writer.pipelines['t'] is not None
+    with DS(tmp_path / "serial.nc") as serial, DS(tmp_path / "direct.nc") as direct:
+        expected, got = serial['t'], direct['t']
+        assert got.filters() == expected.filters()
+        assert {name: got.getncattr(name) for name in got.ncattrs()} == \
+            {name: expected.getncattr(name) for name in expected.ncattrs()}
+        expected, got = expected[:], got[:]
+        assert np.array_equal(got.mask, expected.mask)
+        assert np.array_equal(got.filled(0), expected.filled(0))
+        if precision is not None:
+            # The setting was applied, not just recorded
+            values = np.ma.concatenate([values.ravel() for index, values in fields()])
+            assert not np.array_equal(got.compressed(), values.compressed())
@@ -0,0 +1,134 @@
+import sys
+import json
+import shlex
+from pathlib import Path
+import pytest
+import pipeline
+
+# Stands in for every command of a cycle: logs when it starts and ends, sleeps
+# (long enough for model runs that their conversions start while they run,
+# and longer for the conversions) and exits 3 if the command contains one of
+# STUB_FAIL's patterns
+STUB = f"""#!{sys.executable}
+import os, sys, json, time, shlex
+command = shlex.join(sys.argv[1:])
+def log(event):
+    with open(os.environ["STUB_LOG"], "a") as f:
+        f.write(json.dumps([event, time.time(), command]) + "\\n")
+log("start")
+time.sleep(0.8 if "grib2nc.py" in command else 0.5 if "ai-models-gfs" in command else 0.1)
+failed = any(pattern in command for pattern in os.environ.get("STUB_FAIL", "").split(",") if pattern)
+log("failed" if failed else "end")
+sys.exit(3 if failed else 0)
+"""
+
+@pytest.fixture
+def cycle(tmp_path, monkeypatch):
+    stub = tmp_path / "stub.py"
+    stub.write_text(STUB)
+    stub.chmod(0o755)
+    log = tmp_path / "stub.log"
+    monkeypatch.setenv("STUB_LOG", str(log))
+
+    def run(*options, fail=()):
+        monkeypatch.setenv("STUB_FAIL", ",".join(fail))
+        args = pipeline.parse_args(["2024", "01", "01", "00", "gfs", "--cwd", str(tmp_path), "--aimodels", "ai-models-gfs",
+                                    "--models", "pw", "gc", "--geojson-path", str(tmp_path / "geojson"),
+                                    "--stub", str(stub)] + list(options))
+        stages = pipeline.cycle_stages(args)
+        keep = pipeline.prepare(args)
+        state, times = pipeline.run_stages(stages, {'gpu': args.gpu, 'cpu': args.cpu, 'io': args.io}, poll=0.05,
+                                           stub=args.stub, done=pipeline.resumed(args, keep))
+        return args, state, intervals(stages, log)
+    return run
+
+# {stage name: (first start, last end)} from the stub's log
+def intervals(stages, log):
+    by_command = {shlex.join(command): stage.name for stage in stages for command in stage.commands}
+    spans = {}
+    if not log.exists():
+        return spans
+    for line in log.read_text().splitlines():
+        event, when, command = json.loads(line)
+        start, end = spans.get(by_command[command], (None, None))
+        if event == "start":
+            start = when if start is None else start
+        else:
+            end = when
+        spans[by_command[command]] = (start, end)
+    log.unlink()
+    return spans
+
+def overlapping(spans, names):
+    spans = sorted(spans[name] for name in names)
+    return any(later[0] < earlier[1] for earlier, later in zip(spans, spans[1:]))
+
+def test_order(cycle):
+    args, state, spans = cycle()
+    assert all(value == 'done' for value in state.values()), state
+    for name in ["pw", "gc"]:
+        # Conversions follow their model run while it writes
+        assert spans[f"convert_{name}"][0] < spans[f"run_{name}"][1]
+        for after in [f"upload_{name}", f"remove_grib_{name}", "converted"]:
+            assert spans[after][0] >= spans[f"convert_{name}"][1]
+    # One contouring service for the cycle, started before any NetCDF is ready
+    command = next(stage.commands[0] for stage in pipeline.cycle_stages(args) if stage.name == "contour")
+    assert command.count("--job") == 2
+    assert spans["contour"][0] < spans["convert_pw"][1]
+    assert spans["tile"][0] >= spans["contour"][1]
+    assert spans["publish"][0] >= spans["tile"][1]
+    # The second model's upload doesn't wait for the first model's
+    assert spans["upload_pw"][0] < spans["convert_gc"][1]
+
+def test_slots(cycle):
+    args, state, spans = cycle("--cpu", "1", "--io", "1")
+    assert all(value == 'done' for value in state.values()), state
+    stages = pipeline.cycle_stages(args)
+    for slot in ['gpu', 'cpu', 'io']:
+        assert not overlapping(spans, [stage.name for stage in stages if stage.slot == slot]), slot
+
+def test_failed_run(cycle):
+    args, state, spans = cycle(fail=["assets/gc"])
+    assert state["run_gc"] == 'failed'
+    # The conversion following the failed run is stopped
+    assert state["convert_gc"] == 'failed' and spans["convert_gc"][1] is None
+    for name in ["remove_grib_gc", "upload_gc"]:
+        assert state[name] == 'skipped' and name not in spans
+    assert all(state[f"{kind}_pw"] == 'done' for kind in ["run", "convert", "remove_grib", "upload"])
+    # The contouring service is told no more NetCDFs are coming, and tiling
+    # and publishing go ahead with what was contoured
+    assert state["contour"] == state["converted"] == state["tile"] == state["publish"] == 'done'
+
+def test_failed_tile(cycle):
+    args, state, spans = cycle(fail=["tiling.py"])
+    assert state["tile"] == 'failed'
+    # Publishing is `always`, like the scripts it still sends what there is
+    assert state["publish"] == 'done' and spans["publish"][0] >= spans["tile"][1]
+
+def test_failed_needs(cycle):
+    args, state, spans = cycle(fail=["grib2nc.py"])
+    for name in ["pw", "gc"]:
+        assert state[f"run_{name}"] == 'done' and state[f"convert_{name}"] == 'failed'
+        assert state[f"upload_{name}"] == state[f"remove_grib_{name}"] == 'skipped'
+    assert state["converted"] == state["tile"] == state["publish"] == 'done'
+
+def test_resume(cycle, tmp_path):
+    args = pipeline.parse_args(["2024", "01", "01", "00", "gfs", "--cwd", str(tmp_path), "--aimodels", "ai-models-gfs"])
+    gc = Path(pipeline.model_paths(args, "GRAP_v100")[0])
+    gc.parent.mkdir(parents=True)
+    for suffix in ["", ".nc"]:
+        Path(f"{gc}{suffix}").write_text("")
+    args, state, spans = cycle("--resume")
+    assert all(value == 'done' for value in state.values()), state
+    # The converted model keeps its NetCDF and is only uploaded and contoured
+    assert Path(f"{gc}.nc").exists() and not gc.exists()
+    assert not any(name in spans for name in ["run_gc", "convert_gc", "remove_grib_gc"])
+    assert "upload_gc" in spans and "contour" in spans and "run_pw" in spans
+
+    # With --references, a NetCDF without references is converted again
+    args, state, spans = cycle("--resume", "--references")
+    assert "run_gc" in spans and "convert_gc" in spans
+
+    # Without --resume, everything is redone
+    args, state, spans = cycle()
+    assert "run_gc" in spans
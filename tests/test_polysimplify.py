@@ -0,0 +1,84 @@
+import sys
+import json
+import subprocess
+from collections import Counter
+from pathlib import Path
+import numpy as np
+import pytest
+from test_contour_geojson import FIXTURES, CASES, grid
+
+# contourf_geojson with retain=0.3, the in-process `mapshaper -simplify dp 30%`,
+# on the fixture field. The unsimplified file is the pinned stack's
+# contours_viridis_both.geojson, the file mapshaper used to simplify.
+# simplified_viridis_both.geojson is mapshaper's output for it; write it with
+# `python tests/test_polysimplify.py path/to/mapshaper`.
+
+CASE = "viridis_both"
+
+def simplified():
+    from contour_geojson import contourf_geojson
+    levels, extend, cmap, colors = CASES[CASE]
+    lons, lats = grid()
+    return contourf_geojson(lons, lats, np.load(FIXTURES / "field.npy"), levels, extend, cmap=cmap, colors=colors,
+                            ndigits=2, retain=0.3)
+
+def rings(collection):
+    for feature in collection["features"]:
+        for polygon in (feature["geometry"] or {"coordinates": []})["coordinates"]:
+            yield from polygon
+
+def on_border(point):
+    return point[0] in (0, 360) or point[1] in (-90, 90)
+
+# Times each segment between distinct points appears in any ring, in either
+# direction, leaving out segments along the edges of the grid
+def segment_counts(collection):
+    counts = Counter()
+    for ring in rings(collection):
+        for a, b in zip(map(tuple, ring[:-1]), map(tuple, ring[1:])):
+            if a != b and not (a[0] == b[0] and a[0] in (0, 360)) and not (a[1] == b[1] and a[1] in (-90, 90)):
+                counts[min(a, b), max(a, b)] += 1
+    return counts
+
+def test_shared_edges():
+    original = json.loads((FIXTURES / f"contours_{CASE}.geojson").read_text())
+    assert set(segment_counts(original).values()) == {2}
+    # Bands still share every boundary. A segment is only left unshared
+    # where the band beyond it was a sliver in a corner of the grid that
+    # collapsed and was dropped, as mapshaper drops it.
+    for (a, b), count in segment_counts(simplified()).items():
+        assert count == 2 or (count == 1 and on_border(a) and on_border(b)), (a, b, count)
+
+def test_rings():
+    original = json.loads((FIXTURES / f"contours_{CASE}.geojson").read_text())
+    vertices = {tuple(point) for ring in rings(original) for point in ring}
+    collection = simplified()
+    assert len(collection["features"]) == len(original["features"])
+    kept = 0
+    for ring in rings(collection):
+        assert len(ring) >= 4 and ring[0] == ring[-1]
+        assert all(a != b for a, b in zip(ring[:-1], ring[1:]))
+        # Simplification only removes vertices
+        assert {tuple(point) for point in ring} <= vertices
+        kept += len(ring)
+    assert 0.25 < kept / sum(len(ring) for ring in rings(original)) < 0.4
+
+# Within a few percent of mapshaper: the vertices of each band, and the
+# vertices kept overall
+def test_matches_mapshaper():
+    reference = FIXTURES / f"simplified_{CASE}.geojson"
+    if not reference.exists():
+        pytest.skip(f"no {reference.name}, written with mapshaper by `python tests/test_polysimplify.py MAPSHAPER`")
+    mapshaper = json.loads(reference.read_text())
+    collection = simplified()
+    assert len(collection["features"]) == len(mapshaper["features"])
+    for ours, theirs in zip(collection["features"], mapshaper["features"]):
+        ours, theirs = [sum(len(ring) for ring in rings({"features": [feature]})) for feature in (ours, theirs)]
+        assert abs(ours - theirs) <= max(0.05 * theirs, 10)
+    ours = {tuple(point) for ring in rings(collection) for point in ring}
+    theirs = {tuple(point) for ring in rings(mapshaper) for point in ring}
+    assert len(ours & theirs) >= 0.95 * max(len(ours), len(theirs))
+
+if __name__ == "__main__":
+    subprocess.run([sys.argv[1], str(FIXTURES / f"contours_{CASE}.geojson"), "-simplify", "dp", "30%",
+                    "-o", str(FIXTURES / f"simplified_{CASE}.geojson")], check=True)
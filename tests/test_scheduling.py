@@ -0,0 +1,27 @@
+import os
+import time
+import signal
+import scheduling
+
+# Sleeps briefly, raises for "raise" and kills its own worker for "die"
+def work(task):
+    if task == "die":
+        os.kill(os.getpid(), signal.SIGKILL)
+    if task == "raise":
+        raise ValueError(task)
+    time.sleep(0.1)
+
+def test_failures(monkeypatch):
+    monkeypatch.setattr(scheduling, "CHECK_INTERVAL", 0.2)
+    assert sorted(scheduling.run_tasks(work, ["a", "raise", "b", "die", "c"], 2)) == ["die", "raise"]
+
+def task_name(task):
+    return task if isinstance(task, str) else "lambda"
+
+# A task the pool can't pickle fails instead of never reporting back
+def test_unpicklable():
+    pool = scheduling.TaskPool(1)
+    pool.submit(work, ["a", lambda: None, "b"], name=task_name)
+    assert pool.collect() == 0
+    pool.close()
+    assert pool.failed == ["lambda"]
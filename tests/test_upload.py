@@ -0,0 +1,77 @@
+import json
+import hashlib
+import pytest
+import metrics
+import upload
+
+moto = pytest.importorskip("moto")
+
+MB = upload.MB
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in [("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")]:
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        s3 = upload.client(workers=4)
+        s3.create_bucket(Bucket="bucket")
+        yield s3
+
+def write(path, size, seed=0):
+    path.write_bytes(hashlib.shake_256(str(seed).encode()).digest(size))
+    return path
+
+def stored(s3, key):
+    return s3.get_object(Bucket="bucket", Key=key)["Body"].read()
+
+def test_single_part(s3, tmp_path):
+    path = write(tmp_path / "a.json", 1000)
+    assert upload.upload(s3, path, "s3://bucket/x/a.json")
+    assert stored(s3, "x/a.json") == path.read_bytes()
+    head = s3.head_object(Bucket="bucket", Key="x/a.json")
+    assert head["ETag"].strip('"') == hashlib.md5(path.read_bytes()).hexdigest()
+    assert head["Metadata"]["sha256"] == hashlib.sha256(path.read_bytes()).hexdigest()
+
+def test_multipart(s3, tmp_path):
+    path = write(tmp_path / "a.nc", 12 * MB + 1)
+    assert upload.upload(s3, path, "s3://bucket/x/a.nc", part_size=5 * MB, workers=3)
+    assert stored(s3, "x/a.nc") == path.read_bytes()
+    data = path.read_bytes()
+    parts = [hashlib.md5(data[offset:offset + 5 * MB]).digest() for offset in range(0, len(data), 5 * MB)]
+    assert s3.head_object(Bucket="bucket", Key="x/a.nc")["ETag"].strip('"') == f"{hashlib.md5(b''.join(parts)).hexdigest()}-3"
+
+def test_unchanged_skipped(s3, tmp_path):
+    path = write(tmp_path / "a.nc", 11 * MB)
+    assert upload.upload(s3, path, "s3://bucket/a.nc", part_size=5 * MB)
+    assert not upload.upload(s3, path, "s3://bucket/a.nc", part_size=5 * MB)
+    write(path, 11 * MB, seed=1)
+    assert upload.upload(s3, path, "s3://bucket/a.nc", part_size=5 * MB)
+    assert stored(s3, "a.nc") == path.read_bytes()
+
+def test_corrupted_part_aborted(s3, tmp_path, monkeypatch):
+    path = write(tmp_path / "a.nc", 11 * MB)
+    assert upload.upload(s3, path, "s3://bucket/a.nc", part_size=5 * MB)
+    before = s3.head_object(Bucket="bucket", Key="a.nc")
+
+    # The second part's MD5 doesn't match what is sent, as if it had been
+    # corrupted on the way. S3 rejects the part for its Content-MD5; moto
+    # doesn't check that, so the ETag check catches it.
+    write(path, 11 * MB, seed=1)
+    md5 = upload.md5
+    monkeypatch.setattr(upload, "md5", lambda data: md5(data + b"x") if data[:5 * MB] == path.read_bytes()[5 * MB:10 * MB] else md5(data))
+    with pytest.raises(RuntimeError, match="Part 2"):
+        upload.upload(s3, path, "s3://bucket/a.nc", part_size=5 * MB, workers=1)
+    assert not s3.list_multipart_uploads(Bucket="bucket").get("Uploads")
+    assert s3.head_object(Bucket="bucket", Key="a.nc")["ETag"] == before["ETag"]
+
+def test_upload_files(s3, tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "path", str(tmp_path / "metrics.jsonl"))
+    nc, json_file = write(tmp_path / "a.nc", 6 * MB), write(tmp_path / "a.json", 100)
+    pairs = [(str(nc), "s3://bucket/a.nc"), (str(json_file), "s3://bucket/a.json")]
+    assert upload.upload_files(s3, pairs, part_size=5 * MB) == []
+    # Missing buckets fail, but don't stop the other uploads
+    assert upload.upload_files(s3, [(str(nc), "s3://missing/a.nc")] + pairs, part_size=5 * MB) == [str(nc)]
+    records = [json.loads(line) for line in (tmp_path / "metrics.jsonl").read_text().splitlines()]
+    assert [(record["file"], record["ok"], record.get("uploaded")) for record in records] == [
+        ("a.nc", True, True), ("a.json", True, True), ("a.nc", False, None), ("a.nc", True, False), ("a.json", True, False)]
@@ -0,0 +1,109 @@
+import sys
+import time
+import logging
+import argparse
+import subprocess as sp
+from pathlib import Path
+from scheduling import run_tasks
+import metrics
+import cache
+
+logging.basicConfig(level=logging.INFO)
+
+# Vector tiles for the simplified GeoJSON files of a cycle, made with the same
+# tippecanoe options the run scripts used, on a worker pool instead of one file
+# at a time. The command line here picks up whatever contour_service.py did
+# not tile and cleans up.
+
+# Defaults for the command line options. contour_service.py sets tippecanoe
+# to tile each file as soon as it is written; None leaves them to the
+# command line here.
+tippecanoe = None
+maxzoom = 4
+retries = 2
+
+# <geojson_path>/<YYYYMMDD_HH>/<model>_<init_cond>/<name>.geojson.simple is
+# tiled into <name>_tiles as layer <YYYYMMDD_HH>_<name>
+def layer_name(outdir, name):
+    return f"{Path(outdir).parent.name}_{name}"
+
+def tile_paths(geojsonfile):
+    geojsonfile = Path(geojsonfile)
+    name = geojsonfile.name.split('.geojson')[0]
+    return geojsonfile.parent / f"{name}_tiles", layer_name(geojsonfile.parent, name)
+
+def tippecanoe_command(geojsonfile):
+    tiledir, layer = tile_paths(geojsonfile)
+    command = [tippecanoe]
+    if 'windbarb' in Path(geojsonfile).name:
+        command.append("--drop-rate=0")
+    return command + ["--read-parallel", "-l", layer, "-e", str(tiledir), "--minimum-zoom=2",
+                      f"--maximum-zoom={maxzoom}", "--no-tile-compression", str(geojsonfile), "--force"]
+
+# The tippecanoe command without its input and output paths: the layer name
+# and settings a tile directory is made with, for cache keys
+def tippecanoe_settings(geojsonfile):
+    paths = [str(path) for path in [geojsonfile, tile_paths(geojsonfile)[0]]]
+    return [part for part in tippecanoe_command(geojsonfile)[1:] if part not in paths]
+
+# Run tippecanoe on one file, retrying failed runs. Raises
+# CalledProcessError after the last try.
+def run_tippecanoe(geojsonfile, delay=5):
+    for attempt in range(retries + 1):
+        with metrics.stage("tippecanoe", file=Path(geojsonfile).name, bytes_in=metrics.size(geojsonfile)) as fields:
+            result = metrics.run(tippecanoe_command(geojsonfile), fields, stdout=sp.DEVNULL)
+            fields["ok"] = result.returncode == 0
+        if result.returncode == 0:
+            return
+        logging.warning(f"tippecanoe failed on {geojsonfile} (attempt {attempt + 1}): {result.stderr.strip()[-500:]}")
+        if attempt == retries:
+            result.check_returncode()
+        time.sleep(delay)
+
+# Tile one file and remove it (and the unsimplified GeoJSON, if any) once
+# tiled. With `cached`, the tiles of a file tiled before with the same
+# command come from the cache (contouring.py and winds.py cache their tiles
+# under their own keys and pass cached=False).
+def tile_file(geojsonfile, delay=5, cached=True):
+    tiledir = tile_paths(geojsonfile)[0]
+    product_key = None
+    if cached and cache.directory:
+        product_key = cache.key("tippecanoe", cache.code("tiling.py"), tippecanoe_settings(geojsonfile),
+                                Path(geojsonfile).read_bytes())
+    if not (product_key and cache.fetch(product_key, tiledir)):
+        run_tippecanoe(geojsonfile, delay)
+        if product_key:
+            cache.store(product_key, tiledir)
+    Path(geojsonfile).unlink()
+    Path(str(geojsonfile).split('.geojson')[0] + '.geojson').unlink(missing_ok=True)
+
+# Remove the intermediate GeoJSON and the placeholder .simple files, as the
+# run scripts did after tiling
+def cleanup(cycle_dir):
+    for pattern in ["*/*.geojson", "*/*.simple"]:
+        for path in Path(cycle_dir).glob(pattern):
+            path.unlink()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tile the simplified GeoJSON files of a cycle with tippecanoe")
+    parser.add_argument("cycle_dir", help="<geojson_path>/<YYYYMMDD_HH>")
+    parser.add_argument("--tippecanoe", default="tippecanoe", help="tippecanoe binary")
+    parser.add_argument("--maximum-zoom", type=int, default=maxzoom)
+    parser.add_argument("--workers", type=int, default=14, help="tippecanoe processes at a time")
+    parser.add_argument("--retries", type=int, default=retries, help="retries per file after a failed run")
+    parser.add_argument("--no-cleanup", action="store_true", help="keep the GeoJSON files")
+    parser.add_argument("--cache", help="reuse tiles from (and add them to) this cache directory")
+    args = parser.parse_args()
+    # Set before the pool starts so the workers inherit them
+    tippecanoe, maxzoom, retries = args.tippecanoe, args.maximum_zoom, args.retries
+    cache.directory = args.cache
+
+    # Largest files first
+    files = sorted(Path(args.cycle_dir).glob("*/*.geojson.simple"), key=lambda path: path.stat().st_size, reverse=True)
+    logging.info(f"Tiling {len(files)} files")
+    failed = run_tasks(tile_file, files, args.workers)
+    if not args.no_cleanup:
+        cleanup(args.cycle_dir)
+    if failed:
+        logging.error(f"{len(failed)} files failed to tile: {' '.join(failed)}")
+        sys.exit(1)
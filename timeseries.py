@@ -0,0 +1,201 @@
+import os
+import glob
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import xarray as xr
+from netCDF4 import Dataset as DS
+from netCDF4 import default_fillvals
+from ncwriter import codec_options, compress_chunk, filter_pipeline, h5py
+
+logging.basicConfig(level=logging.INFO)
+
+# A companion to each model NetCDF laid out for time series. The NetCDF keeps
+# one global field per chunk (1,1,721,1440), which suits contouring, but a
+# 41-step series at one point then decompresses 41 whole fields per variable
+# and level. The companion <infile>.ts.nc holds the same values in chunks of
+# every step over a small tile, (41,1,32,32), so a point series is one chunk
+# per variable and level and a region a few. It has the same variables,
+# coordinates and attributes, so it opens like the NetCDF itself.
+
+TILE = 32
+
+def companion_path(ncfile):
+    return f"{ncfile[:-3]}.ts.nc" if ncfile.endswith(".nc") else f"{ncfile}.ts.nc"
+
+# Write the companion of `ncfile` (to <ncfile without .nc>.ts.nc by default).
+# With h5py and workers > 0 the tiles are compressed on a thread pool and
+# stored with direct chunk writes, like ncwriter.ChunkWriter.
+def write_companion(ncfile, outfile=None, tile=TILE, codec='zlib', complevel=4, shuffle=True, workers=4):
+    outfile = outfile or companion_path(ncfile)
+    partfile = f"{outfile}.part"
+    compression = codec_options(codec, complevel, shuffle)
+    with DS(ncfile) as src, DS(partfile, 'w', format='NETCDF4') as dst:
+        dst.setncatts({name: src.getncattr(name) for name in src.ncattrs()})
+        for name, dim in src.dimensions.items():
+            dst.createDimension(name, len(dim))
+        names = []
+        for name, var in src.variables.items():
+            attrs = {attr: var.getncattr(attr) for attr in var.ncattrs() if not attr.startswith('_')}
+            if var.dimensions[-2:] != ('latitude', 'longitude'):
+                out = dst.createVariable(name, var.dtype, var.dimensions, compression='zlib', complevel=4)
+                out[:] = var[:]
+            else:
+                chunks = tuple(len(src.dimensions[dim]) if dim == 'time' else 1 for dim in var.dimensions[:-2]) + (tile, tile)
+                out = dst.createVariable(name, var.dtype, var.dimensions, chunksizes=chunks, **compression)
+                names.append(name)
+            out.setncatts(attrs)
+
+    if workers and h5py is not None:
+        write_tiles_direct(ncfile, partfile, names, tile, workers)
+    else:
+        with DS(ncfile) as src, DS(partfile, 'a') as dst:
+            for name in names:
+                for index in leading_indices(src.variables[name]):
+                    dst.variables[name][index] = src.variables[name][index]
+    os.replace(partfile, outfile)
+    return outfile
+
+# Indices over the dimensions between time and latitude (levels), each
+# selecting every step of one 2-D field
+def leading_indices(var):
+    shape = var.shape[1:-2]
+    return [(slice(None),) + index for index in np.ndindex(*shape)]
+
+def write_tiles_direct(ncfile, partfile, names, tile, workers):
+    pool = ThreadPoolExecutor(workers)
+    pending = deque()
+    with DS(ncfile) as src, h5py.File(partfile, 'r+') as h5:
+        for name in names:
+            dataset = h5[name]
+            pipeline = filter_pipeline(dataset)
+            fill_value = default_fillvals[dataset.dtype.str[1:]]
+            for index in leading_indices(src.variables[name]):
+                values = np.ma.filled(src.variables[name][index], fill_value).astype(dataset.dtype)
+                if pipeline is None:
+                    dataset[index] = values
+                    continue
+                # Every step of one level, padded with fill values to whole
+                # tiles since edge chunks are stored full size
+                ntime, nlat, nlon = values.shape
+                padded = np.full((ntime, -(-nlat // tile) * tile, -(-nlon // tile) * tile), fill_value, dtype=dataset.dtype)
+                padded[:, :nlat, :nlon] = values
+                shape = (ntime,) + (1,) * len(index[1:]) + (tile, tile)
+                for y in range(0, nlat, tile):
+                    for x in range(0, nlon, tile):
+                        chunk = np.ascontiguousarray(padded[:, y:y + tile, x:x + tile]).reshape(shape)
+                        pending.append((dataset, (0,) + index[1:] + (y, x), pool.submit(compress_chunk, chunk, pipeline)))
+                        while len(pending) > 4 * workers:
+                            write_chunk(*pending.popleft())
+        while pending:
+            write_chunk(*pending.popleft())
+    pool.shutdown()
+
+def write_chunk(dataset, offset, future):
+    dataset.id.write_direct_chunk(offset, future.result())
+
+# Model NetCDFs under an output_data directory,
+# <product>/<YYYY>/<MMDD>/<product>_<YYYYMMDDHH>_f000_f240_06.nc, optionally
+# only products matching `pattern` (e.g. GRAP_v100_*) and the given cycles
+# (YYYYMMDDHH)
+def find_runs(output_data, pattern="*", cycles=None):
+    paths = sorted(glob.glob(f"{output_data}/{pattern}/*/*/*_f000_f240_06.nc"))
+    if cycles:
+        paths = [path for path in paths if os.path.basename(path).split("_")[-4] in cycles]
+    return paths
+
+# Open datasets, reused between queries like contouring.open_model_file
+datasets = {}
+
+# The companion of a model NetCDF if it has one (and `companion`), else the
+# NetCDF itself
+def open_run(path, companion=True):
+    if companion and os.path.exists(companion_path(path)):
+        path = companion_path(path)
+    if path not in datasets:
+        datasets[path] = xr.open_dataset(path)
+    return datasets[path]
+
+# Product and cycle of a model NetCDF, e.g. GRAP_v100_GFS_2024010100
+def run_name(path):
+    return os.path.basename(path).split("_f000_")[0]
+
+# Longitude in the range of the file's longitudes (0..360 or -180..180)
+def wrap_lon(ds, lon):
+    lons = ds['longitude'].values
+    return lon % 360 if lons.min() >= 0 else (lon + 180) % 360 - 180
+
+# Variables (at `levels`, if given) with time as hours since initialization
+# and the valid time as a coordinate, so runs of different cycles line up
+def by_lead_time(ds, variables, levels):
+    ds = ds[variables]
+    if levels is not None and 'level' in ds.dims:
+        ds = ds.sel(level=levels)
+    hours = ((ds['time'] - ds['time'][0]) / np.timedelta64(1, 'h')).astype(int)
+    return ds.assign_coords(valid_time=ds['time'], time=hours.values).rename(time='lead_hours')
+
+# The NetCDFs have no _FillValue attribute, so steps a model didn't write read
+# as netCDF's default fill value rather than NaN
+def mask_fill(ds):
+    return ds.where(ds != default_fillvals['f4'])
+
+# Time series at the grid point nearest (lat, lon) from each run, as one
+# dataset with a `run` dimension (product and cycle, see run_name)
+def point(paths, lat, lon, variables, levels=None, companion=True):
+    series = []
+    for path in paths:
+        ds = open_run(path, companion)
+        j = int(np.abs(ds['latitude'].values - lat).argmin())
+        i = int(np.abs(ds['longitude'].values - wrap_lon(ds, lon)).argmin())
+        sub = by_lead_time(ds, variables, levels).isel(latitude=j, longitude=i).load()
+        series.append(mask_fill(sub).expand_dims(run=[run_name(path)]))
+    return xr.concat(series, dim='run')
+
+# Time series over lat_range x lon_range (degrees, lon_range may cross the
+# dateline, e.g. (170, -170)) from each run, as {run: dataset}. Runs are kept
+# apart since models use different longitude conventions.
+def region(paths, lat_range, lon_range, variables, levels=None, companion=True):
+    regions = {}
+    for path in paths:
+        ds = open_run(path, companion)
+        lats = ds['latitude'].values
+        rows = np.where((lats >= min(lat_range)) & (lats <= max(lat_range)))[0]
+        lons = ds['longitude'].values
+        west, east = wrap_lon(ds, lon_range[0]), wrap_lon(ds, lon_range[1])
+        if west <= east:
+            spans = [np.where((lons >= west) & (lons <= east))[0]]
+        else:
+            spans = [np.where(lons >= west)[0], np.where(lons <= east)[0]]
+        sub = by_lead_time(ds, variables, levels).isel(latitude=slice(rows.min(), rows.max() + 1))
+        parts = [sub.isel(longitude=slice(span.min(), span.max() + 1)).load() for span in spans if len(span)]
+        regions[run_name(path)] = mask_fill(parts[0] if len(parts) == 1 else xr.concat(parts, dim='longitude'))
+    return regions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write time-series companions of model NetCDFs, or extract a point series")
+    commands = parser.add_subparsers(dest="command", required=True)
+    write_parser = commands.add_parser("write", help="write <file>.ts.nc next to each NetCDF")
+    write_parser.add_argument("ncfiles", nargs="+")
+    write_parser.add_argument("--tile", type=int, default=TILE, help="tile size in grid points")
+    write_parser.add_argument("--codec", default="zlib")
+    write_parser.add_argument("--complevel", type=int, default=4)
+    write_parser.add_argument("--workers", type=int, default=4, help="threads compressing tiles (0 writes through netCDF4)")
+    point_parser = commands.add_parser("point", help="print the series at a point as CSV")
+    point_parser.add_argument("output_data", help="output_data directory to search")
+    point_parser.add_argument("lat", type=float)
+    point_parser.add_argument("lon", type=float)
+    point_parser.add_argument("--variables", nargs="+", default=["t2", "msl", "u10", "v10"])
+    point_parser.add_argument("--levels", nargs="+", type=int)
+    point_parser.add_argument("--products", default="*", help="product directory pattern, e.g. GRAP_v100_*")
+    point_parser.add_argument("--cycles", nargs="+", help="YYYYMMDDHH")
+    args = parser.parse_args()
+
+    if args.command == "write":
+        for ncfile in args.ncfiles:
+            logging.info(f"Wrote {write_companion(ncfile, tile=args.tile, codec=args.codec, complevel=args.complevel, workers=args.workers)}")
+    else:
+        paths = find_runs(args.output_data, args.products, args.cycles)
+        series = point(paths, args.lat, args.lon, args.variables, args.levels)
+        print(series.to_dataframe().to_csv())
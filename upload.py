@@ -0,0 +1,121 @@
+import os
+import sys
+import base64
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+# Upload files to S3 in parallel multipart parts, in one process instead of an
+# `aws s3 cp` per file. Every part is sent with its MD5 so S3 rejects a
+# corrupted part, and the part and object ETags are checked against the local
+# MD5s. The file's SHA-256 is stored as object metadata; a file whose object
+# already has the same SHA-256 is skipped, so rerunning after a partial
+# failure only uploads what is missing or changed.
+
+MB = 1 << 20
+
+def split_url(url):
+    bucket, _, key = url.removeprefix("s3://").partition("/")
+    return bucket, key
+
+def sha256(path, blocksize=16 * MB):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(blocksize):
+            digest.update(block)
+    return digest.hexdigest()
+
+def md5(data):
+    return hashlib.md5(data).digest()
+
+def read_part(path, offset, size):
+    with open(path, 'rb') as f:
+        return os.pread(f.fileno(), size, offset)
+
+def upload_part(s3, path, bucket, key, upload_id, number, offset, size):
+    data = read_part(path, offset, size)
+    digest = md5(data)
+    etag = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data,
+                          ContentMD5=base64.b64encode(digest).decode())['ETag'].strip('"')
+    if etag != digest.hex():
+        raise RuntimeError(f"Part {number} of {path} came back with ETag {etag}, expected {digest.hex()}")
+    return {'PartNumber': number, 'ETag': etag}, digest
+
+# Returns True if the file was uploaded, False if the object was unchanged
+def upload(s3, path, url, part_size=64 * MB, workers=8):
+    bucket, key = split_url(url)
+    checksum = sha256(path)
+    try:
+        if s3.head_object(Bucket=bucket, Key=key)['Metadata'].get('sha256') == checksum:
+            logging.info(f"{url} is unchanged, skipping")
+            return False
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            raise
+
+    size = os.path.getsize(path)
+    if size <= part_size:
+        data = read_part(path, 0, size)
+        etag = s3.put_object(Bucket=bucket, Key=key, Body=data, Metadata={'sha256': checksum},
+                             ContentMD5=base64.b64encode(md5(data)).decode())['ETag'].strip('"')
+        expected = md5(data).hex()
+    else:
+        upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, Metadata={'sha256': checksum})['UploadId']
+        offsets = range(0, size, part_size)
+        try:
+            with ThreadPoolExecutor(workers) as pool:
+                results = list(pool.map(lambda part: upload_part(s3, path, bucket, key, upload_id, part[0] + 1,
+                                                                 part[1], min(part_size, size - part[1])),
+                                        enumerate(offsets)))
+            etag = s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                MultipartUpload={'Parts': [part for part, digest in results]})['ETag'].strip('"')
+        except BaseException:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+        # S3's multipart ETag: MD5 of the part MD5s, and the number of parts
+        expected = f"{hashlib.md5(b''.join(digest for part, digest in results)).hexdigest()}-{len(results)}"
+    if etag != expected:
+        raise RuntimeError(f"{url} came back with ETag {etag}, expected {expected}")
+    logging.info(f"Uploaded {path} to {url} ({size / MB:.1f} MB)")
+    return True
+
+# Upload (file, url) pairs, going on past failures. Returns the files that failed.
+def upload_files(s3, pairs, part_size=64 * MB, workers=8):
+    failed = []
+    for path, url in pairs:
+        try:
+            with metrics.stage("upload", file=os.path.basename(path), bytes_in=metrics.size(path)) as fields:
+                fields["uploaded"] = upload(s3, path, url, part_size, workers)
+        except Exception:
+            logging.exception(f"Uploading {path} to {url} failed")
+            failed.append(path)
+    return failed
+
+def client(profile=None, endpoint_url=None, workers=8):
+    session = boto3.Session(profile_name=profile)
+    return session.client('s3', endpoint_url=endpoint_url,
+                          config=Config(max_pool_connections=workers, retries={'max_attempts': 5, 'mode': 'standard'}))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload files to S3 in parallel parts, skipping unchanged objects")
+    parser.add_argument("pairs", nargs="+", metavar="FILE S3URL", help="local file and s3://bucket/key, repeated")
+    parser.add_argument("--profile", help="AWS profile (as aws --profile)")
+    parser.add_argument("--endpoint-url", help="S3 endpoint, e.g. a local MinIO or moto server")
+    parser.add_argument("--part-size", type=int, default=64, help="part size in MB (at least 5)")
+    parser.add_argument("--workers", type=int, default=8, help="parts uploaded at a time")
+    args = parser.parse_args()
+    if len(args.pairs) % 2:
+        parser.error("expected FILE S3URL pairs")
+
+    s3 = client(args.profile, args.endpoint_url, args.workers)
+    failed = upload_files(s3, list(zip(args.pairs[::2], args.pairs[1::2])), args.part_size * MB, args.workers)
+    if failed:
+        logging.error(f"{len(failed)} uploads failed: {' '.join(failed)}")
+        sys.exit(1)
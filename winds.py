@@ -1,89 +1,150 @@
 import sys
-import json
-import subprocess as sp
 import numpy as np
 import xarray as xr
-import matplotlib.pyplot as plt
 from pathlib import Path
-from datetime import datetime
-from scipy.ndimage import gaussian_filter
-from multiprocessing import Pool
 import logging
-import geojsoncontour
-import geojson
-from metpy.calc import relative_humidity_from_specific_humidity
-from metpy.units import units
-from functools import partial
+import argparse
+from scheduling import run_tasks
+from mvt import write_point_tiles
+import tiling
+import metrics
+import cache
 
-def shift_lons(lon,model):
+logging.basicConfig(level=logging.INFO)
+
+# Default for --output
+output = 'tiles'
+
+# Longitudes in -180..180 for the 0..360 models, as one array operation
+def shift_lons(lons,model):
     if model in ['fcnv2','pw','gc','gfs','au']:
-        return lon - 360 if lon > 180 else lon
+        return np.where(lons > 180, lons - 360, lons)
     else:
-        return lon
+        return lons
 
-def run_processor(step):
-    stepstr = str(step*6).zfill(3)
-    for lev in range(0,13):
-        level = str(data['level'][lev].values)
-        features = []
-        for i in range(latitudes.shape[0]):
-            for j in range(longitudes.shape[0]):
-                lat = latitudes[i]
-                lon = shift_lons(longitudes[j],model)
-                feature = geojson.Feature(
-                        geometry=geojson.Point((float(lon), float(lat))),
-                        properties={
-                                "direction": float(direction[step,lev,i,j]),
-                                "magnitude": float(magnitude[step,lev,i,j])
-                        }
-                )
-                features.append(feature)
-        feature_collection = geojson.FeatureCollection(features)
-        outfile = f'{outdir}/{model}_{init_cond}_windbarbs{level}_{stepstr}.geojson.simple'
-        with open(outfile, 'w') as f:
-            geojson.dump(feature_collection,f)
-
-    features = []
-    for i in range(latitudes.shape[0]):
-        for j in range(longitudes.shape[0]):
-            lat = latitudes[i]
-            lon = shift_lons(longitudes[j],model)
-            feature = geojson.Feature(
-                    geometry=geojson.Point((float(lon), float(lat))),
-                    properties={
-                            "direction": float(direction10[step,i,j]),
-                            "magnitude": float(magnitude10[step,i,j])
-                    }
-            )
-            features.append(feature)
-    feature_collection = geojson.FeatureCollection(features)
-    outfile = f'{outdir}/{model}_{init_cond}_windbarbs10_{stepstr}.geojson.simple'
+# Wind barbs every 10th grid point: magnitude (kt) and direction (degrees)
+# of one level (None for 10 m) at one step
+def barbs(ds, step, lev):
+    if lev is None:
+        u = ds['u10'][step,::10,::10]
+        v = ds['v10'][step,::10,::10]
+    else:
+        u = ds['u'][step,lev,::10,::10]
+        v = ds['v'][step,lev,::10,::10]
+    magnitude = np.sqrt(u**2 + v**2)*1.94384
+    direction = (np.arctan2(v, u) * 180 / np.pi + 360) % 360
+    magnitude = np.nan_to_num(magnitude, nan=0.0, posinf=0.0, neginf=0.0)
+    direction = np.nan_to_num(direction, nan=0.0, posinf=0.0, neginf=0.0)
+    return magnitude, direction
+
+# A wind barb feature as geojson.dump writes it. Python floats format with
+# repr like json does, so the files are the same as building a
+# geojson.Feature per point.
+FEATURE = ('{"type": "Feature", "geometry": {"type": "Point", "coordinates": [%r, %r]}, '
+           '"properties": {"direction": %r, "magnitude": %r}}')
+
+# Write the FeatureCollection text from whole arrays
+def write_barbs(magnitude, direction, outfile):
+    lon, lat = np.meshgrid(shift_lons(longitudes, model), latitudes)
+    rows = zip(lon.ravel().tolist(), lat.ravel().tolist(), direction.ravel().tolist(), magnitude.ravel().tolist())
     with open(outfile, 'w') as f:
-        geojson.dump(feature_collection,f)
+        f.write('{"type": "FeatureCollection", "features": [')
+        f.write(', '.join([FEATURE % row for row in rows]))
+        f.write(']}')
+
+# A task writes the barbs of one level (index, or None for 10 m) at one step:
+# (job, step, lev), where job is (model, init_cond, model_file, outdir).
+# Workers switch to a task's job and keep its NetCDF open for the tasks that
+# follow.
+job = None
+datasets = {}
+
+def set_job(new_job):
+    global job, model, init_cond, model_file, outdir, longitudes, latitudes
+    if new_job != job:
+        job = new_job
+        model, init_cond, model_file, outdir = job
+        ds = open_model_file(model_file)
+        longitudes = ds['longitude'].values[::10]
+        latitudes = ds['latitude'].values[::10]
+
+def open_model_file(path):
+    if path not in datasets:
+        datasets[path] = xr.open_dataset(path)
+    return datasets[path]
+
+def barb_tasks(job, steps=range(0,41)):
+    with xr.open_dataset(job[2]) as ds:
+        nlevels = len(ds['level'])
+    return [(job, step, lev) for step in steps for lev in list(range(nlevels)) + [None]]
+
+def task_name(task):
+    job, step, lev = task
+    return f"{job[0]}_{job[1]}_windbarbs{'10' if lev is None else lev}_{str(step*6).zfill(3)}"
+
+# Vector tiles for zooms 2 to tiling.maxzoom in <name>_tiles, as tippecanoe -e made them from
+# the GeoJSON. outdir is <geojson_path>/<YYYYMMDD_HH>/<model>_<init_cond>, and
+# layers are named <YYYYMMDD_HH>_<name> like the run scripts name them.
+def write_barb_tiles(magnitude, direction, name):
+    lon, lat = np.meshgrid(shift_lons(longitudes, model), latitudes)
+    write_point_tiles(f'{outdir}/{name}_tiles', tiling.layer_name(outdir, name),
+                      lon.ravel(), lat.ravel(), {"direction": direction.ravel(), "magnitude": magnitude.ravel()},
+                      minzoom=2, maxzoom=tiling.maxzoom)
+
+# Cache key of a task's product: the barbs, where they are, the output and,
+# for tiles, the layer name and zooms (or the tippecanoe settings)
+def barb_key(magnitude, direction, name):
+    if output == 'tiles':
+        tiled = (tiling.layer_name(outdir, name), tiling.maxzoom)
+    elif tiling.tippecanoe:
+        tiled = tiling.tippecanoe_settings(f'{outdir}/{name}.geojson.simple')
+    else:
+        tiled = None
+    return cache.key("winds", cache.code("winds.py", "mvt.py", "tiling.py"), model, output, tiled,
+                     shift_lons(longitudes, model), latitudes, magnitude, direction)
+
+def run_task(task):
+    task_job, step, lev = task
+    set_job(task_job)
+    ds = open_model_file(model_file)
+    stepstr = str(step*6).zfill(3)
+    level = '10' if lev is None else str(ds['level'][lev].values)
+    metrics.labels.update(model=model, init_cond=init_cond, step=step, var=f'windbarbs{level}')
+    with metrics.stage("winds"):
+        magnitude, direction = barbs(ds, step, lev)
+        name = f'{model}_{init_cond}_windbarbs{level}_{stepstr}'
+        geojsonfile = f'{outdir}/{name}.geojson.simple'
+        product = geojsonfile if output == 'geojson' and not tiling.tippecanoe else f'{outdir}/{name}_tiles'
+        product_key = barb_key(magnitude, direction, name) if cache.directory else None
+        if product_key and cache.fetch(product_key, product):
+            return
+        if output == 'tiles':
+            write_barb_tiles(magnitude, direction, name)
+        else:
+            write_barbs(magnitude, direction, geojsonfile)
+            if tiling.tippecanoe:
+                tiling.tile_file(geojsonfile, cached=False)
+        if product_key:
+            cache.store(product_key, product, model=model, var=f'windbarbs{level}', step=step)
 
 if __name__ == "__main__":
-    year, month, day, init, model, init_cond, model_file, geojson_path = sys.argv[1:9]
-    outdir = Path(f"{geojson_path}/{year}{month}{day}_{init}/{model}_{init_cond}")
+    parser = argparse.ArgumentParser(description="Write wind barb vector tiles (or GeoJSON) for a model NetCDF")
+    for name in ["year", "month", "day", "init", "model", "init_cond", "model_file", "geojson_path"]:
+        parser.add_argument(name)
+    parser.add_argument("--workers", type=int, default=14, help="worker processes")
+    parser.add_argument("--steps", type=int, default=41, help="process the first N steps")
+    parser.add_argument("--output", choices=["tiles", "geojson"], default="tiles",
+                        help="vector tiles directly, or GeoJSON for tippecanoe")
+    parser.add_argument("--cache", help="reuse wind barbs whose inputs are unchanged from (and add them to) this cache directory")
+    args = parser.parse_args()
+
+    output = args.output
+    cache.directory = args.cache
+    outdir = Path(f"{args.geojson_path}/{args.year}{args.month}{args.day}_{args.init}/{args.model}_{args.init_cond}")
     outdir.mkdir(parents=True, exist_ok=True)
 
-    data = xr.open_dataset(model_file)
-    uwinds = data['u'][:,:,::10,::10]
-    vwinds = data['v'][:,:,::10,::10]
-    uwinds10 = data['u10'][:,::10,::10]
-    vwinds10 = data['v10'][:,::10,::10]
-
-    longitudes = data['longitude'].values[::10]
-    latitudes = data['latitude'].values[::10]
-    
-    magnitude = np.sqrt(uwinds**2 + vwinds**2)*1.94384
-    direction = (np.arctan2(vwinds, uwinds) * 180 / np.pi + 360) % 360
-    magnitude10 = np.sqrt(uwinds10**2 + vwinds10**2)*1.94384
-    direction10 = (np.arctan2(vwinds10, uwinds10) * 180 / np.pi + 360) % 360
-
-    magnitude = np.nan_to_num(magnitude, nan=0.0, posinf=0.0, neginf = 0.0)
-    direction = np.nan_to_num(direction, nan=0.0, posinf=0.0, neginf = 0.0)
-    magnitude10 = np.nan_to_num(magnitude10, nan=0.0, posinf=0.0, neginf=0.0)
-    direction10 = np.nan_to_num(direction10, nan=0.0, posinf=0.0, neginf=0.0)
-    
-    with Pool(processes=14) as pool:
-        pool.map(run_processor, range(0,41))
+    failed = run_tasks(run_task, barb_tasks((args.model, args.init_cond, args.model_file, outdir), range(args.steps)),
+                       args.workers, name=task_name)
+    if failed:
+        logging.error(f"{len(failed)} wind barb files failed: {' '.join(failed)}")
+        sys.exit(1)